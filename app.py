@@ -143,6 +143,7 @@ def main():
             if st.button("退出系统", key="logout_button", type="secondary", use_container_width=True):
                 st.session_state.logged_in = False
                 st.session_state.is_admin = False
+                st.session_state.pop('profile', None)
                 st.rerun()
     else:
         page = "登录/注册"
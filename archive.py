@@ -0,0 +1,413 @@
+"""锻炼记录冷数据归档
+
+锻炼记录表只增不减，而页面查询几乎只访问最近的数据。ARCHIVE_AFTER_DAYS 天前所在月份之前的记录
+按月移出数据库，写入 ARCHIVE_DIR/month=YYYY-MM/part-*.parquet；设置 ARCHIVE_USER_BUCKETS 时
+再按用户ID哈希分到 bucket=NN 子目录。文件清单和每月的记录数、时长、卡路里汇总保留在数据库中，
+用户每日汇总和全站活动立方体中这些月份的行保持不变，统计页面和排名不受归档影响。
+归档记录的导入键保留在 archived_import_keys 表中，重复导入同一文件时不会再次写入已归档的记录。
+
+归档时先在写事务之外写文件，只在核对、登记文件和删除记录时短暂持有写锁。
+
+训练和导出等需要完整历史的功能通过 scan_records 读取归档和库内记录：库内记录按记录ID分页，
+每页各用一个短读事务，扫描期间并发的归档不会造成重复或遗漏。只读取需要的列，先按月份、
+用户桶和记录ID范围跳过无关文件，其余条件下推到 Parquet 行组的统计信息，文件通过内存映射读取。
+"""
+import operator
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+from database import get_db_connection, read_sql_chunks, _bump_write_generations
+from config import (
+    ARCHIVE_DIR, ARCHIVE_AFTER_DAYS, ARCHIVE_USER_BUCKETS, ARCHIVE_CHUNK_SIZE, SCAN_BATCH_SIZE,
+    DEFAULT_CALORIES, RANDOM_RECORD_NOTE
+)
+
+# 归档文件的列及其类型，与锻炼记录表一致
+ARCHIVE_SCHEMA = pa.schema([
+    ('record_id', pa.int64()),
+    ('user_id', pa.string()),
+    ('date', pa.string()),
+    ('exercise_type', pa.string()),
+    ('duration', pa.int64()),
+    ('intensity', pa.string()),
+    ('calories_burned', pa.float64()),
+    ('calories_estimated', pa.int64()),
+    ('notes', pa.string()),
+    ('import_key', pa.string())
+])
+
+# 扫描条件支持的运算符；is not 把空值视为不相等，与SQL的 IS NOT 一致
+SQL_OPERATORS = {'=': '=', '!=': '<>', '<': '<', '<=': '<=', '>': '>', '>=': '>=', 'is not': 'IS NOT'}
+ARROW_OPERATORS = {
+    '=': operator.eq, '!=': operator.ne, '<': operator.lt,
+    '<=': operator.le, '>': operator.gt, '>=': operator.ge
+}
+
+# 训练数据不包含估算值和回填候选记录中不可信的卡路里
+TRAINING_FILTERS = [
+    ('calories_estimated', '=', 0),
+    ('calories_burned', '!=', DEFAULT_CALORIES),
+    ('notes', 'is not', RANDOM_RECORD_NOTE)
+]
+
+_filesystem = fs.LocalFileSystem(use_mmap=True)
+
+# 写文件期间记录持续变化时最多尝试归档的次数
+ARCHIVE_ATTEMPTS = 3
+
+def _select_list(columns):
+    """查询的列，日期统一按文本读取"""
+    return ', '.join('CAST(date AS TEXT) AS date' if column == 'date' else column for column in columns)
+
+def user_bucket(user_id, buckets):
+    """用户所在的归档桶，使用跨进程稳定的CRC32哈希"""
+    return zlib.crc32(str(user_id).encode()) % buckets
+
+def _normalize_filters(filters):
+    """检查扫描条件，日期统一转为字符串比较"""
+    normalized = []
+    for column, op, value in filters:
+        if column not in ARCHIVE_SCHEMA.names:
+            raise ValueError(f"未知的列：{column}")
+        if op != 'in' and op not in SQL_OPERATORS:
+            raise ValueError(f"不支持的运算符：{op}")
+        if column == 'date' and value is not None:
+            value = [str(v) for v in value] if op == 'in' else str(value)
+        normalized.append((column, op, value))
+    return normalized
+
+def _sql_where(filters):
+    """把扫描条件转换为SQL的WHERE子句和参数"""
+    conditions = []
+    params = []
+    for column, op, value in filters:
+        if op == 'in':
+            conditions.append(f"{column} IN ({','.join('?' * len(value))})")
+            params.extend(value)
+        else:
+            conditions.append(f"{column} {SQL_OPERATORS[op]} ?")
+            params.append(value)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ''), params
+
+def _arrow_filter(filters):
+    """把扫描条件转换为 pyarrow 表达式，用于行组统计信息过滤和逐行过滤"""
+    expression = None
+    for column, op, value in filters:
+        field = ds.field(column)
+        if op == 'in':
+            condition = field.isin(list(value))
+        elif op == 'is not' and value is None:
+            condition = field.is_valid()
+        elif op == 'is not':
+            condition = (field != value) | field.is_null()
+        else:
+            condition = ARROW_OPERATORS[op](field, value)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def _select_files(conn, filters):
+    """按月份、记录ID范围和用户桶筛选可能包含符合条件记录的归档文件"""
+    conditions = []
+    params = []
+    users = None
+    for column, op, value in filters:
+        if column == 'date' and op in ('=', '>', '>='):
+            conditions.append('month >= ?')
+            params.append(value[:7])
+        if column == 'date' and op in ('=', '<', '<='):
+            conditions.append('month <= ?')
+            params.append(value[:7])
+        if column == 'record_id' and op in ('=', '>', '>='):
+            conditions.append(f"max_record_id {'>=' if op == '=' else op} ?")
+            params.append(value)
+        if column == 'record_id' and op in ('=', '<', '<='):
+            conditions.append(f"min_record_id {'<=' if op == '=' else op} ?")
+            params.append(value)
+        if column == 'user_id' and op in ('=', 'in'):
+            users = [value] if op == '=' else list(value)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    rows = conn.execute(f'SELECT path, bucket, buckets FROM archive_files {where} ORDER BY path', params)
+    return [
+        row['path'] for row in rows
+        if users is None or row['bucket'] is None
+        or any(user_bucket(user_id, row['buckets']) == row['bucket'] for user_id in users)
+    ]
+
+def _read_files(paths, columns, filters, batch_size):
+    """分批读取归档文件中符合条件的记录"""
+    if not paths:
+        return
+    dataset = ds.dataset(
+        [str(ARCHIVE_DIR / path) for path in paths],
+        schema=ARCHIVE_SCHEMA, format='parquet', filesystem=_filesystem
+    )
+    for batch in dataset.to_batches(columns=columns, filter=_arrow_filter(filters), batch_size=batch_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+def scan_batches(columns=None, filters=(), batch_size=SCAN_BATCH_SIZE):
+    """分批读取归档和库内的锻炼记录，逐批返回数据帧
+
+    columns 为需要的列，默认全部；filters 为 (列, 运算符, 值) 条件的列表，各条件同时成立。
+    运算符支持 =、!=、<、<=、>、>=、in 和 is not。先返回已归档的记录，再按记录ID分页返回库内记录。
+    扫描开始后新增的记录不会返回。
+
+    每页在单独的短读事务中读取，两次产出之间不保持事务，调用方提前停止迭代也不会占用读快照。
+    读取某页时发现扫描期间新归档的文件，先从文件中读出记录ID大于已读位置的记录，这些记录已不在库内。
+    """
+    columns = list(columns or ARCHIVE_SCHEMA.names)
+    for column in columns:
+        if column not in ARCHIVE_SCHEMA.names:
+            raise ValueError(f"未知的列：{column}")
+    filters = _normalize_filters(filters)
+    where, params = _sql_where(filters)
+    where = f"{where} AND" if where else 'WHERE'
+    # 分页需要记录ID，返回前去掉调用方未要求的列
+    read_columns = columns if 'record_id' in columns else [*columns, 'record_id']
+    
+    with get_db_connection() as conn:
+        # 在同一个读事务中确定文件清单和库内最大记录ID
+        if not conn.in_transaction:
+            conn.execute('BEGIN')
+        files = _select_files(conn, filters)
+        max_record_id = conn.execute('SELECT COALESCE(MAX(record_id), 0) FROM exercise_records').fetchone()[0]
+    yield from _read_files(files, columns, filters, batch_size)
+    
+    seen = set(files)
+    last_record_id = 0
+    while True:
+        with get_db_connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            moved = [path for path in _select_files(conn, filters) if path not in seen]
+            page = pd.read_sql_query(f'''
+                SELECT {_select_list(read_columns)} FROM exercise_records
+                {where} record_id > ? AND record_id <= ?
+                ORDER BY record_id
+                LIMIT ?
+            ''', conn, params=[*params, last_record_id, max_record_id, batch_size])
+        
+        if moved:
+            seen.update(moved)
+            yield from _read_files(moved, columns, [
+                *filters, ('record_id', '>', last_record_id), ('record_id', '<=', max_record_id)
+            ], batch_size)
+        # 没有库内记录时也返回一个空数据帧，调用方据此得到列名
+        if len(page) or not last_record_id:
+            yield page[columns]
+        if len(page) < batch_size:
+            break
+        last_record_id = int(page['record_id'].iloc[-1])
+
+def scan_records(columns=None, filters=()):
+    """读取归档和库内符合条件的锻炼记录，参数同 scan_batches"""
+    frames = list(scan_batches(columns, filters))
+    return pd.concat([frame for frame in frames if len(frame)] or frames[-1:], ignore_index=True)
+
+def load_training_data(after_record_id=0):
+    """获取训练卡路里模型所需的记录和用户特征，只包含记录ID大于 after_record_id 的记录"""
+    records = scan_records(
+        ['record_id', 'user_id', 'duration', 'intensity', 'calories_burned'],
+        [('record_id', '>', after_record_id), *TRAINING_FILTERS]
+    )
+    with get_db_connection() as conn:
+        users = pd.read_sql_query('SELECT user_id, age, gender FROM users', conn)
+    return records.merge(users, on='user_id').drop(columns='user_id')
+
+def archivable_months(older_than_days=ARCHIVE_AFTER_DAYS):
+    """库内仍有记录、且早于 older_than_days 天前所在月份的月份列表"""
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime('%Y-%m-01')
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT DISTINCT substr(CAST(date AS TEXT), 1, 7) AS month
+            FROM exercise_records
+            WHERE date < ?
+            ORDER BY month
+        ''', (cutoff,)).fetchall()
+    return [row['month'] for row in rows]
+
+class _RecordsChanged(Exception):
+    """写文件期间待归档的记录发生了变化"""
+
+def archive_month(month, user_buckets=ARCHIVE_USER_BUCKETS, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """把一个月的锻炼记录写成Parquet文件并从数据库删除，返回归档统计，没有记录时返回 None
+
+    先在写事务之外把记录ID不超过当时最大值的记录写成临时文件，写文件期间不阻塞其他写入。
+    随后在短暂的写事务中核对这些记录的条数和时长、卡路里、估算标记的合计与文件一致，再登记文件并删除记录。
+    SQLite 的 BEGIN IMMEDIATE 即阻塞其他写入；PostgreSQL 中它只是咨询锁，需另外锁住锻炼记录表。
+    核对不一致时（期间有记录被回填卡路里，或 PostgreSQL 中记录ID较小的事务较晚提交）丢弃文件重试，
+    最多 ARCHIVE_ATTEMPTS 次。
+    """
+    for _ in range(ARCHIVE_ATTEMPTS):
+        try:
+            return _archive_month_once(month, user_buckets, chunk_size)
+        except _RecordsChanged:
+            continue
+    raise RuntimeError(f"{month} 的记录在归档期间不断变化，请稍后重试")
+
+def _archive_month_once(month, user_buckets, chunk_size):
+    """执行一次归档，写文件期间记录发生变化时抛出 _RecordsChanged"""
+    year, number = map(int, month.split('-'))
+    start = f"{month}-01"
+    end = f"{year + number // 12:04d}-{number % 12 + 1:02d}-01"
+    name = f"part-{uuid.uuid4().hex}.parquet"
+    
+    with get_db_connection() as conn:
+        max_record_id = conn.execute(
+            'SELECT MAX(record_id) FROM exercise_records WHERE date >= ? AND date < ?', (start, end)
+        ).fetchone()[0]
+    if max_record_id is None:
+        return None
+    
+    writers = {}
+    files = {}
+    totals = {'records': 0, 'duration': 0, 'calories': 0.0, 'estimated': 0}
+    user_ids = set()
+    try:
+        with get_db_connection() as conn:
+            chunks = read_sql_chunks(f'''
+                SELECT {_select_list(ARCHIVE_SCHEMA.names)}
+                FROM exercise_records
+                WHERE date >= ? AND date < ? AND record_id <= ?
+                ORDER BY exercise_records.date
+            ''', conn, params=(start, end, max_record_id), chunksize=chunk_size)
+            for chunk in chunks:
+                if chunk.empty:
+                    continue
+                if user_buckets:
+                    parts = chunk.groupby(chunk['user_id'].map(lambda user_id: user_bucket(user_id, user_buckets)))
+                else:
+                    parts = [(None, chunk)]
+                for bucket, part in parts:
+                    if bucket not in writers:
+                        directory = ARCHIVE_DIR / f"month={month}"
+                        if bucket is not None:
+                            directory = directory / f"bucket={bucket:02d}"
+                        directory.mkdir(parents=True, exist_ok=True)
+                        files[bucket] = {
+                            'temp': directory / f".{name}.tmp",
+                            'path': directory / name,
+                            'records': 0,
+                            'min_record_id': int(part['record_id'].min()),
+                            'max_record_id': int(part['record_id'].max())
+                        }
+                        writers[bucket] = pq.ParquetWriter(files[bucket]['temp'], ARCHIVE_SCHEMA, compression='zstd')
+                    # 每块写成一个行组，行组按日期有序，日期条件可以跳过无关行组
+                    writers[bucket].write_table(pa.Table.from_pandas(part, schema=ARCHIVE_SCHEMA, preserve_index=False))
+                    info = files[bucket]
+                    info['records'] += len(part)
+                    info['min_record_id'] = min(info['min_record_id'], int(part['record_id'].min()))
+                    info['max_record_id'] = max(info['max_record_id'], int(part['record_id'].max()))
+                
+                totals['records'] += len(chunk)
+                totals['duration'] += int(chunk['duration'].fillna(0).sum())
+                totals['calories'] += float(chunk['calories_burned'].fillna(0).sum())
+                totals['estimated'] += int(chunk['calories_estimated'].fillna(0).sum())
+                user_ids.update(chunk['user_id'].dropna())
+        
+        for writer in writers.values():
+            writer.close()
+        writers.clear()
+        if not files:
+            return None
+        
+        with get_db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if getattr(conn, 'dialect', 'sqlite') == 'postgresql':
+                # 阻塞新增、修改和删除，核对之后提交的记录不会未写入文件就被删除
+                conn.execute('LOCK TABLE exercise_records IN SHARE ROW EXCLUSIVE MODE')
+            records, duration, calories, estimated = conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(duration), 0), COALESCE(SUM(calories_burned), 0),
+                       COALESCE(SUM(calories_estimated), 0)
+                FROM exercise_records
+                WHERE date >= ? AND date < ? AND record_id <= ?
+            ''', (start, end, max_record_id)).fetchone()
+            if (
+                (records, duration, estimated) != (totals['records'], totals['duration'], totals['estimated'])
+                or abs(calories - totals['calories']) > 1e-6 * max(1.0, abs(totals['calories']))
+            ):
+                raise _RecordsChanged()
+            
+            for info in files.values():
+                info['temp'].replace(info['path'])
+                info['bytes'] = info['path'].stat().st_size
+            conn.executemany('''
+                INSERT INTO archive_files (path, month, bucket, buckets, records, min_record_id, max_record_id, bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(
+                info['path'].relative_to(ARCHIVE_DIR).as_posix(), month,
+                None if bucket is None else int(bucket), user_buckets or None,
+                info['records'], info['min_record_id'], info['max_record_id'], info['bytes']
+            ) for bucket, info in files.items()])
+            
+            archived_bytes = sum(info['bytes'] for info in files.values())
+            conn.execute('''
+                INSERT INTO archive_months (month, records, duration, calories, files, bytes)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (month) DO UPDATE SET
+                    records = archive_months.records + excluded.records,
+                    duration = archive_months.duration + excluded.duration,
+                    calories = archive_months.calories + excluded.calories,
+                    files = archive_months.files + excluded.files,
+                    bytes = archive_months.bytes + excluded.bytes,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (month, totals['records'], totals['duration'], totals['calories'], len(files), archived_bytes))
+            # 只删除写入了文件的记录，导入键留在库中供重复导入时去重
+            conn.execute('''
+                INSERT INTO archived_import_keys (user_id, import_key)
+                SELECT user_id, import_key FROM exercise_records
+                WHERE date >= ? AND date < ? AND record_id <= ?
+                  AND user_id IS NOT NULL AND import_key IS NOT NULL
+                ON CONFLICT (user_id, import_key) DO NOTHING
+            ''', (start, end, max_record_id))
+            conn.execute(
+                'DELETE FROM exercise_records WHERE date >= ? AND date < ? AND record_id <= ?',
+                (start, end, max_record_id)
+            )
+            # 最近记录等按用户缓存的结果可能包含被归档的记录
+            _bump_write_generations(conn, user_ids)
+    except BaseException:
+        for writer in writers.values():
+            writer.close()
+        for info in files.values():
+            info['temp'].unlink(missing_ok=True)
+            info['path'].unlink(missing_ok=True)
+        raise
+    
+    return {'month': month, 'records': totals['records'], 'files': len(files), 'bytes': archived_bytes}
+
+def archive_records(older_than_days=ARCHIVE_AFTER_DAYS, user_buckets=ARCHIVE_USER_BUCKETS,
+                    chunk_size=ARCHIVE_CHUNK_SIZE, progress=None):
+    """按月归档 older_than_days 天前所在月份之前的记录，返回归档统计
+
+    统计包括月份数、记录数、文件数、文件字节数、耗时和每秒归档行数。
+    传入 progress 时每归档一个月后调用 progress(月份, 已归档记录数)。
+    """
+    report = {'months': 0, 'records': 0, 'files': 0, 'bytes': 0}
+    started = time.perf_counter()
+    for month in archivable_months(older_than_days):
+        result = archive_month(month, user_buckets, chunk_size)
+        if result is None:
+            continue
+        report['months'] += 1
+        for key in ('records', 'files', 'bytes'):
+            report[key] += result[key]
+        if progress is not None:
+            progress(month, report['records'])
+    
+    report['seconds'] = time.perf_counter() - started
+    report['rows_per_sec'] = report['records'] / report['seconds'] if report['seconds'] else 0.0
+    return report
+
+def get_archive_months():
+    """获取各归档月份的汇总，最近的月份在前"""
+    with get_db_connection() as conn:
+        rows = conn.execute('SELECT * FROM archive_months ORDER BY month DESC').fetchall()
+    return [dict(row) for row in rows]
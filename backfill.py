@@ -0,0 +1,90 @@
+"""批量回填锻炼记录的卡路里
+
+未填写卡路里、保留表单默认值或随机生成的记录会扭曲排名和统计。回填任务按记录ID
+键集分块读取这些记录，用最新发布的卡路里模型整块预测；模型无法处理的记录
+（没有模型、年龄或性别缺失）按运动类型和强度的代谢当量(MET)推算，没有时长的记录不回填。
+每块在一个事务中写回并修正每日汇总和全站活动立方体，内存占用只与块大小有关。
+回填后的记录标记为估算值，不再参与模型训练，也不会被再次回填。
+"""
+import time
+import numpy as np
+from database import load_calorie_candidates, apply_calorie_estimates
+from model import calorie_model, GENDER_CODES, INTENSITY_CODES
+from config import (
+    BACKFILL_CHUNK_SIZE, MET_TABLE, DEFAULT_MET, MET_REFERENCE_WEIGHT,
+    DEFAULT_REFERENCE_WEIGHT, INTENSITY_LEVELS
+)
+
+# 代谢当量矩阵：行为运动类型（最后一行为未知类型），列为强度
+EXERCISE_INDEX = {exercise_type: i for i, exercise_type in enumerate(MET_TABLE)}
+MET_MATRIX = np.array([*MET_TABLE.values(), DEFAULT_MET])
+INTENSITY_INDEX = {intensity: i for i, intensity in enumerate(INTENSITY_LEVELS)}
+
+def met_calories(chunk):
+    """按代谢当量 × 参考体重 × 小时数推算卡路里，未知强度按中等计算"""
+    exercise = chunk['exercise_type'].map(EXERCISE_INDEX).fillna(len(MET_TABLE)).to_numpy(dtype=int)
+    intensity = chunk['intensity'].map(INTENSITY_INDEX).fillna(INTENSITY_INDEX["中"]).to_numpy(dtype=int)
+    weight = chunk['gender'].map(MET_REFERENCE_WEIGHT).fillna(DEFAULT_REFERENCE_WEIGHT).to_numpy(dtype=float)
+    hours = chunk['duration'].to_numpy(dtype=float) / 60
+    return MET_MATRIX[exercise, intensity] * weight * hours
+
+def model_calories(model, chunk):
+    """用模型预测整块记录的卡路里，无法编码特征的记录为 NaN"""
+    X = np.column_stack([
+        chunk['age'].to_numpy(dtype=float),
+        chunk['gender'].map(GENDER_CODES).to_numpy(dtype=float),
+        chunk['duration'].to_numpy(dtype=float),
+        chunk['intensity'].map(INTENSITY_CODES).to_numpy(dtype=float)
+    ])
+    predictions = np.full(len(chunk), np.nan)
+    valid = ~np.isnan(X).any(axis=1)
+    if valid.any():
+        predictions[valid] = model.predict(X[valid])
+    return predictions
+
+def backfill_calories(chunk_size=BACKFILL_CHUNK_SIZE, use_model=True, progress=None):
+    """回填全部候选记录的卡路里，返回处理统计
+
+    统计包括回填记录数、其中由模型和代谢当量估算的条数、块数、耗时和每秒处理行数。
+    传入 progress 时每块完成后调用 progress(已回填记录数)。
+    """
+    model = calorie_model.get()[1] if use_model else None
+    report = {'updated': 0, 'model': 0, 'met': 0, 'chunks': 0}
+    started = time.perf_counter()
+    last_id = 0
+    
+    while True:
+        chunk = load_calorie_candidates(last_id, chunk_size)
+        if chunk.empty:
+            break
+        last_id = int(chunk['record_id'].iloc[-1])
+        
+        estimates = model_calories(model, chunk) if model is not None else np.full(len(chunk), np.nan)
+        from_model = ~np.isnan(estimates)
+        estimates = np.where(from_model, estimates, met_calories(chunk))
+        estimates = np.rint(np.maximum(estimates, 0))
+        if not np.isfinite(estimates).all():
+            # NaN 会写入每日汇总和活动立方体的非空列
+            raise ValueError(f"记录 {chunk['record_id'].iloc[0]}-{last_id} 中有无法估算的卡路里")
+        
+        old = np.nan_to_num(chunk['calories_burned'].to_numpy(dtype=float))
+        apply_calorie_estimates(list(zip(
+            chunk['record_id'].tolist(),
+            chunk['user_id'].tolist(),
+            chunk['date'].tolist(),
+            chunk['exercise_type'].tolist(),
+            chunk['intensity'].tolist(),
+            old.tolist(),
+            estimates.tolist()
+        )))
+        
+        report['updated'] += len(chunk)
+        report['model'] += int(from_model.sum())
+        report['met'] += int((~from_model).sum())
+        report['chunks'] += 1
+        if progress is not None:
+            progress(report['updated'])
+    
+    report['seconds'] = time.perf_counter() - started
+    report['rows_per_sec'] = report['updated'] / report['seconds'] if report['seconds'] else 0.0
+    return report
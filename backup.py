@@ -0,0 +1,99 @@
+"""数据库在线备份
+
+使用 SQLite 备份接口分步复制数据库页，每步之间暂停片刻，备份期间页面请求和写入照常进行。
+源连接在整个备份期间持有一个读事务，复制的是备份开始时的WAL快照；
+否则其他连接的每次写入都会让备份从头开始，写入频繁时可能一直无法完成。
+备份先写入临时文件，通过 PRAGMA integrity_check 校验后再改为带时间戳的正式文件名，
+只保留最近 BACKUP_RETENTION 份。每次备份的状态、大小和耗时记录在 backup_runs 表中。
+"""
+import sqlite3
+import time
+from datetime import datetime
+from database import get_database_path, get_db_connection, get_dialect
+from config import BACKUP_DIR, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP, BACKUP_RETENTION
+
+BACKUP_PREFIX = "fitness_"
+
+def backup_database(pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP, progress=None):
+    """备份当前数据库，返回 backup_runs 中的记录
+
+    传入 progress 时每步复制后调用 progress(已复制页数, 总页数)。只支持SQLite。
+    """
+    if get_dialect() != 'sqlite':
+        raise RuntimeError("在线备份只支持SQLite，PostgreSQL 请使用 pg_dump 或流复制")
+    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+    target = BACKUP_DIR / f"{BACKUP_PREFIX}{datetime.now():%Y%m%d_%H%M%S}.db"
+    temp = target.with_suffix('.db.tmp')
+    
+    with get_db_connection() as conn:
+        run_id = conn.execute(
+            'INSERT INTO backup_runs (path) VALUES (?)', (target.name,)
+        ).lastrowid
+    
+    def report(status, remaining, total):
+        if progress is not None:
+            progress(total - remaining, total)
+        # sqlite3 的 sleep 参数只在遇到锁时生效，步间暂停在这里完成
+        if remaining:
+            time.sleep(sleep)
+    
+    try:
+        started = time.perf_counter()
+        source = sqlite3.connect(get_database_path(), isolation_level=None)
+        destination = sqlite3.connect(temp)
+        try:
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            source.backup(destination, pages=pages, progress=report, sleep=sleep)
+            source.execute('COMMIT')
+            page_count = destination.execute('PRAGMA page_count').fetchone()[0]
+            copy_seconds = time.perf_counter() - started
+            
+            started = time.perf_counter()
+            integrity = '; '.join(row[0] for row in destination.execute('PRAGMA integrity_check'))
+            verify_seconds = time.perf_counter() - started
+        finally:
+            destination.close()
+            source.close()
+        
+        if integrity != 'ok':
+            raise RuntimeError(f"备份文件校验失败：{integrity}")
+        temp.replace(target)
+        
+        _finish_run(
+            run_id, 'done', pages=page_count, bytes=target.stat().st_size,
+            copy_seconds=copy_seconds, verify_seconds=verify_seconds, integrity=integrity
+        )
+    except Exception as e:
+        temp.unlink(missing_ok=True)
+        _finish_run(run_id, 'failed', error=str(e))
+        raise
+    
+    prune_backups()
+    return get_backup_runs(1)[0]
+
+def _finish_run(run_id, status, **fields):
+    """记录备份的结束状态"""
+    assignments = ''.join(f", {name} = ?" for name in fields)
+    with get_db_connection() as conn:
+        conn.execute(f'''
+            UPDATE backup_runs SET status = ?, finished_at = CURRENT_TIMESTAMP{assignments}
+            WHERE run_id = ?
+        ''', (status, *fields.values(), run_id))
+
+def prune_backups(keep=BACKUP_RETENTION):
+    """删除超出保留份数的旧备份文件，返回删除的文件名"""
+    backups = sorted(BACKUP_DIR.glob(f"{BACKUP_PREFIX}*.db"), reverse=True)
+    removed = []
+    for path in backups[keep:]:
+        path.unlink()
+        removed.append(path.name)
+    return removed
+
+def get_backup_runs(limit=10):
+    """获取最近的备份记录"""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            'SELECT * FROM backup_runs ORDER BY run_id DESC LIMIT ?', (limit,)
+        ).fetchall()
+    return [dict(row) for row in rows]
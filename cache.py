@@ -0,0 +1,78 @@
+"""按写入代数失效的LRU缓存
+
+缓存项以 (命名空间, user_id) 为键，同时记录加载时的写入代数。
+用户每次写入都会使代数加一，读取时代数不一致即视为未命中，
+因此新记录只会使该用户的缓存失效。
+"""
+import threading
+from collections import OrderedDict
+from config import RECORD_CACHE_MAX_ENTRIES, RECORD_CACHE_MAX_BYTES
+
+def _frame_size(value):
+    """估算缓存值占用的字节数"""
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    return 0
+
+class GenerationCache:
+    """带条目数和内存上限的LRU缓存"""
+
+    def __init__(self, max_entries=RECORD_CACHE_MAX_ENTRIES, max_bytes=RECORD_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get_or_load(self, key, generation, loader):
+        """代数一致时返回缓存值，否则调用 loader 加载并缓存
+
+        返回的数据帧由所有会话共享，调用方不应原地修改。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+            self._stats['misses'] += 1
+        
+        value = loader()
+        size = _frame_size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if size <= self.max_bytes:
+                self._entries[key] = (generation, value, size)
+                self._bytes += size
+                self._evict()
+        return value
+
+    def _evict(self):
+        """淘汰最久未使用的条目直到满足上限"""
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._stats['evictions'] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """返回命中统计和占用情况"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else 0.0
+        return stats
+
+record_cache = GenerationCache()
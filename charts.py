@@ -0,0 +1,74 @@
+"""趋势图数据准备
+
+页面把完整的时间序列交给 Plotly 时，所有点都会序列化后发送到浏览器。折线图在绘制前用
+LTTB（Largest-Triangle-Three-Buckets）算法降采样到最多 CHART_MAX_POINTS 个点，保留峰谷形状；
+绘制的点数超过 CHART_WEBGL_THRESHOLD 时改用 WebGL 渲染。柱状图按周、月、季度、年逐级合并，
+直到柱数不超过 CHART_MAX_BARS。
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from config import CHART_MAX_POINTS, CHART_WEBGL_THRESHOLD, CHART_MAX_BARS
+
+# 柱状图依次尝试的合并周期及其名称
+BAR_PERIODS = [('W', "周"), ('M', "月"), ('Q', "季度"), ('Y', "年")]
+
+def lttb_indices(x, y, n_out):
+    """LTTB 降采样保留的点的下标，x 需按升序排列
+
+    首尾两点总是保留，中间的点均分为 n_out - 2 个桶，每个桶保留与上一个保留点和
+    下一个桶的平均点构成的三角形面积最大的点。
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    every = (n - 2) / (n_out - 2)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    a = 0
+    for i in range(n_out - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+        
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(areas.argmax())
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+def downsample(frame, x, y, max_points=CHART_MAX_POINTS):
+    """按 x 排序后把数据帧降采样到最多 max_points 行，x 为日期列"""
+    if len(frame) <= max_points:
+        return frame
+    frame = frame.sort_values(x)
+    xs = pd.to_datetime(frame[x]).to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(float)
+    ys = frame[y].to_numpy(dtype=float)
+    return frame.iloc[lttb_indices(xs, ys, max_points)]
+
+def line_chart(frame, x, y, title, max_points=CHART_MAX_POINTS):
+    """降采样后绘制折线图，返回图和实际绘制的点数"""
+    data = downsample(frame, x, y, max_points)
+    fig = px.line(
+        data, x=x, y=y, title=title,
+        render_mode='webgl' if len(data) > CHART_WEBGL_THRESHOLD else 'svg'
+    )
+    return fig, len(data)
+
+def bar_chart(frame, x, y, max_bars=CHART_MAX_BARS):
+    """按日期列 x 合并为柱数不超过 max_bars 的最短周期后绘制柱状图，返回图和周期名称"""
+    dates = pd.to_datetime(frame[x])
+    for period, name in BAR_PERIODS:
+        data = frame.groupby(dates.dt.to_period(period).dt.start_time)[y].sum()
+        if len(data) <= max_bars:
+            break
+    data = data.rename_axis(x).reset_index()
+    fig = px.bar(data, x=x, y=y)
+    return fig, name
@@ -1,74 +1,356 @@
+import re
 import sqlite3
+import threading
 import pandas as pd
-from datetime import datetime
-from config import DATABASE_PATH
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from migrations import migrate, intensity_load_sql, activity_cube_select
+from cache import record_cache
+from query_stats import InstrumentedConnection
+from config import (
+    DATABASE_BACKEND, DATABASE_URL, DATABASE_PATH, DB_POOL_SIZE, DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE_KB, DB_MMAP_SIZE, INTENSITY_CALORIES, QUERY_STATS_ENABLED,
+    DEFAULT_CALORIES, RANDOM_RECORD_NOTE
+)
+
+class ConnectionPool:
+    """进程级SQLite连接池
+
+    同一线程内嵌套获取时复用已借出的连接，归还的连接放入空闲列表供其他线程复用。
+    """
+    
+    dialect = 'sqlite'
+    
+    def __init__(self, database, max_idle=DB_POOL_SIZE):
+        self.database = database
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._trace_callback = None
+        self._stats = {
+            'checkouts': 0,
+            'reused': 0,
+            'nested': 0,
+            'created': 0,
+            'closed': 0,
+            'in_use': 0
+        }
+    
+    def _connect(self):
+        """创建新连接并设置性能相关的PRAGMA"""
+        conn = sqlite3.connect(
+            self.database,
+            timeout=DB_BUSY_TIMEOUT / 1000,
+            check_same_thread=False,
+            factory=InstrumentedConnection if QUERY_STATS_ENABLED else sqlite3.Connection
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.set_trace_callback(self._trace_callback)
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """借出连接，正常退出时提交，异常时回滚"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            # 同一线程嵌套调用，直接复用外层连接，由外层负责提交
+            with self._lock:
+                self._stats['nested'] += 1
+            yield held
+            return
+        
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self._stats['reused'] += 1
+        
+        try:
+            if conn is None:
+                conn = self._connect()
+                with self._lock:
+                    self._stats['created'] += 1
+        except Exception:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            raise
+        
+        self._local.conn = conn
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._release(conn)
+    
+    def _release(self, conn):
+        """归还连接，超过空闲上限时直接关闭"""
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._stats['closed'] += 1
+        conn.close()
+    
+    def set_trace_callback(self, callback):
+        """为已有和之后创建的连接设置SQL语句跟踪回调，传入 None 取消"""
+        with self._lock:
+            self._trace_callback = callback
+            for conn in self._idle:
+                conn.set_trace_callback(callback)
+    
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._stats['closed'] += len(idle)
+        for conn in idle:
+            conn.close()
+    
+    def stats(self):
+        """返回连接池统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['max_idle'] = self.max_idle
+        return stats
+
+def _create_pool(database):
+    """按数据库地址创建连接池，postgresql:// 开头的地址使用PostgreSQL，其余视为SQLite文件路径"""
+    if str(database).startswith(('postgresql://', 'postgresql+psycopg2://', 'postgres://')):
+        # 只有使用PostgreSQL时才需要 SQLAlchemy 和 psycopg2
+        from pg_backend import PostgresPool
+        return PostgresPool(str(database))
+    return ConnectionPool(database)
+
+_pool = _create_pool(DATABASE_URL if DATABASE_BACKEND == 'postgresql' else DATABASE_PATH)
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+def use_database(path):
+    """切换当前进程使用的数据库文件或PostgreSQL地址，供命令行工具、训练进程和基准测试使用"""
+    global _pool, _schema_ready
+    old_pool = _pool
+    with _schema_lock:
+        _pool = _create_pool(path)
+        _schema_ready = False
+    old_pool.close_all()
+    record_cache.clear()
+
+def get_database_path():
+    """获取当前进程使用的数据库文件路径或PostgreSQL地址"""
+    return _pool.database
+
+def get_dialect():
+    """当前数据库的方言：sqlite 或 postgresql"""
+    return _pool.dialect
 
 def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """从连接池借出数据库连接，需配合with语句使用"""
+    return _pool.connection()
+
+def get_pool_stats():
+    """获取连接池统计信息"""
+    return _pool.stats()
+
+def set_trace_callback(callback):
+    """为连接池中的连接设置SQL语句跟踪回调"""
+    _pool.set_trace_callback(callback)
+
+def read_sql_chunks(sql, conn, params=(), chunksize=None):
+    """按块读取查询结果为数据帧，PostgreSQL 使用服务端游标，不会一次读入全部结果"""
+    if getattr(conn, 'dialect', 'sqlite') != 'postgresql':
+        return pd.read_sql_query(sql, conn, params=params, chunksize=chunksize)
+    # pandas 在调用时即执行查询，只需在调用期间创建服务端游标
+    with conn.stream_results():
+        return pd.read_sql_query(sql, conn, params=params, chunksize=chunksize)
+
+# 页面热点查询
+USER_PROFILE_SQL = 'SELECT * FROM users WHERE user_id = ?'
+
+USER_LATEST_RECORDS_SQL = '''
+    SELECT * FROM exercise_records 
+    WHERE user_id = ? 
+    ORDER BY date DESC
+    LIMIT ?
+'''
+
+WRITE_GENERATION_SQL = 'SELECT generation FROM user_write_generations WHERE user_id = ?'
+
+USER_DAILY_STATS_SQL = '''
+    SELECT day, exercise_type, workouts, duration, calories
+    FROM user_daily_stats
+    WHERE user_id = ?
+    ORDER BY day
+'''
+
+USER_LOAD_SCORE_SQL = '''
+    SELECT COALESCE(SUM(workouts), 0) AS workouts,
+           COALESCE(SUM(duration), 0) AS duration,
+           COALESCE(SUM(intensity_load), 0) AS total_load
+    FROM user_daily_stats
+    WHERE user_id = ? AND day >= ?
+'''
+
+# 全站活动立方体可用的分组维度
+ACTIVITY_DIMENSIONS = ['exercise_type', 'intensity', 'gender']
+
+def daily_activity_sql(dimension='exercise_type'):
+    """按日期和指定维度汇总全站活动立方体的查询"""
+    if dimension not in ACTIVITY_DIMENSIONS:
+        raise ValueError(f"未知的统计维度：{dimension}")
+    return f'''
+        SELECT day AS date, {dimension}, SUM(workouts) AS count,
+               SUM(duration) AS duration, SUM(calories) AS calories
+        FROM daily_activity_cube
+        WHERE day BETWEEN ? AND ?
+        GROUP BY day, {dimension}
+        ORDER BY day, {dimension}
+    '''
+
+# 用户健身评分排名：窗口内总时长和总卡路里各按最高者归一化后各占一半。
+# 汇总按日期索引只读取窗口内的行，避免按主键顺序扫描全表
+LEADERBOARD_SQL = '''
+    WITH totals AS (
+        SELECT user_id, SUM(duration) AS duration, SUM(calories) AS calories
+        FROM user_daily_stats INDEXED BY idx_user_daily_stats_day
+        WHERE day >= ?
+        GROUP BY user_id
+    ),
+    scored AS (
+        SELECT user_id, duration, calories,
+               COALESCE(duration * 0.5 / NULLIF(MAX(duration) OVER (), 0), 0)
+             + COALESCE(calories * 0.5 / NULLIF(MAX(calories) OVER (), 0), 0) AS score
+        FROM totals
+    )
+    SELECT RANK() OVER (ORDER BY scored.score DESC) AS rank,
+           u.username, scored.duration, scored.calories AS calories_burned, scored.score
+    FROM scored
+    JOIN users u ON u.user_id = scored.user_id
+    ORDER BY scored.score DESC
+    LIMIT ?
+'''
+
+# 按记录ID键集分块读取需要回填卡路里的记录：未填写、表单默认值或随机生成的记录
+# 没有时长的记录无法推算卡路里，不参与回填
+CALORIE_CANDIDATES_SQL = f'''
+    SELECT er.record_id, er.user_id, er.date, er.exercise_type, er.duration, er.intensity,
+           er.calories_burned, u.age, u.gender
+    FROM exercise_records er
+    JOIN users u ON er.user_id = u.user_id
+    WHERE er.record_id > ? AND er.calories_estimated = 0 AND er.duration IS NOT NULL
+      AND (er.calories_burned IS NULL
+           OR er.calories_burned = {DEFAULT_CALORIES}
+           OR er.notes = '{RANDOM_RECORD_NOTE}')
+    ORDER BY er.record_id
+    LIMIT ?
+'''
+
+# 按用户名键集分页，先沿用户名索引取出当前页的用户，再只聚合这些用户的汇总。
+# 锻炼汇总取自每日汇总表，已归档月份的记录同样计入
+USER_PAGE_SQL = '''
+    WITH page AS (
+        SELECT user_id, username, age, gender, fitness_goal, created_at
+        FROM users
+        WHERE username > ? AND instr(username, ?) > 0
+        ORDER BY username
+        LIMIT ?
+    )
+    SELECT page.user_id, page.username, page.age, page.gender, page.fitness_goal, page.created_at,
+           COALESCE(SUM(s.workouts), 0) AS record_count,
+           MAX(s.day) AS last_exercise,
+           COALESCE(SUM(s.duration), 0) AS total_duration
+    FROM page
+    LEFT JOIN user_daily_stats s ON s.user_id = page.user_id
+    GROUP BY page.username, page.user_id, page.age, page.gender, page.fitness_goal, page.created_at
+    ORDER BY page.username
+'''
+
+# 需要检查执行计划的热点查询：名称 -> (SQL, 示例参数)
+HOT_QUERIES = {
+    'user_profile': (USER_PROFILE_SQL, ('',)),
+    'user_latest_records': (USER_LATEST_RECORDS_SQL, ('', 5)),
+    'user_daily_stats': (USER_DAILY_STATS_SQL, ('',)),
+    'write_generation': (WRITE_GENERATION_SQL, ('',)),
+    'user_load_score': (USER_LOAD_SCORE_SQL, ('', '1970-01-01')),
+    'daily_activity': (daily_activity_sql(), ('1970-01-01', '9999-12-31')),
+    'leaderboard': (LEADERBOARD_SQL, ('1970-01-01', 3)),
+    'user_page': (USER_PAGE_SQL, ('', '', 20)),
+}
+
+def explain_query(conn, sql, params=()):
+    """返回查询执行计划的描述列表"""
+    rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    return [row['detail'] for row in rows]
+
+_CTE_NAME = re.compile(r'(\w+)\s+AS\s*\(', re.IGNORECASE)
+
+def check_query_plans():
+    """检查所有热点查询的执行计划，出现全表扫描时抛出异常
+
+    扫描子查询或 WITH 子句中间结果的步骤不算全表扫描。只支持SQLite。
+    """
+    if get_dialect() != 'sqlite':
+        raise RuntimeError("执行计划检查只支持SQLite")
+    plans = {}
+    failures = []
+    with get_db_connection() as conn:
+        for name, (sql, params) in HOT_QUERIES.items():
+            plan = explain_query(conn, sql, params)
+            plans[name] = plan
+            intermediates = set(_CTE_NAME.findall(sql))
+            scans = [
+                step for step in plan
+                if step.startswith('SCAN')
+                and not step.startswith('SCAN (')
+                and step.split()[1] not in intermediates
+            ]
+            if scans:
+                failures.append(f"{name}: {'; '.join(scans)}")
+    
+    if failures:
+        raise RuntimeError("热点查询出现全表扫描：\n" + "\n".join(failures))
+    return plans
 
 def init_database():
-    """初始化数据库"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    # 创建用户表
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            age INTEGER,
-            gender TEXT,
-            fitness_goal TEXT,
-            preferred_exercise TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # 创建锻炼记录表
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS exercise_records (
-            record_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            exercise_type TEXT,
-            duration INTEGER,
-            intensity TEXT,
-            calories_burned FLOAT,
-            notes TEXT,
-            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    # 创建用户设置表
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS user_settings (
-            user_id TEXT PRIMARY KEY,
-            daily_exercise_goal INTEGER,
-            weekly_exercise_goal INTEGER,
-            reminder_time TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
+    """初始化数据库，每个进程只执行一次结构迁移"""
+    global _schema_ready
+    if _schema_ready:
+        return
     
-    conn.commit()
-    conn.close()
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with get_db_connection() as conn:
+            migrate(conn)
+        _schema_ready = True
 
 def add_user(user_data):
-    """添加新用户"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    try:
+    """添加新用户，用户名已存在时不写入并返回 False"""
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        
+        # 由唯一约束判断用户名是否已存在，不必先查询再插入
         c.execute('''
             INSERT INTO users (
                 user_id, username, password, age, 
                 gender, fitness_goal, preferred_exercise
             )
             VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (username) DO NOTHING
         ''', (
             user_data['user_id'],
             user_data['username'],
@@ -78,6 +360,8 @@ def add_user(user_data):
             user_data['fitness_goal'],
             user_data['preferred_exercise']
         ))
+        if c.rowcount == 0:
+            return False
         
         # 初始化用户设置
         c.execute('''
@@ -92,32 +376,385 @@ def add_user(user_data):
             3,   # 默认每周运动3次
             "08:00"
         ))
-        
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    
+    return True
 
 def get_user(username):
     """获取用户信息"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute('SELECT * FROM users WHERE username = ?', (username,))
-    user = c.fetchone()
+    with get_db_connection() as conn:
+        user = conn.execute(
+            'SELECT * FROM users WHERE username = ?', (username,)
+        ).fetchone()
     
-    conn.close()
     return user if user else None
 
 def get_user_by_id(user_id):
     """通过ID获取用户信息"""
-    conn = get_db_connection()
-    c = conn.cursor()
+    with get_db_connection() as conn:
+        user = conn.execute(
+            'SELECT * FROM users WHERE user_id = ?', (user_id,)
+        ).fetchone()
+    
+    return user if user else None
+
+def add_exercise_records(records):
+    """批量添加锻炼记录，并在同一事务中更新用户每日汇总
+
+    带 import_key 的记录按 (user_id, import_key) 去重，已导入过的会被跳过。
+    返回实际写入的记录数。
+    """
+    with get_db_connection() as conn:
+        records = _skip_imported(conn, records)
+        if not records:
+            return 0
+        
+        conn.executemany('''
+            INSERT INTO exercise_records 
+            (user_id, exercise_type, duration, intensity, calories_burned, notes, date, import_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            record['user_id'],
+            record['exercise_type'],
+            record['duration'],
+            record['intensity'],
+            record['calories_burned'],
+            record['notes'],
+            record['date'],
+            record.get('import_key')
+        ) for record in records])
+        _update_daily_stats(conn, records)
+        _update_activity_cube(conn, records)
+        _bump_write_generations(conn, {record['user_id'] for record in records})
     
-    c.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    user = c.fetchone()
+    return len(records)
+
+def _skip_imported(conn, records):
+    """去掉批次内重复以及库内或已归档记录中已存在导入键的记录"""
+    keyed = {}
+    for record in records:
+        if record.get('import_key') is not None:
+            keyed.setdefault(record['user_id'], set()).add(record['import_key'])
+    if not keyed:
+        return records
+    
+    existing = set()
+    for user_id, keys in keyed.items():
+        keys = list(keys)
+        # 分段查询，避免超过SQLite的参数个数上限
+        for start in range(0, len(keys), 400):
+            chunk = keys[start:start + 400]
+            placeholders = ','.join('?' * len(chunk))
+            existing.update(
+                (user_id, row['import_key']) for row in conn.execute(
+                    f'''
+                    SELECT import_key FROM exercise_records
+                    WHERE user_id = ? AND import_key IN ({placeholders})
+                    UNION ALL
+                    SELECT import_key FROM archived_import_keys
+                    WHERE user_id = ? AND import_key IN ({placeholders})
+                    ''', (user_id, *chunk, user_id, *chunk)
+                )
+            )
+    
+    kept = []
+    for record in records:
+        key = record.get('import_key')
+        if key is not None:
+            if (record['user_id'], key) in existing:
+                continue
+            existing.add((record['user_id'], key))
+        kept.append(record)
+    return kept
+
+def _update_daily_stats(conn, records):
+    """把一批新记录累加到用户每日汇总表"""
+    totals = {}
+    for record in records:
+        key = (record['user_id'], str(record['date'])[:10], record['exercise_type'])
+        workouts, duration, calories, load = totals.get(key, (0, 0, 0, 0))
+        totals[key] = (
+            workouts + 1,
+            duration + (record['duration'] or 0),
+            calories + (record['calories_burned'] or 0),
+            load + INTENSITY_CALORIES.get(record['intensity'], 0)
+        )
+    
+    conn.executemany('''
+        INSERT INTO user_daily_stats
+            (user_id, day, exercise_type, workouts, duration, calories, intensity_load)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, day, exercise_type) DO UPDATE SET
+            workouts = user_daily_stats.workouts + excluded.workouts,
+            duration = user_daily_stats.duration + excluded.duration,
+            calories = user_daily_stats.calories + excluded.calories,
+            intensity_load = user_daily_stats.intensity_load + excluded.intensity_load
+    ''', [(*key, *values) for key, values in totals.items()])
+
+def _get_genders(conn, user_ids):
+    """查询一批用户的性别"""
+    user_ids = list(user_ids)
+    genders = {}
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        genders.update(
+            (row['user_id'], row['gender']) for row in conn.execute(
+                f'SELECT user_id, gender FROM users WHERE user_id IN ({placeholders})', chunk
+            )
+        )
+    return genders
+
+def _update_activity_cube(conn, records):
+    """把一批新记录累加到全站活动立方体
+
+    立方体中的性别始终是用户资料中的当前性别，与重建结果一致；修改性别时由
+    _move_activity_cube 把该用户的记录移到新性别下。
+    """
+    genders = _get_genders(conn, {record['user_id'] for record in records})
+    totals = {}
+    for record in records:
+        key = (
+            str(record['date'])[:10],
+            record['exercise_type'],
+            record['intensity'] or '',
+            genders.get(record['user_id']) or ''
+        )
+        workouts, duration, calories = totals.get(key, (0, 0, 0))
+        totals[key] = (
+            workouts + 1,
+            duration + (record['duration'] or 0),
+            calories + (record['calories_burned'] or 0)
+        )
+    
+    conn.executemany('''
+        INSERT INTO daily_activity_cube
+            (day, exercise_type, intensity, gender, workouts, duration, calories)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (day, exercise_type, intensity, gender) DO UPDATE SET
+            workouts = daily_activity_cube.workouts + excluded.workouts,
+            duration = daily_activity_cube.duration + excluded.duration,
+            calories = daily_activity_cube.calories + excluded.calories
+    ''', [(*key, *values) for key, values in totals.items()])
+
+def _move_activity_cube(conn, user_id, old_gender, new_gender):
+    """把一个用户的全部记录（含已归档的记录）在全站活动立方体中从旧性别移到新性别"""
+    # 归档模块依赖本模块，在函数内导入
+    from archive import scan_records
+    records = scan_records(
+        ['date', 'exercise_type', 'intensity', 'duration', 'calories_burned'],
+        [('user_id', '=', user_id), ('exercise_type', 'is not', None), ('date', 'is not', None)]
+    )
+    if records.empty:
+        return
+    totals = records.assign(
+        day=records['date'].str[:10],
+        intensity=records['intensity'].fillna(''),
+        duration=records['duration'].fillna(0),
+        calories_burned=records['calories_burned'].fillna(0)
+    ).groupby(['day', 'exercise_type', 'intensity']).agg(
+        workouts=('day', 'size'), duration=('duration', 'sum'), calories=('calories_burned', 'sum')
+    )
+    rows = [
+        (day, exercise_type, intensity, int(row.workouts), int(row.duration), float(row.calories))
+        for (day, exercise_type, intensity), row in zip(totals.index, totals.itertuples())
+    ]
+    
+    conn.executemany('''
+        UPDATE daily_activity_cube
+        SET workouts = workouts - ?, duration = duration - ?, calories = calories - ?
+        WHERE day = ? AND exercise_type = ? AND intensity = ? AND gender = ?
+    ''', [
+        (workouts, duration, calories, day, exercise_type, intensity, old_gender or '')
+        for day, exercise_type, intensity, workouts, duration, calories in rows
+    ])
+    conn.execute('DELETE FROM daily_activity_cube WHERE gender = ? AND workouts <= 0', (old_gender or '',))
+    conn.executemany('''
+        INSERT INTO daily_activity_cube
+            (day, exercise_type, intensity, gender, workouts, duration, calories)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (day, exercise_type, intensity, gender) DO UPDATE SET
+            workouts = daily_activity_cube.workouts + excluded.workouts,
+            duration = daily_activity_cube.duration + excluded.duration,
+            calories = daily_activity_cube.calories + excluded.calories
+    ''', [
+        (day, exercise_type, intensity, new_gender or '', workouts, duration, calories)
+        for day, exercise_type, intensity, workouts, duration, calories in rows
+    ])
+
+def update_user_profile(user_id, age, gender, fitness_goal, preferred_exercise):
+    """更新用户资料，性别改变时在同一事务中调整全站活动立方体"""
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT gender FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        conn.execute('''
+            UPDATE users
+            SET age=?, gender=?, fitness_goal=?, preferred_exercise=?
+            WHERE user_id=?
+        ''', (age, gender, fitness_goal, preferred_exercise, user_id))
+        if row is not None and (row['gender'] or '') != (gender or ''):
+            _move_activity_cube(conn, user_id, row['gender'], gender)
+
+def _bump_write_generations(conn, user_ids):
+    """用户数据发生写入后递增其写入代数，使该用户的缓存失效"""
+    conn.executemany('''
+        INSERT INTO user_write_generations (user_id, generation)
+        VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET generation = user_write_generations.generation + 1
+    ''', [(user_id,) for user_id in user_ids])
+
+def load_calorie_candidates(after_record_id, limit):
+    """按记录ID顺序读取一块需要回填卡路里的记录"""
+    with get_db_connection() as conn:
+        return pd.read_sql_query(CALORIE_CANDIDATES_SQL, conn, params=(after_record_id, limit))
+
+def apply_calorie_estimates(rows):
+    """写回估算的卡路里并标记为估算值，在同一事务中修正每日汇总和全站活动立方体
+
+    rows 为 (record_id, user_id, date, exercise_type, intensity, 原卡路里, 估算卡路里) 的序列。
+    立方体的性别在写事务中按用户当前资料查询，与 _update_activity_cube 一致。
+    """
+    with get_db_connection() as conn:
+        genders = _get_genders(conn, {row[1] for row in rows})
+        deltas = {}
+        cube_deltas = {}
+        for record_id, user_id, date, exercise_type, intensity, old, new in rows:
+            day = str(date)[:10]
+            key = (user_id, day, exercise_type)
+            deltas[key] = deltas.get(key, 0) + new - (old or 0)
+            cube_key = (day, exercise_type, intensity or '', genders.get(user_id) or '')
+            cube_deltas[cube_key] = cube_deltas.get(cube_key, 0) + new - (old or 0)
+        
+        conn.executemany(
+            'UPDATE exercise_records SET calories_burned = ?, calories_estimated = 1 WHERE record_id = ?',
+            [(row[6], row[0]) for row in rows]
+        )
+        conn.executemany('''
+            UPDATE user_daily_stats SET calories = calories + ?
+            WHERE user_id = ? AND day = ? AND exercise_type = ?
+        ''', [(delta, *key) for key, delta in deltas.items()])
+        conn.executemany('''
+            UPDATE daily_activity_cube SET calories = calories + ?
+            WHERE day = ? AND exercise_type = ? AND intensity = ? AND gender = ?
+        ''', [(delta, *key) for key, delta in cube_deltas.items()])
+        _bump_write_generations(conn, {key[0] for key in deltas})
+
+def get_write_generation(conn, user_id):
+    """获取用户当前的写入代数"""
+    row = conn.execute(WRITE_GENERATION_SQL, (user_id,)).fetchone()
+    return row['generation'] if row else 0
+
+# 日期所在月份是否已归档的条件，{} 处填入日期列
+ARCHIVED_MONTH = 'substr(CAST({} AS TEXT), 1, 7) IN (SELECT month FROM archive_months)'
+
+def rebuild_daily_stats():
+    """根据锻炼记录全量重建用户每日汇总和全站活动立方体，返回用户每日汇总行数
+
+    已归档月份的记录不在数据库中，这些月份的汇总保持不变。
+    """
+    with get_db_connection() as conn:
+        conn.execute(f'DELETE FROM daily_activity_cube WHERE NOT {ARCHIVED_MONTH.format("day")}')
+        conn.execute(f'''
+            INSERT INTO daily_activity_cube
+                (day, exercise_type, intensity, gender, workouts, duration, calories)
+            {activity_cube_select(f'NOT {ARCHIVED_MONTH.format("er.date")}')}
+        ''')
+        
+        conn.execute(f'DELETE FROM user_daily_stats WHERE NOT {ARCHIVED_MONTH.format("day")}')
+        conn.execute(f'''
+            INSERT INTO user_daily_stats
+                (user_id, day, exercise_type, workouts, duration, calories, intensity_load)
+            SELECT user_id, date(date), exercise_type,
+                   COUNT(*), COALESCE(SUM(duration), 0), COALESCE(SUM(calories_burned), 0),
+                   SUM({intensity_load_sql()})
+            FROM exercise_records
+            WHERE user_id IS NOT NULL AND exercise_type IS NOT NULL
+              AND NOT {ARCHIVED_MONTH.format("date")}
+            GROUP BY user_id, date(date), exercise_type
+        ''')
+        rows = conn.execute('SELECT COUNT(*) FROM user_daily_stats').fetchone()[0]
+        _bump_write_generations(conn, [
+            row['user_id'] for row in
+            conn.execute('SELECT DISTINCT user_id FROM user_daily_stats')
+        ])
+    record_cache.clear()
+    return rows
+
+def get_user_daily_stats(user_id):
+    """获取用户按天、按运动类型的汇总数据，结果按写入代数缓存，勿原地修改"""
+    with get_db_connection() as conn:
+        generation = get_write_generation(conn, user_id)
+        return record_cache.get_or_load(
+            ('daily_stats', user_id), generation,
+            lambda: pd.read_sql_query(USER_DAILY_STATS_SQL, conn, params=(user_id,))
+        )
+
+def get_latest_records(user_id, limit=5):
+    """获取用户最近的锻炼记录，结果按写入代数缓存，勿原地修改"""
+    with get_db_connection() as conn:
+        generation = get_write_generation(conn, user_id)
+        return record_cache.get_or_load(
+            ('latest_records', user_id, limit), generation,
+            lambda: pd.read_sql_query(USER_LATEST_RECORDS_SQL, conn, params=(user_id, limit))
+        )
+
+def get_user_duration_records(user_id, start, end):
+    """获取用户 start 到 end 日（含）每次运动的日期和时长（含已归档的记录），按日期排序
+
+    结果按写入代数缓存，勿原地修改。
+    """
+    from archive import scan_records
+    
+    def load():
+        records = scan_records(['date', 'duration'], [
+            ('user_id', '=', user_id),
+            ('date', '>=', start),
+            ('date', '<', end + timedelta(days=1))
+        ])
+        return records.assign(date=pd.to_datetime(records['date'])).sort_values('date')
+    
+    with get_db_connection() as conn:
+        generation = get_write_generation(conn, user_id)
+    return record_cache.get_or_load(('duration_records', user_id, start, end), generation, load)
+
+def get_load_score(user_id, days=7, today=None):
+    """计算用户最近若干天的运动负荷
+
+    负荷按 INTENSITY_CALORIES 中各强度的权重累加，直接从每日汇总表聚合，
+    返回运动次数、总时长、总负荷和日均负荷。today 默认为当前日期。
+    """
+    since = ((today or datetime.now()) - timedelta(days=days)).strftime('%Y-%m-%d')
+    with get_db_connection() as conn:
+        row = conn.execute(USER_LOAD_SCORE_SQL, (user_id, since)).fetchone()
+    
+    return {
+        'workouts': row['workouts'],
+        'duration': row['duration'],
+        'total_load': row['total_load'],
+        'avg_daily_load': row['total_load'] / days
+    }
+
+def get_daily_activity(start_date, end_date, dimension='exercise_type'):
+    """获取日期范围内全站每天的锻炼次数、时长和卡路里，按运动类型、强度或性别分组"""
+    with get_db_connection() as conn:
+        return pd.read_sql_query(
+            daily_activity_sql(dimension), conn, params=(str(start_date), str(end_date))
+        )
+
+def get_leaderboard(days=10, top_n=3, today=None):
+    """获取最近若干天健身评分排名前 top_n 的用户，today 默认为当前日期"""
+    start_date = ((today or datetime.now()) - timedelta(days=days)).strftime('%Y-%m-%d')
+    with get_db_connection() as conn:
+        return pd.read_sql_query(LEADERBOARD_SQL, conn, params=(start_date, top_n))
+
+def get_user_page(after_username=None, page_size=20, keyword=""):
+    """按用户名分页获取用户及其锻炼汇总
+
+    返回 (当前页用户列表, 是否还有下一页)，下一页从本页最后一个用户名之后开始。
+    """
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            USER_PAGE_SQL,
+            (after_username or "", keyword or "", page_size + 1)
+        ).fetchall()
     
-    conn.close()
-    return user if user else None 
+    users = [dict(row) for row in rows[:page_size]]
+    return users, len(rows) > page_size
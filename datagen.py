@@ -0,0 +1,140 @@
+"""合成数据集生成器
+
+沿用随机记录按钮的分布（运动类型、强度均匀分布，时长15-120分钟，卡路里50-500），
+按固定种子批量生成用户和锻炼记录，用于搭建不同规模的性能测试夹具库。
+记录日期以固定的截止日为准，不随生成时间变化。
+"""
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+import numpy as np
+from database import use_database, init_database, rebuild_daily_stats
+from config import EXERCISE_TYPES, INTENSITY_LEVELS, FITNESS_GOALS, DATAGEN_ANCHOR_DATE
+
+def _user_rows(rng, start, count):
+    """生成一批用户及其默认设置"""
+    users = []
+    settings = []
+    for i in range(start, start + count):
+        user_id = str(uuid.UUID(bytes=rng.bytes(16), version=4))
+        preferred = rng.choice(EXERCISE_TYPES, size=rng.integers(1, 4), replace=False)
+        users.append((
+            user_id,
+            f"user{i:07d}",
+            "password",
+            int(rng.integers(18, 66)),
+            "男" if rng.random() < 0.5 else "女",
+            FITNESS_GOALS[rng.integers(len(FITNESS_GOALS))],
+            ','.join(preferred)
+        ))
+        settings.append((user_id, 30, 3, "08:00"))
+    return users, settings
+
+def _record_rows(rng, user_ids, records_per_user, days, today):
+    """为一批用户生成锻炼记录
+
+    每个用户的记录数服从均值为 records_per_user 的泊松分布，
+    记录日期均匀分布在该用户开始锻炼至截止日 today 的区间内。
+    """
+    counts = rng.poisson(records_per_user, len(user_ids))
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(user_ids)), counts)
+    
+    active_days = rng.integers(1, days + 1, len(user_ids))
+    offsets = (rng.random(total) * active_days[owner]).astype('timedelta64[D]')
+    dates = (today - offsets).astype(str)
+    
+    types = np.array(EXERCISE_TYPES)[rng.integers(0, len(EXERCISE_TYPES), total)]
+    intensities = np.array(INTENSITY_LEVELS)[rng.integers(0, len(INTENSITY_LEVELS), total)]
+    durations = rng.integers(15, 121, total)
+    calories = rng.integers(50, 501, total)
+    
+    return zip(
+        np.array(user_ids)[owner].tolist(),
+        types.tolist(),
+        durations.tolist(),
+        intensities.tolist(),
+        calories.tolist(),
+        ["合成数据"] * total,
+        dates.tolist()
+    ), total
+
+def generate_dataset(path, users, records_per_user, seed=42, days=365, chunk_users=1000,
+                     anchor_date=DATAGEN_ANCHOR_DATE):
+    """生成合成数据库，相同参数和种子总是得到相同的数据
+
+    path 必须是不存在的文件。记录日期不晚于 anchor_date（YYYY-MM-DD）。
+    返回用户数、记录数、耗时和每秒写入行数。
+    """
+    path = Path(path)
+    today = np.datetime64(str(anchor_date), 'D')
+    if path.exists():
+        raise FileExistsError(f"数据库文件已存在：{path}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    
+    started = time.perf_counter()
+    use_database(path)
+    init_database()
+    
+    rng = np.random.default_rng(seed)
+    total_records = 0
+    
+    # 夹具库可随时重建，批量写入时关闭同步，并先删除二级索引、写完后一次性重建
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA cache_size=-262144')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    indexes = [row[0] for row in conn.execute('''
+        SELECT sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = 'exercise_records' AND sql IS NOT NULL
+    ''')]
+    for name, in conn.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = 'exercise_records' AND sql IS NOT NULL
+    ''').fetchall():
+        conn.execute(f'DROP INDEX {name}')
+    try:
+        for start in range(0, users, chunk_users):
+            count = min(chunk_users, users - start)
+            user_rows, setting_rows = _user_rows(rng, start, count)
+            records, generated = _record_rows(
+                rng, [row[0] for row in user_rows], records_per_user, days, today
+            )
+            
+            conn.executemany('''
+                INSERT INTO users (
+                    user_id, username, password, age,
+                    gender, fitness_goal, preferred_exercise
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', user_rows)
+            conn.executemany('''
+                INSERT INTO user_settings (
+                    user_id, daily_exercise_goal,
+                    weekly_exercise_goal, reminder_time
+                )
+                VALUES (?, ?, ?, ?)
+            ''', setting_rows)
+            conn.executemany('''
+                INSERT INTO exercise_records
+                (user_id, exercise_type, duration, intensity, calories_burned, notes, date)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', records)
+            conn.commit()
+            total_records += generated
+    finally:
+        for sql in indexes:
+            conn.execute(sql)
+        conn.commit()
+        conn.close()
+    
+    rebuild_daily_stats()
+    
+    seconds = time.perf_counter() - started
+    return {
+        'users': users,
+        'records': total_records,
+        'seconds': seconds,
+        'rows_per_sec': total_records / seconds if seconds else 0.0
+    }
@@ -0,0 +1,72 @@
+"""SQLite 数据复制到 PostgreSQL
+
+在目标库上执行结构迁移后，按建表顺序逐表分块读取SQLite数据并批量写入，
+最后把自增列的序列推进到已有的最大ID。用于从SQLite迁移到PostgreSQL，
+以及基准测试把同一个夹具库装入PostgreSQL。
+"""
+import sqlite3
+import time
+from psycopg2.extras import execute_values
+from database import use_database, init_database, get_db_connection, get_dialect
+from config import PG_COPY_CHUNK_SIZE
+
+def copy_database(source_path, target, truncate=False, chunk_size=PG_COPY_CHUNK_SIZE, progress=None):
+    """把SQLite数据库的全部数据复制到 target 指向的PostgreSQL数据库，返回复制统计
+
+    目标库应为空库；truncate 为真时先清空目标库中的应用表。复制完成后当前进程切换到目标库。
+    传入 progress 时每复制完一张表调用 progress(表名, 行数)。
+    """
+    use_database(target)
+    if get_dialect() != 'postgresql':
+        raise ValueError(f"目标不是PostgreSQL数据库：{target}")
+    init_database()
+    
+    started = time.perf_counter()
+    report = {'tables': 0, 'rows': 0}
+    source = sqlite3.connect(source_path)
+    try:
+        tables = [row[0] for row in source.execute('''
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+            ORDER BY rowid
+        ''')]
+        with get_db_connection() as conn:
+            if truncate:
+                conn.execute(f'TRUNCATE {", ".join(tables)} RESTART IDENTITY')
+            cursor = conn.raw.cursor()
+            for table in tables:
+                info = source.execute(f'PRAGMA table_info({table})').fetchall()
+                columns = [row[1] for row in info]
+                rows = source.execute(f'SELECT {", ".join(columns)} FROM {table}')
+                copied = 0
+                while True:
+                    chunk = rows.fetchmany(chunk_size)
+                    if not chunk:
+                        break
+                    execute_values(
+                        cursor, f'INSERT INTO {table} ({", ".join(columns)}) VALUES %s',
+                        chunk, page_size=chunk_size
+                    )
+                    copied += len(chunk)
+                
+                # 显式写入了自增列，把序列推进到最大ID之后
+                for column in (row[1] for row in info if row[5]):
+                    cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', (table, column))
+                    sequence = cursor.fetchone()[0]
+                    if sequence is not None:
+                        cursor.execute(
+                            f'SELECT setval(%s, MAX({column})) FROM {table} HAVING MAX({column}) IS NOT NULL',
+                            (sequence,)
+                        )
+                report['tables'] += 1
+                report['rows'] += copied
+                if progress is not None:
+                    progress(table, copied)
+            # 批量写入后更新统计信息，查询计划才能用上索引
+            cursor.execute('ANALYZE')
+    finally:
+        source.close()
+    
+    report['seconds'] = time.perf_counter() - started
+    report['rows_per_sec'] = report['rows'] / report['seconds'] if report['seconds'] else 0.0
+    return report
@@ -0,0 +1,114 @@
+"""锻炼记录导出
+
+通过 scan_batches 按块读取归档和库内的锻炼记录，逐块写入 CSV 或 Parquet（每块一个行组），
+内存占用只与块大小有关。可按用户和日期范围筛选。整个导出在一个读事务中完成，得到的是一致的快照。
+"""
+import io
+import time
+from datetime import date, timedelta
+import pyarrow as pa
+import pyarrow.parquet as pq
+from database import get_db_connection
+from archive import scan_batches
+from config import EXPORT_CHUNK_SIZE
+
+EXPORT_FORMATS = ['csv', 'parquet']
+
+# 导出列及其 Parquet 类型，显式指定以保证各行组类型一致
+EXPORT_SCHEMA = pa.schema([
+    ('record_id', pa.int64()),
+    ('user_id', pa.string()),
+    ('username', pa.string()),
+    ('date', pa.string()),
+    ('exercise_type', pa.string()),
+    ('duration', pa.int64()),
+    ('intensity', pa.string()),
+    ('calories_burned', pa.float64()),
+    ('calories_estimated', pa.int64()),
+    ('notes', pa.string()),
+    ('import_key', pa.string())
+])
+
+# 从锻炼记录读取的列，用户名按用户ID补充
+EXPORT_COLUMNS = [name for name in EXPORT_SCHEMA.names if name != 'username']
+
+def export_filters(user_id=None, start_date=None, end_date=None):
+    """生成导出的扫描条件，日期范围包含首尾两天"""
+    filters = []
+    if user_id is not None:
+        filters.append(('user_id', '=', user_id))
+    if start_date is not None:
+        filters.append(('date', '>=', str(start_date)))
+    if end_date is not None:
+        # 日期可能带时间部分，用次日作为开区间上限
+        filters.append(('date', '<', str(date.fromisoformat(str(end_date)[:10]) + timedelta(days=1))))
+    return filters
+
+def _get_usernames(user_id=None):
+    """用户ID到用户名的映射"""
+    with get_db_connection() as conn:
+        if user_id is None:
+            rows = conn.execute('SELECT user_id, username FROM users')
+        else:
+            rows = conn.execute('SELECT user_id, username FROM users WHERE user_id = ?', (user_id,))
+        return {row['user_id']: row['username'] for row in rows}
+
+def _with_usernames(chunks, usernames):
+    """为每块记录补充用户名列"""
+    for chunk in chunks:
+        chunk.insert(EXPORT_SCHEMA.names.index('username'), 'username', chunk['user_id'].map(usernames))
+        yield chunk
+
+def _write_csv(chunks, out):
+    """逐块写入CSV，带BOM以便表格软件识别中文"""
+    text = io.TextIOWrapper(out, encoding='utf-8-sig', newline='')
+    header = True
+    for chunk in chunks:
+        chunk.to_csv(text, header=header, index=False)
+        header = False
+        yield len(chunk)
+    if header:
+        text.write(','.join(EXPORT_SCHEMA.names) + '\n')
+    text.flush()
+    text.detach()
+
+def _write_parquet(chunks, out):
+    """逐块写入Parquet，每块一个行组"""
+    with pq.ParquetWriter(out, EXPORT_SCHEMA, compression='zstd') as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=EXPORT_SCHEMA, preserve_index=False))
+            yield len(chunk)
+
+WRITERS = {
+    'csv': _write_csv,
+    'parquet': _write_parquet
+}
+
+def export_records(out, fmt='csv', user_id=None, start_date=None, end_date=None,
+                   chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """把锻炼记录导出到二进制文件对象，返回导出统计
+
+    统计包括行数、块数、耗时和每秒导出行数。传入 progress 时每块写完后调用 progress(已导出行数)。
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"不支持的导出格式：{fmt}")
+    
+    report = {'rows': 0, 'chunks': 0}
+    started = time.perf_counter()
+    
+    chunks = scan_batches(EXPORT_COLUMNS, export_filters(user_id, start_date, end_date), chunk_size)
+    for rows in WRITERS[fmt](_with_usernames(chunks, _get_usernames(user_id)), out):
+        report['rows'] += rows
+        report['chunks'] += 1
+        if progress is not None:
+            progress(report['rows'])
+    
+    report['seconds'] = time.perf_counter() - started
+    report['rows_per_sec'] = report['rows'] / report['seconds'] if report['seconds'] else 0.0
+    return report
+
+def export_file(path, fmt=None, **filters):
+    """导出到文件，未指定格式时按扩展名判断"""
+    fmt = fmt or str(path).rsplit('.', 1)[-1].lower()
+    with open(path, 'wb') as out:
+        return export_records(out, fmt, **filters)
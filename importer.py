@@ -0,0 +1,235 @@
+"""锻炼记录批量导入
+
+支持 CSV、JSON Lines 和 GPX 轨迹摘要三种格式。文件以生成器逐行解析，
+校验后按批写入，每批一个事务。未提供 import_key 的记录按内容和在文件中第几次出现生成导入键，
+同一文件重复导入不会产生重复记录，文件中完全相同的多条记录都会保留。
+解析器遇到无法解析的行时产出 ValueError 而不是抛出，导入时与校验失败的行一样计入不合法行数并继续导入。
+"""
+import csv
+import hashlib
+import io
+import json
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from database import add_exercise_records
+from config import EXERCISE_TYPES, INTENSITY_LEVELS, IMPORT_BATCH_SIZE
+
+# GPX 中常见的活动类型与系统运动类型的对应关系
+GPX_ACTIVITY_TYPES = {
+    'running': "跑步",
+    'run': "跑步",
+    'cycling': "骑行",
+    'biking': "骑行",
+    'swimming': "游泳",
+    'walking': "健走",
+    'hiking': "登山"
+}
+
+SUPPORTED_FORMATS = ['csv', 'jsonl', 'gpx']
+
+def detect_format(filename):
+    """根据文件扩展名判断导入格式"""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'json', 'ndjson'):
+        return 'jsonl'
+    if extension in SUPPORTED_FORMATS:
+        return extension
+    raise ValueError(f"不支持的文件格式：{extension}")
+
+def parse_csv(stream):
+    """逐行解析CSV，表头需包含记录字段名"""
+    reader = csv.DictReader(stream)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield ValueError(f"CSV格式错误（第{reader.line_num}行）：{e}")
+            continue
+        yield row
+
+def parse_jsonl(stream):
+    """逐行解析JSON Lines，跳过空行"""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            raw = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"JSON格式错误（第{line_number}行）：{e}")
+            continue
+        if not isinstance(raw, dict):
+            yield ValueError(f"第{line_number}行不是JSON对象")
+            continue
+        yield raw
+
+def _local_name(tag):
+    """去掉XML命名空间前缀"""
+    return tag.rsplit('}', 1)[-1]
+
+def parse_gpx(stream):
+    """把GPX中的每条轨迹汇总成一条锻炼记录
+
+    运动时长取首末轨迹点的时间差，类型取自 <type>，强度默认为中。
+    时间格式错误的轨迹产出 ValueError；XML 本身损坏时之后的内容无法读取，产出错误后结束。
+    """
+    track = None
+    events = ET.iterparse(stream, events=('start', 'end'))
+    while True:
+        try:
+            event, element = next(events)
+        except StopIteration:
+            return
+        except ET.ParseError as e:
+            yield ValueError(f"GPX格式错误：{e}")
+            return
+        name = _local_name(element.tag)
+        if event == 'start':
+            if name == 'trk':
+                track = {'type': None, 'name': None, 'first': None, 'last': None, 'error': None}
+            continue
+
+        if track is not None:
+            if name == 'type' and track['type'] is None:
+                track['type'] = (element.text or '').strip()
+            elif name == 'name' and track['name'] is None:
+                track['name'] = (element.text or '').strip()
+            elif name == 'time':
+                text = (element.text or '').strip()
+                try:
+                    timestamp = datetime.fromisoformat(text.replace('Z', '+00:00'))
+                except ValueError:
+                    track['error'] = track['error'] or ValueError(f"轨迹时间格式错误：{text}")
+                    continue
+                track['first'] = track['first'] or timestamp
+                track['last'] = timestamp
+            elif name == 'trkpt':
+                # 轨迹点处理完即释放，保持内存占用恒定
+                element.clear()
+            elif name == 'trk':
+                if track['error'] is not None:
+                    yield track['error']
+                elif track['first'] is not None:
+                    activity = track['type'] or ''
+                    yield {
+                        'exercise_type': GPX_ACTIVITY_TYPES.get(activity.lower(), activity),
+                        'duration': max(1, round((track['last'] - track['first']).total_seconds() / 60)),
+                        'intensity': "中",
+                        'calories_burned': None,
+                        'notes': track['name'] or "GPX导入",
+                        'date': track['first'].strftime('%Y-%m-%d'),
+                        'import_key': f"gpx:{track['first'].isoformat()}"
+                    }
+                track = None
+                element.clear()
+
+PARSERS = {
+    'csv': parse_csv,
+    'jsonl': parse_jsonl,
+    'gpx': parse_gpx
+}
+
+def validate_record(raw, user_id, occurrences=None):
+    """校验并规范化一条原始记录，不合法时抛出 ValueError
+
+    未提供 import_key 时按原始时间和各字段生成导入键。occurrences 记录本文件中各内容已出现的次数，
+    同一天内容完全相同的多次运动依次编号，不会被当作重复记录。
+    """
+    exercise_type = (raw.get('exercise_type') or '').strip()
+    if exercise_type not in EXERCISE_TYPES:
+        raise ValueError(f"未知的运动类型：{exercise_type}")
+
+    intensity = (raw.get('intensity') or '').strip()
+    if intensity not in INTENSITY_LEVELS:
+        raise ValueError(f"未知的运动强度：{intensity}")
+
+    duration = int(float(raw.get('duration') or 0))
+    if duration <= 0:
+        raise ValueError(f"运动时长必须大于0：{raw.get('duration')}")
+
+    calories = raw.get('calories_burned')
+    calories = float(calories) if calories not in (None, '') else None
+    if calories is not None and calories < 0:
+        raise ValueError(f"消耗卡路里不能为负数：{calories}")
+
+    timestamp = str(raw.get('date') or '').strip()
+    date = datetime.fromisoformat(timestamp).strftime('%Y-%m-%d')
+    notes = raw.get('notes') or ''
+
+    import_key = raw.get('import_key') or None
+    if import_key is None:
+        content = '|'.join(map(str, (timestamp, exercise_type, duration, intensity, calories, notes)))
+        if occurrences is not None:
+            seen = occurrences.get(content, 0)
+            occurrences[content] = seen + 1
+            # 第一次出现时不加编号，与只有日期的旧导入键一致
+            if seen:
+                content = f"{content}|{seen}"
+        import_key = hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    return {
+        'user_id': user_id,
+        'exercise_type': exercise_type,
+        'duration': duration,
+        'intensity': intensity,
+        'calories_burned': calories,
+        'notes': notes,
+        'date': date,
+        'import_key': str(import_key)
+    }
+
+def import_records(user_id, rows, batch_size=IMPORT_BATCH_SIZE, max_errors=20):
+    """校验并分批写入记录，返回导入统计
+
+    统计包括读取行数、写入行数、重复跳过行数、不合法行数、
+    前 max_errors 条错误信息、耗时和每秒处理行数。
+    """
+    report = {'rows': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0, 'errors': []}
+    started = time.perf_counter()
+    batch = []
+    occurrences = {}
+
+    for line_number, raw in enumerate(rows, start=1):
+        report['rows'] += 1
+        try:
+            # 解析失败的行由解析器以异常对象产出
+            if isinstance(raw, Exception):
+                raise raw
+            batch.append(validate_record(raw, user_id, occurrences))
+        except (ValueError, TypeError) as e:
+            report['invalid'] += 1
+            if len(report['errors']) < max_errors:
+                report['errors'].append(f"第{line_number}条：{e}")
+            continue
+
+        if len(batch) >= batch_size:
+            inserted = add_exercise_records(batch)
+            report['inserted'] += inserted
+            report['duplicates'] += len(batch) - inserted
+            batch = []
+
+    if batch:
+        inserted = add_exercise_records(batch)
+        report['inserted'] += inserted
+        report['duplicates'] += len(batch) - inserted
+
+    report['seconds'] = time.perf_counter() - started
+    report['rows_per_sec'] = report['rows'] / report['seconds'] if report['seconds'] else 0.0
+    return report
+
+def import_stream(user_id, stream, fmt, batch_size=IMPORT_BATCH_SIZE):
+    """从二进制流导入记录，CSV 和 JSON Lines 按 UTF-8 解码"""
+    if fmt not in PARSERS:
+        raise ValueError(f"不支持的文件格式：{fmt}")
+    if fmt != 'gpx':
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return import_records(user_id, PARSERS[fmt](stream), batch_size)
+
+def import_file(user_id, path, fmt=None, batch_size=IMPORT_BATCH_SIZE):
+    """从文件导入记录，未指定格式时按扩展名判断"""
+    fmt = fmt or detect_format(str(path))
+    with open(path, 'rb') as stream:
+        return import_stream(user_id, stream, fmt, batch_size)
@@ -0,0 +1,251 @@
+"""命令行维护工具
+
+用法:
+    python manage.py check-plans      检查热点查询的执行计划
+    python manage.py rebuild-stats    重建用户每日汇总表
+    python manage.py import USERNAME FILE [--format csv|jsonl|gpx]
+                                      为用户批量导入锻炼记录
+    python manage.py generate PATH --users N --records-per-user M [--seed S] [--anchor-date DATE]
+                                      生成合成数据库用于性能测试
+    python manage.py train [--incremental] [--trees N] [--n-jobs N]
+                                      训练卡路里模型，适合定时任务每日增量更新
+    python manage.py backfill-calories [--chunk-size N] [--met-only]
+                                      估算未填写或默认值的卡路里
+    python manage.py backup [--pages N] [--sleep S]
+                                      在线备份数据库并校验
+    python manage.py export FILE [--format csv|parquet] [--user USERNAME] [--start DATE] [--end DATE]
+                                      分块导出锻炼记录
+    python manage.py archive [--older-than-days N] [--user-buckets N]
+                                      把旧记录按月归档为Parquet文件
+    python manage.py copy-to-postgres URL [--source PATH] [--truncate]
+                                      把SQLite数据库复制到PostgreSQL
+"""
+import argparse
+import sys
+from database import init_database, check_query_plans, rebuild_daily_stats, get_user, get_database_path
+from importer import import_file, SUPPORTED_FORMATS
+from datagen import generate_dataset
+from backfill import backfill_calories
+from backup import backup_database
+from export import export_file, EXPORT_FORMATS
+from archive import archive_records
+from training_jobs import create_job, run_training_job, get_training_jobs
+from config import (
+    DATABASE_PATH, IMPORT_BATCH_SIZE, INCREMENTAL_TREES, TRAINING_N_JOBS, BACKFILL_CHUNK_SIZE,
+    BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP, EXPORT_CHUNK_SIZE,
+    ARCHIVE_AFTER_DAYS, ARCHIVE_USER_BUCKETS, ARCHIVE_CHUNK_SIZE, PG_COPY_CHUNK_SIZE, DATAGEN_ANCHOR_DATE
+)
+
+def check_plans(args):
+    """输出热点查询执行计划，出现全表扫描时以非零状态退出"""
+    try:
+        plans = check_query_plans()
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for name, plan in plans.items():
+        print(f"{name}: {'; '.join(plan)}")
+    return 0
+
+def rebuild_stats(args):
+    """重建用户每日汇总表"""
+    rows = rebuild_daily_stats()
+    print(f"已重建 {rows} 行每日汇总")
+    return 0
+
+def import_records(args):
+    """为指定用户导入锻炼记录文件"""
+    user = get_user(args.username)
+    if user is None:
+        print(f"用户不存在：{args.username}", file=sys.stderr)
+        return 1
+    
+    report = import_file(user['user_id'], args.file, args.format, args.batch_size)
+    print(
+        f"读取 {report['rows']} 行，写入 {report['inserted']} 行，"
+        f"重复跳过 {report['duplicates']} 行，不合法 {report['invalid']} 行，"
+        f"耗时 {report['seconds']:.2f} 秒（{report['rows_per_sec']:.0f} 行/秒）"
+    )
+    for error in report['errors']:
+        print(error, file=sys.stderr)
+    return 0
+
+def generate(args):
+    """生成合成数据库"""
+    report = generate_dataset(
+        args.path, args.users, args.records_per_user, args.seed, args.days,
+        anchor_date=args.anchor_date
+    )
+    print(
+        f"已生成 {report['users']} 个用户、{report['records']} 条记录，"
+        f"耗时 {report['seconds']:.2f} 秒（{report['rows_per_sec']:.0f} 行/秒）"
+    )
+    return 0
+
+def train(args):
+    """在当前进程中执行训练任务，任务同样记录在 training_jobs 表中"""
+    if args.incremental:
+        fields = {'kind': 'incremental', 'n_estimators': args.trees or INCREMENTAL_TREES, 'n_jobs': args.n_jobs}
+    else:
+        fields = {
+            'kind': 'train',
+            'n_estimators': args.trees or 100,
+            'max_depth': args.max_depth,
+            'min_samples_split': args.min_samples_split,
+            'n_jobs': args.n_jobs
+        }
+    job_id = create_job(fields)
+    run_training_job(job_id, str(get_database_path()))
+    
+    job = next(job for job in get_training_jobs() if job['job_id'] == job_id)
+    if job['status'] != 'done':
+        print(f"训练任务 #{job_id} {job['status']}：{job['error']}", file=sys.stderr)
+        return 1
+    print(
+        f"训练任务 #{job_id} 完成：模型 v{job['model_version']}，"
+        f"{job['training_rows']} 条数据，耗时 {job['seconds']:.2f} 秒"
+    )
+    return 0
+
+def backfill(args):
+    """回填卡路里并输出吞吐量"""
+    report = backfill_calories(
+        args.chunk_size, use_model=not args.met_only,
+        progress=lambda updated: print(f"已回填 {updated} 条", file=sys.stderr)
+    )
+    print(
+        f"回填 {report['updated']} 条记录（模型 {report['model']} 条，代谢当量 {report['met']} 条），"
+        f"{report['chunks']} 个事务，耗时 {report['seconds']:.2f} 秒（{report['rows_per_sec']:.0f} 行/秒）"
+    )
+    return 0
+
+def backup(args):
+    """在线备份数据库"""
+    try:
+        run = backup_database(args.pages, args.sleep)
+    except Exception as e:
+        print(f"备份失败：{e}", file=sys.stderr)
+        return 1
+    print(
+        f"已备份到 {run['path']}：{run['pages']} 页，{run['bytes'] / 1024 / 1024:.1f} MB，"
+        f"复制 {run['copy_seconds']:.2f} 秒，校验 {run['verify_seconds']:.2f} 秒"
+    )
+    return 0
+
+def export(args):
+    """导出锻炼记录到文件"""
+    user_id = None
+    if args.user:
+        user = get_user(args.user)
+        if user is None:
+            print(f"用户不存在：{args.user}", file=sys.stderr)
+            return 1
+        user_id = user['user_id']
+    
+    report = export_file(
+        args.file, args.format, user_id=user_id,
+        start_date=args.start, end_date=args.end, chunk_size=args.chunk_size
+    )
+    print(
+        f"导出 {report['rows']} 条记录到 {args.file}，{report['chunks']} 块，"
+        f"耗时 {report['seconds']:.2f} 秒（{report['rows_per_sec']:.0f} 行/秒）"
+    )
+    return 0
+
+def archive(args):
+    """把旧记录归档为Parquet文件"""
+    report = archive_records(
+        args.older_than_days, args.user_buckets, args.chunk_size,
+        progress=lambda month, records: print(f"已归档 {month}，累计 {records} 条", file=sys.stderr)
+    )
+    print(
+        f"归档 {report['months']} 个月 {report['records']} 条记录，{report['files']} 个文件，"
+        f"{report['bytes'] / 1024 / 1024:.1f} MB，耗时 {report['seconds']:.2f} 秒"
+        f"（{report['rows_per_sec']:.0f} 行/秒）"
+    )
+    return 0
+
+def copy_to_postgres(args):
+    """把SQLite数据库复制到PostgreSQL"""
+    # 只在使用PostgreSQL时才需要 psycopg2
+    from dbcopy import copy_database
+    report = copy_database(
+        args.source, args.url, truncate=args.truncate, chunk_size=args.chunk_size,
+        progress=lambda table, rows: print(f"已复制 {table}：{rows} 行", file=sys.stderr)
+    )
+    print(
+        f"复制 {report['tables']} 张表 {report['rows']} 行，耗时 {report['seconds']:.2f} 秒"
+        f"（{report['rows_per_sec']:.0f} 行/秒）"
+    )
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="健身追踪系统维护工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    subparsers.add_parser("check-plans", help="检查热点查询的执行计划").set_defaults(func=check_plans)
+    subparsers.add_parser("rebuild-stats", help="重建用户每日汇总表").set_defaults(func=rebuild_stats)
+    
+    import_parser = subparsers.add_parser("import", help="为用户批量导入锻炼记录")
+    import_parser.add_argument("username", help="用户名")
+    import_parser.add_argument("file", help="CSV、JSON Lines 或 GPX 文件")
+    import_parser.add_argument("--format", choices=SUPPORTED_FORMATS, help="文件格式，默认按扩展名判断")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="每个事务写入的记录数")
+    import_parser.set_defaults(func=import_records)
+    
+    generate_parser = subparsers.add_parser("generate", help="生成合成数据库用于性能测试")
+    generate_parser.add_argument("path", help="新数据库文件路径，文件不能已存在")
+    generate_parser.add_argument("--users", type=int, default=10000, help="用户数")
+    generate_parser.add_argument("--records-per-user", type=int, default=50, help="每个用户的平均记录数")
+    generate_parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    generate_parser.add_argument("--days", type=int, default=365, help="记录日期分布的最大天数")
+    generate_parser.add_argument("--anchor-date", default=DATAGEN_ANCHOR_DATE, help="记录日期的截止日(YYYY-MM-DD)")
+    generate_parser.set_defaults(func=generate, init=False)
+    
+    train_parser = subparsers.add_parser("train", help="训练卡路里模型")
+    train_parser.add_argument("--incremental", action="store_true", help="只用上次训练之后的新记录增加树")
+    train_parser.add_argument("--trees", type=int, help="树的数量，增量更新时为新增的树数")
+    train_parser.add_argument("--max-depth", type=int, default=10, help="树的最大深度")
+    train_parser.add_argument("--min-samples-split", type=int, default=2, help="分裂所需的最小样本数")
+    train_parser.add_argument("--n-jobs", type=int, default=TRAINING_N_JOBS, help="使用的CPU核数")
+    train_parser.set_defaults(func=train)
+    
+    backfill_parser = subparsers.add_parser("backfill-calories", help="估算未填写或默认值的卡路里")
+    backfill_parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="每个事务回填的记录数")
+    backfill_parser.add_argument("--met-only", action="store_true", help="不使用模型，只按代谢当量估算")
+    backfill_parser.set_defaults(func=backfill)
+    
+    backup_parser = subparsers.add_parser("backup", help="在线备份数据库并校验")
+    backup_parser.add_argument("--pages", type=int, default=BACKUP_PAGES_PER_STEP, help="每步复制的页数")
+    backup_parser.add_argument("--sleep", type=float, default=BACKUP_STEP_SLEEP, help="每步之间暂停的秒数")
+    backup_parser.set_defaults(func=backup)
+    
+    export_parser = subparsers.add_parser("export", help="分块导出锻炼记录")
+    export_parser.add_argument("file", help="导出文件路径")
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, help="文件格式，默认按扩展名判断")
+    export_parser.add_argument("--user", help="只导出该用户的记录")
+    export_parser.add_argument("--start", help="开始日期 YYYY-MM-DD")
+    export_parser.add_argument("--end", help="结束日期 YYYY-MM-DD（含）")
+    export_parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="每块记录数")
+    export_parser.set_defaults(func=export)
+    
+    archive_parser = subparsers.add_parser("archive", help="把旧记录按月归档为Parquet文件")
+    archive_parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS, help="归档该天数前所在月份之前的记录")
+    archive_parser.add_argument("--user-buckets", type=int, default=ARCHIVE_USER_BUCKETS, help="每月按用户哈希分成的桶数，0 表示不分桶")
+    archive_parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK_SIZE, help="每次读取的记录数")
+    archive_parser.set_defaults(func=archive)
+    
+    copy_parser = subparsers.add_parser("copy-to-postgres", help="把SQLite数据库复制到PostgreSQL")
+    copy_parser.add_argument("url", help="目标数据库地址 postgresql://用户:密码@主机/库名")
+    copy_parser.add_argument("--source", default=DATABASE_PATH, help="源SQLite数据库文件")
+    copy_parser.add_argument("--truncate", action="store_true", help="先清空目标库中的应用表")
+    copy_parser.add_argument("--chunk-size", type=int, default=PG_COPY_CHUNK_SIZE, help="每批写入的行数")
+    copy_parser.set_defaults(func=copy_to_postgres, init=False)
+    
+    args = parser.parse_args(argv)
+    if getattr(args, 'init', True):
+        init_database()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,362 @@
+"""数据库结构迁移
+
+每个迁移对应一个 PRAGMA user_version 版本号（PostgreSQL记录在 schema_version 表中），
+按版本顺序在各自的事务中执行一次。新增表、索引或字段时，在 MIGRATIONS 末尾追加一项即可。
+迁移按SQLite方言编写，PostgreSQL连接执行时自动改写，数据回填语句需同时适用于两者。
+"""
+
+from config import INTENSITY_CALORIES
+
+def intensity_load_sql(column='intensity'):
+    """按运动强度换算负荷的 CASE 表达式，权重来自 INTENSITY_CALORIES"""
+    cases = ' '.join(
+        f"WHEN '{level}' THEN {weight}" for level, weight in INTENSITY_CALORIES.items()
+    )
+    return f'CASE {column} {cases} ELSE 0 END'
+
+def activity_cube_select(condition='TRUE'):
+    """按日期、运动类型、强度和性别汇总锻炼记录的查询，用于创建和重建全站活动立方体
+
+    condition 为对锻炼记录 er 的额外筛选条件。
+    """
+    return f'''
+        SELECT date(er.date), er.exercise_type, COALESCE(er.intensity, ''), COALESCE(u.gender, ''),
+               COUNT(*), COALESCE(SUM(er.duration), 0), COALESCE(SUM(er.calories_burned), 0)
+        FROM exercise_records er
+        LEFT JOIN users u ON u.user_id = er.user_id
+        WHERE er.exercise_type IS NOT NULL AND er.date IS NOT NULL AND {condition}
+        GROUP BY date(er.date), er.exercise_type, COALESCE(er.intensity, ''), COALESCE(u.gender, '')
+    '''
+
+def _copy_archived_import_keys(conn):
+    """把已归档文件中的导入键写入 archived_import_keys"""
+    import pyarrow.parquet as pq
+    import archive
+    
+    for row in conn.execute('SELECT path FROM archive_files').fetchall():
+        table = pq.read_table(archive.ARCHIVE_DIR / row['path'], columns=['user_id', 'import_key'])
+        conn.executemany('''
+            INSERT INTO archived_import_keys (user_id, import_key) VALUES (?, ?)
+            ON CONFLICT (user_id, import_key) DO NOTHING
+        ''', [
+            (user_id, import_key) for user_id, import_key in
+            zip(table.column('user_id').to_pylist(), table.column('import_key').to_pylist())
+            if user_id is not None and import_key is not None
+        ])
+
+MIGRATIONS = [
+    (1, "创建用户、锻炼记录和用户设置表", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            age INTEGER,
+            gender TEXT,
+            fitness_goal TEXT,
+            preferred_exercise TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS exercise_records (
+            record_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            exercise_type TEXT,
+            duration INTEGER,
+            intensity TEXT,
+            calories_burned FLOAT,
+            notes TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id TEXT PRIMARY KEY,
+            daily_exercise_goal INTEGER,
+            weekly_exercise_goal INTEGER,
+            reminder_time TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+    ]),
+    (2, "锻炼记录按用户和按日期查询的索引", [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_exercise_records_user_date
+        ON exercise_records (user_id, date)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_exercise_records_date_user
+        ON exercise_records (date, user_id, exercise_type, duration, calories_burned)
+        ''',
+    ]),
+    (3, "创建模型参数表", [
+        '''
+        CREATE TABLE IF NOT EXISTS model_params (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            n_estimators INTEGER,
+            max_depth INTEGER,
+            min_samples_split INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (4, "创建用户每日运动汇总表并回填", [
+        '''
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            exercise_type TEXT NOT NULL,
+            workouts INTEGER NOT NULL DEFAULT 0,
+            duration INTEGER NOT NULL DEFAULT 0,
+            calories FLOAT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, exercise_type)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT INTO user_daily_stats
+            (user_id, day, exercise_type, workouts, duration, calories)
+        SELECT user_id, date(date), exercise_type,
+               COUNT(*), COALESCE(SUM(duration), 0), COALESCE(SUM(calories_burned), 0)
+        FROM exercise_records
+        WHERE user_id IS NOT NULL AND exercise_type IS NOT NULL
+        GROUP BY user_id, date(date), exercise_type
+        ''',
+    ]),
+    (5, "创建用户写入代数表", [
+        '''
+        CREATE TABLE IF NOT EXISTS user_write_generations (
+            user_id TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (6, "每日汇总增加运动负荷字段", [
+        '''
+        ALTER TABLE user_daily_stats
+        ADD COLUMN intensity_load FLOAT NOT NULL DEFAULT 0
+        ''',
+        lambda conn: conn.execute(f'''
+            UPDATE user_daily_stats SET intensity_load = (
+                SELECT COALESCE(SUM({intensity_load_sql('er.intensity')}), 0)
+                FROM exercise_records er
+                WHERE er.user_id = user_daily_stats.user_id
+                  AND CAST(date(er.date) AS TEXT) = user_daily_stats.day
+                  AND er.exercise_type = user_daily_stats.exercise_type
+            )
+        '''),
+    ]),
+    (7, "锻炼记录增加导入键，用于批量导入去重", [
+        '''
+        ALTER TABLE exercise_records ADD COLUMN import_key TEXT
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_exercise_records_import_key
+        ON exercise_records (user_id, import_key)
+        WHERE import_key IS NOT NULL
+        ''',
+    ]),
+    (8, "模型参数表记录模型文件和训练数据量", [
+        '''
+        ALTER TABLE model_params ADD COLUMN artifact_path TEXT
+        ''',
+        '''
+        ALTER TABLE model_params ADD COLUMN training_rows INTEGER
+        ''',
+    ]),
+    (9, "后台训练任务表", [
+        '''
+        CREATE TABLE IF NOT EXISTS training_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            n_estimators INTEGER,
+            max_depth INTEGER,
+            min_samples_split INTEGER,
+            n_jobs INTEGER,
+            training_rows INTEGER,
+            progress REAL NOT NULL DEFAULT 0,
+            model_version INTEGER,
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            seconds REAL
+        )
+        ''',
+    ]),
+    (10, "超参数搜索任务和排行榜", [
+        '''
+        ALTER TABLE training_jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'train'
+        ''',
+        '''
+        ALTER TABLE training_jobs ADD COLUMN search_mode TEXT
+        ''',
+        '''
+        ALTER TABLE training_jobs ADD COLUMN cv_folds INTEGER
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS search_results (
+            job_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            n_estimators INTEGER,
+            max_depth INTEGER,
+            min_samples_split INTEGER,
+            iteration INTEGER,
+            n_samples INTEGER,
+            mae REAL,
+            mae_std REAL,
+            fit_seconds REAL,
+            PRIMARY KEY (job_id, rank)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (11, "模型记录训练数据的记录ID高水位和增量更新的基础版本", [
+        '''
+        ALTER TABLE model_params ADD COLUMN record_watermark INTEGER
+        ''',
+        '''
+        ALTER TABLE model_params ADD COLUMN base_version INTEGER
+        ''',
+    ]),
+    (12, "锻炼记录标记估算的卡路里", [
+        '''
+        ALTER TABLE exercise_records ADD COLUMN calories_estimated INTEGER NOT NULL DEFAULT 0
+        ''',
+    ]),
+    (13, "每日汇总按日期的覆盖索引，用于全站活动统计和排名", [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_user_daily_stats_day
+        ON user_daily_stats(day, exercise_type, user_id, workouts, duration, calories)
+        ''',
+    ]),
+    (14, "创建全站每日活动立方体并回填", [
+        '''
+        CREATE TABLE IF NOT EXISTS daily_activity_cube (
+            day TEXT NOT NULL,
+            exercise_type TEXT NOT NULL,
+            intensity TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            workouts INTEGER NOT NULL DEFAULT 0,
+            duration INTEGER NOT NULL DEFAULT 0,
+            calories FLOAT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, exercise_type, intensity, gender)
+        ) WITHOUT ROWID
+        ''',
+        f'''
+        INSERT INTO daily_activity_cube
+            (day, exercise_type, intensity, gender, workouts, duration, calories)
+        {activity_cube_select()}
+        ''',
+    ]),
+    (15, "数据库备份记录表", [
+        '''
+        CREATE TABLE IF NOT EXISTS backup_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'running',
+            path TEXT,
+            pages INTEGER,
+            bytes INTEGER,
+            copy_seconds REAL,
+            verify_seconds REAL,
+            integrity TEXT,
+            error TEXT,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+    ]),
+    (16, "冷数据归档的文件清单和按月汇总", [
+        '''
+        CREATE TABLE IF NOT EXISTS archive_files (
+            path TEXT PRIMARY KEY,
+            month TEXT NOT NULL,
+            bucket INTEGER,
+            buckets INTEGER,
+            records INTEGER NOT NULL,
+            min_record_id INTEGER,
+            max_record_id INTEGER,
+            bytes INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS archive_months (
+            month TEXT PRIMARY KEY,
+            records INTEGER NOT NULL DEFAULT 0,
+            duration INTEGER NOT NULL DEFAULT 0,
+            calories FLOAT NOT NULL DEFAULT 0,
+            files INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (17, "训练任务记录所属进程和心跳时间", [
+        '''
+        ALTER TABLE training_jobs ADD COLUMN owner TEXT
+        ''',
+        '''
+        ALTER TABLE training_jobs ADD COLUMN heartbeat_at TIMESTAMP
+        ''',
+    ]),
+    (18, "已归档记录的导入键，重复导入时与库内记录一起去重", [
+        '''
+        CREATE TABLE IF NOT EXISTS archived_import_keys (
+            user_id TEXT NOT NULL,
+            import_key TEXT NOT NULL,
+            PRIMARY KEY (user_id, import_key)
+        ) WITHOUT ROWID
+        ''',
+        _copy_archived_import_keys,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    """获取数据库当前的结构版本"""
+    if getattr(conn, 'dialect', 'sqlite') == 'postgresql':
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+        return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def _set_schema_version(conn, version):
+    """记录数据库的结构版本"""
+    if getattr(conn, 'dialect', 'sqlite') == 'postgresql':
+        conn.execute('DELETE FROM schema_version')
+        conn.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+    else:
+        conn.execute(f'PRAGMA user_version = {version}')
+
+def migrate(conn):
+    """执行尚未应用的迁移，返回本次应用的版本号列表
+
+    迁移步骤可以是SQL语句，也可以是接收连接的函数。
+    """
+    applied = []
+    if get_schema_version(conn) >= LATEST_VERSION:
+        return applied
+    
+    for version, description, steps in MIGRATIONS:
+        # 获取写锁后再确认版本，避免多个进程重复执行同一迁移
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            _set_schema_version(conn, version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    
+    return applied
@@ -0,0 +1,272 @@
+"""卡路里预测模型
+
+根据年龄、性别、运动时长和强度预测锻炼消耗的卡路里。
+训练好的模型保存为 MODEL_DIR 下带版本号的文件，并在 model_params 中登记；
+各进程按需加载最新版本并常驻内存，发现新版本时自动重新加载。
+"""
+import os
+import threading
+import time
+import uuid
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingGridSearchCV, HalvingRandomSearchCV, KFold
+from database import get_db_connection
+from config import (
+    MODEL_DIR, MODEL_RELOAD_INTERVAL, MODEL_MAX_TREES, SEARCH_FOLDS, SEARCH_CANDIDATES,
+    SEARCH_PARAM_GRID, SEARCH_PARAM_RANGES
+)
+
+FEATURES = ['age', 'gender', 'duration', 'intensity']
+GENDER_CODES = {'男': 0, '女': 1}
+INTENSITY_CODES = {'低': 0, '中': 1, '高': 2}
+
+# 训练所需的最少记录数
+MIN_TRAINING_ROWS = 10
+
+# 超参数搜索的参数
+SEARCH_PARAMS = ['n_estimators', 'max_depth', 'min_samples_split']
+
+# 分批训练时进度汇报的次数
+PROGRESS_STEPS = 10
+
+# 每个模型版本最多缓存的预测结果数
+PREDICTION_CACHE_SIZE = 4096
+
+def prepare_features(records):
+    """把训练数据转换为特征矩阵和目标值，丢弃无法编码的记录"""
+    features = records[FEATURES].copy()
+    features['gender'] = features['gender'].map(GENDER_CODES)
+    features['intensity'] = features['intensity'].map(INTENSITY_CODES)
+    valid = features.notna().all(axis=1)
+    return features[valid].to_numpy(dtype=float), records.loc[valid, 'calories_burned']
+
+def _grow_forest(model, X, y, n_estimators, progress=None):
+    """把森林扩充到 n_estimators 棵树，新增的树只用 X、y 训练
+
+    传入 progress 时分批增加，每批完成后调用 progress(已新增树数, 需新增树数)，
+    回调可以抛出异常中止训练。
+    """
+    existing = len(getattr(model, 'estimators_', []))
+    if progress is None:
+        model.set_params(n_estimators=n_estimators)
+        model.fit(X, y)
+        return model
+    
+    total = n_estimators - existing
+    step = max(1, total // PROGRESS_STEPS)
+    for trees in range(existing + step, n_estimators + step, step):
+        model.set_params(n_estimators=min(trees, n_estimators))
+        model.fit(X, y)
+        progress(len(model.estimators_) - existing, total)
+    return model
+
+def fit_calorie_model(records, n_estimators, max_depth, min_samples_split, n_jobs=None, progress=None):
+    """训练随机森林模型，数据量不足时返回 None
+
+    progress 的用法见 _grow_forest。
+    """
+    X, y = prepare_features(records)
+    if len(y) < MIN_TRAINING_ROWS:
+        return None
+    
+    model = RandomForestRegressor(
+        max_depth=max_depth,
+        min_samples_split=min_samples_split,
+        n_jobs=n_jobs,
+        random_state=42,
+        warm_start=progress is not None
+    )
+    _grow_forest(model, X, y, n_estimators, progress)
+    model.set_params(warm_start=False)
+    return model
+
+def extend_calorie_model(model, records, trees, n_jobs=None, progress=None, max_trees=MODEL_MAX_TREES):
+    """用新记录在已有森林上增加 trees 棵树，新记录不足时返回 None
+
+    原有的树保持不变，森林超过 max_trees 棵时丢弃最早训练的树，
+    预测结果逐渐偏向近期数据。
+    """
+    X, y = prepare_features(records)
+    if len(y) < MIN_TRAINING_ROWS:
+        return None
+    
+    model.set_params(warm_start=True, n_jobs=n_jobs)
+    _grow_forest(model, X, y, len(model.estimators_) + trees, progress)
+    if len(model.estimators_) > max_trees:
+        model.estimators_ = model.estimators_[-max_trees:]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+    return model
+
+def search_calorie_params(records, mode='grid', folds=SEARCH_FOLDS, n_jobs=-1, n_candidates=SEARCH_CANDIDATES):
+    """用逐次减半的K折交叉验证搜索随机森林超参数，数据量不足时返回 None
+
+    mode 为 grid 时遍历 SEARCH_PARAM_GRID，为 random 时从 SEARCH_PARAM_RANGES 中
+    抽取 n_candidates 组参数。每轮只保留较好的三分之一候选，并把训练样本数扩大三倍，
+    起始样本数按最后一轮用满全部数据倒推，各折的训练分散到 n_jobs 个进程。返回每组参数到达的最后一轮结果，
+    按轮次从高到低、平均绝对误差从低到高排序。
+    """
+    X, y = prepare_features(records)
+    if len(y) < max(MIN_TRAINING_ROWS, folds * 2):
+        return None
+    
+    # 并行放在交叉验证层，单个森林只用一个核
+    options = {
+        'cv': KFold(n_splits=folds, shuffle=True, random_state=42),
+        'scoring': 'neg_mean_absolute_error',
+        'factor': 3,
+        'min_resources': 'exhaust',
+        'n_jobs': n_jobs,
+        'refit': False,
+        'random_state': 42
+    }
+    estimator = RandomForestRegressor(random_state=42)
+    if mode == 'grid':
+        search = HalvingGridSearchCV(estimator, SEARCH_PARAM_GRID, **options)
+    elif mode == 'random':
+        search = HalvingRandomSearchCV(estimator, SEARCH_PARAM_RANGES, n_candidates=n_candidates, **options)
+    else:
+        raise ValueError(f"未知的搜索方式：{mode}")
+    search.fit(X, y)
+    
+    results = search.cv_results_
+    final = {}
+    for i, params in enumerate(results['params']):
+        row = {name: int(params[name]) for name in SEARCH_PARAMS}
+        row.update({
+            'iteration': int(results['iter'][i]),
+            'n_samples': int(results['n_resources'][i]),
+            'mae': float(-results['mean_test_score'][i]),
+            'mae_std': float(results['std_test_score'][i]),
+            'fit_seconds': float(results['mean_fit_time'][i])
+        })
+        key = tuple(row[name] for name in SEARCH_PARAMS)
+        if key not in final or row['iteration'] > final[key]['iteration']:
+            final[key] = row
+    
+    return sorted(final.values(), key=lambda row: (-row['iteration'], row['mae']))
+
+def publish_model(model, n_estimators, max_depth, min_samples_split, training_rows,
+                  record_watermark=None, base_version=None):
+    """保存模型文件并登记到 model_params，返回模型版本号
+
+    record_watermark 是训练用到的最大记录ID，下次增量更新从它之后开始；
+    增量更新得到的模型用 base_version 记录它所基于的版本。
+    先写临时文件再登记和改名，数据库写锁只在登记时短暂持有。
+    """
+    MODEL_DIR.mkdir(parents=True, exist_ok=True)
+    temp_path = MODEL_DIR / f"calorie_model_{uuid.uuid4().hex}.tmp"
+    joblib.dump(model, temp_path)
+    
+    try:
+        with get_db_connection() as conn:
+            version = conn.execute('''
+                INSERT INTO model_params (
+                    n_estimators, max_depth, min_samples_split, training_rows,
+                    record_watermark, base_version
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                n_estimators, max_depth, min_samples_split, training_rows,
+                record_watermark, base_version
+            )).lastrowid
+            artifact = f"calorie_model_v{version}.joblib"
+            os.replace(temp_path, MODEL_DIR / artifact)
+            conn.execute(
+                'UPDATE model_params SET artifact_path = ? WHERE id = ?',
+                (artifact, version)
+            )
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+    
+    return version
+
+def get_latest_model_info():
+    """获取最新已发布模型的参数，没有时返回 None"""
+    with get_db_connection() as conn:
+        row = conn.execute('''
+            SELECT * FROM model_params
+            WHERE artifact_path IS NOT NULL
+            ORDER BY id DESC
+            LIMIT 1
+        ''').fetchone()
+    return dict(row) if row else None
+
+def load_model(info):
+    """加载 model_params 中登记的模型文件"""
+    return joblib.load(MODEL_DIR / info['artifact_path'])
+
+def _predict_one(model, row):
+    """预测单条样本
+
+    随机森林直接对各棵树求平均，避开 predict 的并行调度开销。
+    """
+    x = np.asarray([row], dtype=np.float32)
+    estimators = getattr(model, 'estimators_', None)
+    if estimators is None:
+        return float(model.predict(x)[0])
+    return float(sum(tree.tree_.predict(x)[0, 0] for tree in estimators) / len(estimators))
+
+class CalorieModelCache:
+    """进程内常驻的最新模型
+
+    距上次检查超过 reload_interval 秒时查询 model_params，有新版本即重新加载。
+    """
+
+    def __init__(self, reload_interval=MODEL_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._model = None
+        self._version = None
+        self._checked_at = None
+        self._predictions = {}
+
+    def get(self):
+        """返回 (版本号, 模型)，尚无已发布模型时返回 (None, None)"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.reload_interval:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at >= self.reload_interval:
+                    self._reload_if_newer()
+                    self._checked_at = now
+        return self._version, self._model
+
+    def _reload_if_newer(self):
+        """加载比当前更新的模型版本"""
+        info = get_latest_model_info()
+        if info is None or info['id'] == self._version:
+            return
+        model = load_model(info)
+        self._model, self._version = model, info['id']
+        self._predictions = {}
+
+    def predict(self, age, gender, duration, intensity):
+        """预测消耗的卡路里，没有可用模型或特征无法编码时返回 None"""
+        version, model = self.get()
+        gender_code = GENDER_CODES.get(gender)
+        intensity_code = INTENSITY_CODES.get(intensity)
+        if model is None or age is None or gender_code is None or intensity_code is None:
+            return None
+        
+        key = (version, age, gender_code, duration, intensity_code)
+        predictions = self._predictions
+        if key not in predictions:
+            if len(predictions) >= PREDICTION_CACHE_SIZE:
+                predictions.clear()
+            predictions[key] = _predict_one(model, key[1:])
+        return predictions[key]
+
+    def clear(self):
+        """卸载模型，下次使用时重新加载"""
+        with self._lock:
+            self._model = self._version = self._checked_at = None
+            self._predictions = {}
+
+calorie_model = CalorieModelCache()
+
+def predict_calories(age, gender, duration, intensity):
+    """用最新发布的模型预测消耗的卡路里"""
+    return calorie_model.predict(age, gender, duration, intensity)
@@ -1,10 +1,40 @@
+import json
+import os
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 from datetime import datetime, timedelta
-from database import get_db_connection
-import numpy as np
-from sklearn.ensemble import RandomForestRegressor
+from cache import record_cache
+from backup import backup_database as run_backup, get_backup_runs
+from export import export_file, EXPORT_FORMATS
+from archive import archive_records, get_archive_months
+from query_stats import query_recorder
+from write_queue import record_writer
+from database import (
+    get_db_connection, get_pool_stats, get_user_page, rebuild_daily_stats,
+    get_daily_activity, get_leaderboard, get_user
+)
+from training_jobs import (
+    submit_training_job, submit_incremental_job, submit_search_job, cancel_training_job, get_training_jobs,
+    get_latest_search, get_search_results, promote_search_result, ACTIVE_STATUSES
+)
+from model import get_latest_model_info
+from config import (
+    TRAINING_N_JOBS, SEARCH_FOLDS, ACTIVITY_WINDOWS, LEADERBOARD_TOP_N,
+    EXPORT_DIR, EXPORT_DOWNLOAD_MAX_BYTES, ARCHIVE_AFTER_DAYS, WRITE_ACK_TIMEOUT
+)
+
+ACTIVITY_DIMENSION_NAMES = {
+    'exercise_type': "运动类型",
+    'intensity': "运动强度",
+    'gender': "性别"
+}
+
+ACTIVITY_METRIC_NAMES = {
+    'count': "锻炼次数",
+    'duration': "运动时长(分钟)",
+    'calories': "消耗卡路里"
+}
 
 def show(page):
     if not st.session_state.is_admin:
@@ -22,14 +52,28 @@ def show_user_management():
     """用户管理页面"""
     st.header("用户管理")
     
-    conn = get_db_connection()
-    users = pd.read_sql_query('SELECT * FROM users', conn)
+    col1, col2 = st.columns([3, 1])
+    keyword = col1.text_input("按用户名筛选")
+    page_size = col2.selectbox("每页人数", [10, 20, 50, 100], index=1)
+    
+    # 筛选条件变化时回到第一页，cursors 保存每一页的起始用户名
+    page_filter = (keyword, page_size)
+    if st.session_state.get('user_page_filter') != page_filter:
+        st.session_state.user_page_filter = page_filter
+        st.session_state.user_page_cursors = [None]
+    cursors = st.session_state.user_page_cursors
+    
+    users, has_more = get_user_page(cursors[-1], page_size, keyword)
     
     # 显示用户列表
     st.subheader("用户列表")
+    st.caption(f"第 {len(cursors)} 页")
+    
+    if not users:
+        st.info("没有符合条件的用户")
     
     # 为每个用户创建一个可展开的部分
-    for _, user in users.iterrows():
+    for user in users:
         with st.expander(f"用户: {user['username']}"):
             col1, col2 = st.columns(2)
             
@@ -41,82 +85,70 @@ def show_user_management():
                 st.write(f"注册时间: {user['created_at']}")
             
             with col2:
-                # 获取用户的锻炼记录
-                records = pd.read_sql_query(
-                    'SELECT * FROM exercise_records WHERE user_id = ?',
-                    conn,
-                    params=(user['user_id'],)
-                )
-                st.write(f"锻炼记录数: {len(records)}")
-                if len(records) > 0:
-                    st.write(f"最近锻炼: {records['date'].max()}")
-                    st.write(f"总运动时长: {records['duration'].sum()}分钟")
+                st.write(f"锻炼记录数: {user['record_count']}")
+                if user['record_count'] > 0:
+                    st.write(f"最近锻炼: {user['last_exercise']}")
+                    st.write(f"总运动时长: {user['total_duration']}分钟")
             
             # 编辑用户信息按钮
             if st.button(f"编辑用户 {user['username']}", key=f"edit_{user['user_id']}"):
                 st.session_state.editing_user = user['user_id']
     
-    conn.close()
+    # 翻页
+    col_prev, col_next = st.columns(2)
+    if col_prev.button("上一页", disabled=len(cursors) == 1, use_container_width=True):
+        cursors.pop()
+        st.rerun()
+    if col_next.button("下一页", disabled=not has_more, use_container_width=True):
+        cursors.append(users[-1]['username'])
+        st.rerun()
 
 def show_data_analysis():
     """数据分析页面"""
     st.header("数据分析")
     
-    conn = get_db_connection()
+    col1, col2 = st.columns(2)
+    days = col1.selectbox("统计天数", ACTIVITY_WINDOWS, index=ACTIVITY_WINDOWS.index(10))
+    top_n = col2.number_input("排名人数", min_value=1, max_value=100, value=LEADERBOARD_TOP_N)
     
-    # 获取过去10天的数据
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=10)
+    # 全站运动情况，可任选日期范围并按强度或性别细分
+    st.subheader("运动情况")
+    today = datetime.now().date()
+    col1, col2, col3 = st.columns([2, 1, 1])
+    date_range = col1.date_input("日期范围", (today - timedelta(days=days), today))
+    dimension = col2.selectbox("分组", list(ACTIVITY_DIMENSION_NAMES), format_func=ACTIVITY_DIMENSION_NAMES.get)
+    metric = col3.selectbox("指标", list(ACTIVITY_METRIC_NAMES), format_func=ACTIVITY_METRIC_NAMES.get)
     
-    records = pd.read_sql_query('''
-        SELECT er.*, u.username 
-        FROM exercise_records er
-        JOIN users u ON er.user_id = u.user_id
-        WHERE er.date >= ?
-    ''', conn, params=(start_date.strftime('%Y-%m-%d'),))
+    if len(date_range) != 2:
+        st.info("请选择结束日期")
+        return
+    daily_stats = get_daily_activity(date_range[0], date_range[1], dimension)
     
-    if len(records) == 0:
+    if len(daily_stats) == 0:
         st.info("暂无数据")
         return
     
-    # 显示过去10天的运动情况
-    st.subheader("过去10天运动情况")
-    records['date'] = pd.to_datetime(records['date'])
-    daily_stats = records.groupby(['date', 'exercise_type']).size().reset_index(name='count')
-    
     fig_daily = px.bar(
         daily_stats,
         x='date',
-        y='count',
-        color='exercise_type',
-        title='每日运动类型分布'
+        y=metric,
+        color=dimension,
+        title=f'每日{ACTIVITY_METRIC_NAMES[metric]}（按{ACTIVITY_DIMENSION_NAMES[dimension]}）',
+        labels={'date': '日期', metric: ACTIVITY_METRIC_NAMES[metric], dimension: ACTIVITY_DIMENSION_NAMES[dimension]}
     )
     st.plotly_chart(fig_daily)
     
-    # 显示排名前三的用户
-    st.subheader("用户排名")
-    user_stats = records.groupby('username').agg({
-        'duration': 'sum',
-        'calories_burned': 'sum'
-    }).reset_index()
-    
-    user_stats['score'] = (
-        user_stats['duration'] / user_stats['duration'].max() * 0.5 +
-        user_stats['calories_burned'] / user_stats['calories_burned'].max() * 0.5
-    )
-    
-    top_users = user_stats.nlargest(3, 'score')
-    
+    # 显示排名靠前的用户
+    st.subheader(f"用户排名（过去{days}天）")
+    top_users = get_leaderboard(days, top_n)
     fig_ranking = px.bar(
         top_users,
         x='username',
         y='score',
-        title='用户健身评分排名（前三名）',
+        title=f'用户健身评分排名（前{top_n}名）',
         labels={'username': '用户名', 'score': '综合评分'}
     )
     st.plotly_chart(fig_ranking)
-    
-    conn.close()
 
 def show_system_settings():
     """系统设置页面"""
@@ -129,18 +161,89 @@ def show_system_settings():
         n_estimators = st.slider("随机森林树的数量", 10, 200, 100)
         max_depth = st.slider("树的最大深度", 3, 20, 10)
         min_samples_split = st.slider("分裂所需的最小样本数", 2, 10, 2)
+        cpu_count = os.cpu_count() or 1
+        n_jobs = st.number_input(
+            "训练使用的CPU核数", min_value=1, max_value=cpu_count, value=min(TRAINING_N_JOBS, cpu_count)
+        )
         
         if st.form_submit_button("重新训练模型"):
-            retrain_model(n_estimators, max_depth, min_samples_split)
+            retrain_model(n_estimators, max_depth, min_samples_split, n_jobs)
+    
+    # 增量更新只用上次训练之后的新记录
+    current_model = get_latest_model_info()
+    col1, col2 = st.columns([1, 3])
+    if col1.button("增量更新模型", disabled=current_model is None or current_model['record_watermark'] is None):
+        update_model()
+    if current_model is not None:
+        col2.caption(
+            f"当前模型 v{current_model['id']}：{current_model['n_estimators']} 棵树，"
+            f"已训练至记录 #{current_model['record_watermark']}"
+        )
+    
+    with st.form("param_search"):
+        st.markdown("**超参数搜索**")
+        col1, col2 = st.columns(2)
+        mode = col1.radio("搜索方式", ["网格搜索", "随机搜索"], horizontal=True)
+        folds = col2.number_input("交叉验证折数", min_value=3, max_value=10, value=SEARCH_FOLDS)
+        
+        if st.form_submit_button("开始搜索"):
+            search_params('grid' if mode == "网格搜索" else 'random', folds)
+    
+    show_training_jobs()
+    show_search_leaderboard()
     
     # 系统维护选项
     st.subheader("系统维护")
     
     if st.button("备份数据库"):
         backup_database()
+    show_backup_runs()
+    
+    col1, col2 = st.columns([1, 3])
+    if col1.button("归档旧记录"):
+        archive_old_records()
+    col2.caption(f"把 {ARCHIVE_AFTER_DAYS} 天前所在月份之前的锻炼记录移到 Parquet 文件，统计汇总保持不变")
+    show_archive_months()
+    
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        if st.button("清理缓存"):
+            clear_cache()
+    with col2:
+        cache_stats = record_cache.stats()
+        st.caption(
+            f"用户数据缓存：命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次，"
+            f"命中率 {cache_stats['hit_rate']:.1%}，"
+            f"{cache_stats['entries']} 项 / {cache_stats['bytes'] / 1024 / 1024:.1f} MB"
+        )
+    
+    if st.button("重建统计汇总"):
+        rebuild_stats()
+    
+    show_export_form()
+    
+    # 数据库连接池状态
+    st.subheader("数据库连接池")
+    pool_stats = get_pool_stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("借出次数", pool_stats['checkouts'])
+    col2.metric("复用次数", pool_stats['reused'] + pool_stats['nested'])
+    col3.metric("使用中", pool_stats['in_use'])
+    col4.metric("空闲连接", f"{pool_stats['idle']}/{pool_stats['max_idle']}")
+    if 'overflow' in pool_stats:
+        st.caption(f"PostgreSQL 连接池：溢出连接 {pool_stats['overflow']} 个，共创建 {pool_stats['created']} 个连接")
     
-    if st.button("清理缓存"):
-        clear_cache()
+    # 锻炼记录写入队列状态
+    st.subheader("记录写入队列")
+    writer_stats = record_writer.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("排队记录", writer_stats['pending'], help=f"最多 {writer_stats['max_pending']} 条")
+    col2.metric("已写入记录", writer_stats['records'], help=f"失败 {writer_stats['failed']} 次请求")
+    col3.metric("平均每批记录", f"{writer_stats['avg_batch_records']:.1f}", help=f"共 {writer_stats['batches']} 批")
+    col4.metric("平均确认耗时", f"{writer_stats['avg_wait_ms']:.1f} ms")
+    st.caption(f"写入吞吐量 {writer_stats['records_per_sec']:.0f} 条/秒")
+    
+    show_query_stats()
     
     # 系统关机选项
     st.subheader("系统关机")
@@ -152,61 +255,299 @@ def show_system_settings():
         else:
             st.error("请输入关机原因")
 
-def retrain_model(n_estimators, max_depth, min_samples_split):
-    """重新训练机器学习模型"""
+def show_query_stats():
+    """显示SQL语句耗时统计"""
+    st.subheader("慢查询统计")
+    
+    col1, col2 = st.columns([1, 3])
+    top_n = col1.number_input("显示条数", min_value=5, max_value=50, value=10)
+    order = col2.radio("排序方式", ["总耗时", "p99耗时"], horizontal=True)
+    
+    queries = query_recorder.top_queries(top_n, 'total_ms' if order == "总耗时" else 'p99_ms')
+    if not queries:
+        st.info("暂无SQL统计数据")
+    else:
+        table = pd.DataFrame(queries)
+        # 只显示调用次数最多的页面函数
+        table['callers'] = table['callers'].map(lambda callers: max(callers, key=callers.get))
+        st.dataframe(
+            table[['fingerprint', 'calls', 'total_ms', 'avg_ms', 'p99_ms', 'max_ms', 'rows', 'callers']]
+            .rename(columns={
+                'fingerprint': '语句',
+                'calls': '次数',
+                'total_ms': '总耗时(ms)',
+                'avg_ms': '平均(ms)',
+                'p99_ms': 'p99(ms)',
+                'max_ms': '最大(ms)',
+                'rows': '返回行数',
+                'callers': '主要调用方'
+            }),
+            use_container_width=True
+        )
+    
+    col1, col2 = st.columns(2)
+    col1.download_button(
+        "导出JSON",
+        json.dumps(query_recorder.export(), ensure_ascii=False, indent=2),
+        file_name=f"query_stats_{datetime.now():%Y%m%d_%H%M%S}.json",
+        mime="application/json"
+    )
+    if col2.button("重置统计"):
+        query_recorder.reset()
+        st.rerun()
+
+def retrain_model(n_estimators, max_depth, min_samples_split, n_jobs):
+    """提交后台训练任务"""
     try:
-        conn = get_db_connection()
-        
-        # 获取训练数据
-        records = pd.read_sql_query('''
-            SELECT er.*, u.age, u.gender, u.fitness_goal
-            FROM exercise_records er
-            JOIN users u ON er.user_id = u.user_id
-        ''', conn)
-        
-        if len(records) < 10:
-            st.warning("数据量不足，无法训练模型")
-            return
-        
-        # 准备特征
-        records['gender'] = records['gender'].map({'男': 0, '女': 1})
-        records['intensity'] = records['intensity'].map({'低': 0, '中': 1, '高': 2})
+        job_id = submit_training_job(n_estimators, max_depth, min_samples_split, n_jobs)
+        st.success(f"训练任务 #{job_id} 已提交，可在下方查看进度")
+    except Exception as e:
+        st.error(f"提交训练任务失败：{str(e)}")
+
+def update_model():
+    """提交后台增量更新任务"""
+    try:
+        job_id = submit_incremental_job()
+        st.success(f"增量更新任务 #{job_id} 已提交，可在下方查看进度")
+    except Exception as e:
+        st.error(f"提交增量更新任务失败：{str(e)}")
+
+def search_params(mode, folds):
+    """提交后台超参数搜索任务"""
+    try:
+        job_id = submit_search_job(mode, folds)
+        st.success(f"搜索任务 #{job_id} 已提交，完成后在下方显示排行榜")
+    except Exception as e:
+        st.error(f"提交搜索任务失败：{str(e)}")
+
+def show_search_leaderboard():
+    """显示最近一次超参数搜索的排行榜，可一键用最佳参数训练"""
+    search = get_latest_search()
+    if search is None:
+        return
+    
+    st.markdown(f"**搜索排行榜（任务 #{search['job_id']}，{search['cv_folds']} 折交叉验证）**")
+    results = pd.DataFrame(get_search_results(search['job_id']))
+    if results.empty:
+        st.caption("本次搜索没有结果")
+        return
+    
+    st.dataframe(
+        results[['rank', 'n_estimators', 'max_depth', 'min_samples_split', 'mae', 'mae_std', 'fit_seconds', 'iteration', 'n_samples']]
+        .rename(columns={
+            'rank': '排名',
+            'n_estimators': '树的数量',
+            'max_depth': '最大深度',
+            'min_samples_split': '最小分裂样本数',
+            'mae': 'CV MAE',
+            'mae_std': 'MAE标准差',
+            'fit_seconds': '平均训练耗时(秒)',
+            'iteration': '到达轮次',
+            'n_samples': '样本数'
+        }),
+        hide_index=True,
+        use_container_width=True
+    )
+    
+    if st.button("采用最佳参数训练"):
+        try:
+            job_id = promote_search_result(search['job_id'])
+            st.success(f"已用最佳参数提交训练任务 #{job_id}")
+        except Exception as e:
+            st.error(f"提交训练任务失败：{str(e)}")
+
+def show_training_jobs():
+    """显示训练任务列表，有未完成的任务时定时刷新"""
+    jobs = get_training_jobs()
+    active = any(job['status'] in ACTIVE_STATUSES for job in jobs)
+    st.fragment(run_every=2 if active else None)(render_training_jobs)()
+
+def render_training_jobs():
+    """训练任务状态和进度"""
+    st.markdown("**训练任务**")
+    jobs = get_training_jobs()
+    if not jobs:
+        st.caption("暂无训练任务")
+        return
+    
+    status_names = {
+        'queued': "排队中",
+        'running': "训练中",
+        'done': "已完成",
+        'failed': "失败",
+        'cancelled': "已取消"
+    }
+    for job in jobs:
+        col1, col2, col3 = st.columns([2, 3, 1])
+        col1.write(f"#{job['job_id']} {status_names.get(job['status'], job['status'])}")
         
-        X = records[['age', 'gender', 'duration', 'intensity']]
-        y = records['calories_burned']
+        if job['kind'] == 'search':
+            description = f"{'网格' if job['search_mode'] == 'grid' else '随机'}搜索，{job['cv_folds']} 折"
+        elif job['kind'] == 'incremental':
+            description = f"增量更新 +{job['n_estimators']} 棵树，{job['n_jobs']} 核"
+        else:
+            description = f"{job['n_estimators']} 棵树，{job['n_jobs']} 核"
         
-        # 训练模型
-        model = RandomForestRegressor(
-            n_estimators=n_estimators,
-            max_depth=max_depth,
-            min_samples_split=min_samples_split,
-            random_state=42
+        if job['status'] in ACTIVE_STATUSES:
+            col2.progress(job['progress'], text=description)
+            if col3.button("取消", key=f"cancel_job_{job['job_id']}"):
+                cancel_training_job(job['job_id'])
+                st.rerun()
+        elif job['status'] == 'done':
+            result = "已生成排行榜" if job['kind'] == 'search' else f"模型 v{job['model_version']}"
+            col2.caption(
+                f"{description}：{result}，{job['training_rows']} 条数据，耗时 {job['seconds']:.1f} 秒"
+            )
+        elif job['error']:
+            col2.caption(job['error'])
+
+def backup_database():
+    """在线备份数据库并显示复制进度"""
+    progress_bar = st.progress(0.0, text="正在备份...")
+    
+    def report(copied, total):
+        progress_bar.progress(copied / total if total else 1.0, text=f"已复制 {copied}/{total} 页")
+    
+    try:
+        run = run_backup(progress=report)
+        progress_bar.progress(1.0, text="备份完成")
+        st.success(
+            f"数据库备份成功！{run['path']}，{run['bytes'] / 1024 / 1024:.1f} MB，"
+            f"复制 {run['copy_seconds']:.1f} 秒，校验 {run['verify_seconds']:.1f} 秒"
         )
-        model.fit(X, y)
-        
-        # 保存模型参数到数据库
-        save_model_params(n_estimators, max_depth, min_samples_split)
-        
-        st.success("模型训练成功！")
+    except Exception as e:
+        st.error(f"备份失败：{str(e)}")
+
+def show_backup_runs():
+    """显示最近的备份记录"""
+    runs = get_backup_runs(5)
+    if not runs:
+        return
+    
+    table = pd.DataFrame(runs)
+    table['size_mb'] = table['bytes'] / 1024 / 1024
+    st.dataframe(
+        table[['started_at', 'status', 'path', 'size_mb', 'copy_seconds', 'verify_seconds', 'integrity', 'error']]
+        .rename(columns={
+            'started_at': '开始时间',
+            'status': '状态',
+            'path': '文件',
+            'size_mb': '大小(MB)',
+            'copy_seconds': '复制耗时(秒)',
+            'verify_seconds': '校验耗时(秒)',
+            'integrity': '完整性',
+            'error': '错误'
+        }),
+        hide_index=True,
+        use_container_width=True
+    )
+
+def archive_old_records():
+    """归档旧记录并显示进度"""
+    progress_text = st.empty()
+    try:
+        report = archive_records(
+            progress=lambda month, records: progress_text.caption(f"已归档 {month}，累计 {records} 条...")
+        )
+        progress_text.empty()
+        if report['months']:
+            st.success(
+                f"归档完成：{report['months']} 个月 {report['records']} 条记录，"
+                f"{report['bytes'] / 1024 / 1024:.1f} MB，耗时 {report['seconds']:.1f} 秒"
+            )
+        else:
+            st.info("没有需要归档的记录")
+    except Exception as e:
+        st.error(f"归档失败：{str(e)}")
+
+def show_archive_months():
+    """显示各归档月份的汇总"""
+    months = get_archive_months()
+    if not months:
+        return
+    
+    table = pd.DataFrame(months)
+    table['size_mb'] = table['bytes'] / 1024 / 1024
+    with st.expander(f"已归档 {len(months)} 个月，共 {table['records'].sum()} 条记录"):
+        st.dataframe(
+            table[['month', 'records', 'duration', 'calories', 'files', 'size_mb', 'updated_at']]
+            .rename(columns={
+                'month': '月份',
+                'records': '记录数',
+                'duration': '总时长(分钟)',
+                'calories': '总卡路里',
+                'files': '文件数',
+                'size_mb': '大小(MB)',
+                'updated_at': '归档时间'
+            }),
+            hide_index=True,
+            use_container_width=True
+        )
+
+def show_export_form():
+    """导出锻炼记录到服务器文件，文件不大时提供下载"""
+    st.markdown("**导出锻炼记录**")
+    col1, col2, col3 = st.columns(3)
+    fmt = col1.radio("导出格式", EXPORT_FORMATS, horizontal=True, key="admin_export_format")
+    date_range = col2.date_input("日期范围（不选则导出全部）", value=(), key="admin_export_range")
+    username = col3.text_input("用户名（不填则导出全部用户）", key="admin_export_user")
+    
+    if st.button("生成导出文件", key="admin_export"):
+        export_records_to_file(fmt, date_range, username.strip())
+    
+    path = st.session_state.get('admin_export_path')
+    if path is not None and path.exists():
+        size = path.stat().st_size
+        if size <= EXPORT_DOWNLOAD_MAX_BYTES:
+            with open(path, 'rb') as f:
+                st.download_button("下载导出文件", f, file_name=path.name)
+        else:
+            st.caption(f"文件较大（{size / 1024 / 1024:.0f} MB），请从服务器 {path} 获取")
+
+def export_records_to_file(fmt, date_range, username):
+    """导出锻炼记录并显示吞吐量"""
+    try:
+        user_id = None
+        if username:
+            user = get_user(username)
+            if user is None:
+                st.error(f"用户不存在：{username}")
+                return
+            user_id = user['user_id']
         
+        EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        path = EXPORT_DIR / f"exercise_records_{datetime.now():%Y%m%d_%H%M%S}.{fmt}"
+        progress_text = st.empty()
+        report = export_file(
+            path, fmt,
+            user_id=user_id,
+            start_date=date_range[0] if len(date_range) > 0 else None,
+            end_date=date_range[1] if len(date_range) > 1 else None,
+            progress=lambda rows: progress_text.caption(f"已导出 {rows} 条...")
+        )
+        st.session_state.admin_export_path = path
+        progress_text.empty()
+        st.success(
+            f"导出完成：{report['rows']} 条记录，{path.stat().st_size / 1024 / 1024:.1f} MB，"
+            f"耗时 {report['seconds']:.2f} 秒（{report['rows_per_sec']:.0f} 行/秒）"
+        )
     except Exception as e:
-        st.error(f"模型训练失败：{str(e)}")
-    finally:
-        conn.close()
+        st.error(f"导出失败：{str(e)}")
 
-def backup_database():
-    """备份数据库"""
+def rebuild_stats():
+    """根据锻炼记录重建统计汇总表"""
     try:
-        # 实现数据库备份逻辑
-        st.success("数据库备份成功！")
+        rows = rebuild_daily_stats()
+        st.success(f"统计汇总重建成功，共 {rows} 行！")
     except Exception as e:
-        st.error(f"备份失败：{str(e)}")
+        st.error(f"重建失败：{str(e)}")
 
 def clear_cache():
     """清理系统缓存"""
     try:
         st.cache_data.clear()
         st.cache_resource.clear()
+        record_cache.clear()
         st.success("缓存清理成功！")
     except Exception as e:
         st.error(f"缓存清理失败：{str(e)}")
@@ -216,30 +557,7 @@ def shutdown_system(reason):
     st.warning("系统即将关闭...")
     st.write(f"关机原因：{reason}")
     st.write("请保存所有工作，系统将在5秒后关闭。")
+    # 写入队列中尚未提交的记录
+    record_writer.flush(WRITE_ACK_TIMEOUT)
     # 在实际应用中，这里应该实现真正的关机逻辑
     st.stop()
-
-def save_model_params(n_estimators, max_depth, min_samples_split):
-    """保存模型参数到数据库"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    try:
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS model_params (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                n_estimators INTEGER,
-                max_depth INTEGER,
-                min_samples_split INTEGER,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        c.execute('''
-            INSERT INTO model_params (n_estimators, max_depth, min_samples_split)
-            VALUES (?, ?, ?)
-        ''', (n_estimators, max_depth, min_samples_split))
-        
-        conn.commit()
-    finally:
-        conn.close() 
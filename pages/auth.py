@@ -3,6 +3,7 @@ import sqlite3
 import uuid
 import time
 from database import add_user, get_user
+from pages.user import set_profile
 from config import FITNESS_GOALS, EXERCISE_TYPES, ADMIN_USERNAME, ADMIN_PASSWORD
 
 def show():
@@ -42,6 +43,8 @@ def show():
                         st.session_state.logged_in = True
                         st.session_state.user_id = user[0]
                         st.session_state.username = user[1]
+                        # 登录时已读出完整的用户行，直接作为会话资料
+                        set_profile(user)
                         st.session_state.current_page = "锻炼推荐"
                         st.success("登录成功！")
                         st.rerun()
@@ -66,12 +69,6 @@ def show():
                         st.error("用户名和密码不能为空！")
                         return
                     
-                    # 检查用户名是否已存在
-                    existing_user = get_user(username)
-                    if existing_user:
-                        st.error("用户名已存在！")
-                        return
-                    
                     # 创建新用户
                     user_data = {
                         'user_id': str(uuid.uuid4()),
@@ -84,7 +81,9 @@ def show():
                     }
                     
                     try:
-                        add_user(user_data)
+                        if not add_user(user_data):
+                            st.error("用户名已存在！")
+                            return
                         st.success("注册成功！正在跳转到登录页面...")
                         # 设置要显示的用户名和密码
                         st.session_state.temp_username = username
@@ -1,10 +1,23 @@
+import io
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 from datetime import datetime, timedelta
 import random
-from database import get_db_connection
-from config import EXERCISE_TYPES, INTENSITY_LEVELS, FOOD_CATEGORIES, INTENSITY_CALORIES
+from concurrent.futures import TimeoutError as WriteTimeout
+from database import (
+    get_user_daily_stats, get_latest_records, get_user_duration_records,
+    get_load_score, get_user_by_id, update_user_profile
+)
+from model import predict_calories
+from charts import line_chart, bar_chart
+from write_queue import record_writer
+from importer import import_stream, detect_format
+from export import export_records, EXPORT_FORMATS
+from config import (
+    EXERCISE_TYPES, INTENSITY_LEVELS, FOOD_CATEGORIES, LOAD_SCORE_WINDOWS,
+    DEFAULT_CALORIES, RANDOM_RECORD_NOTE, WRITE_ACK_TIMEOUT, CHART_DETAIL_DAYS
+)
 
 def show(page):
     if not st.session_state.logged_in:
@@ -23,15 +36,30 @@ def show(page):
         show_progress()
         show_analysis()
 
+def set_profile(user):
+    """把用户行保存为当前会话的资料，不含密码"""
+    st.session_state.profile = {key: user[key] for key in user.keys() if key != 'password'}
+
+def get_profile():
+    """返回当前会话的用户资料
+
+    资料在登录时保存到会话中，页面重新运行时不再查询 users 表；
+    会话中没有或不属于当前用户时重新加载，用户不存在时返回 None。
+    """
+    profile = st.session_state.get('profile')
+    if profile is None or profile['user_id'] != st.session_state.user_id:
+        user = get_user_by_id(st.session_state.user_id)
+        if user is None:
+            return None
+        set_profile(user)
+        profile = st.session_state.profile
+    return profile
+
 def show_profile():
     """显示和编辑个人资料"""
     st.header("个人资料")
     
-    conn = get_db_connection()
-    user = conn.execute(
-        'SELECT * FROM users WHERE user_id = ?', 
-        (st.session_state.user_id,)
-    ).fetchone()
+    user = get_profile()
     
     with st.form("profile_form"):
         username = st.text_input("用户名", value=user['username'], disabled=True)
@@ -42,17 +70,14 @@ def show_profile():
         
         if st.form_submit_button("更新资料"):
             try:
-                conn.execute('''
-                    UPDATE users 
-                    SET age=?, gender=?, fitness_goal=?, preferred_exercise=?
-                    WHERE user_id=?
-                ''', (age, gender, fitness_goal, ','.join(preferred_exercises), st.session_state.user_id))
-                conn.commit()
+                update_user_profile(
+                    st.session_state.user_id, age, gender, fitness_goal, ','.join(preferred_exercises)
+                )
+                # 资料已修改，下次使用时重新加载
+                st.session_state.pop('profile', None)
                 st.success("资料更新成功！")
             except Exception as e:
                 st.error(f"更新失败：{str(e)}")
-    
-    conn.close()
 
 def show_exercise_form():
     """添加锻炼记录表单"""
@@ -61,101 +86,142 @@ def show_exercise_form():
     col1, col2 = st.columns([3, 1])
     
     with col1:
+        # 运动时长和强度放在表单外，修改后立即按模型重新估算卡路里
+        exercise_type = st.selectbox("运动类型", EXERCISE_TYPES)
+        duration = st.number_input("运动时长(分钟)", min_value=1, value=30)
+        intensity = st.select_slider("运动强度", INTENSITY_LEVELS)
+        
+        user = get_profile()
+        estimated = predict_calories(user['age'], user['gender'], duration, intensity) if user else None
+        
         with st.form("exercise_form"):
-            exercise_type = st.selectbox("运动类型", EXERCISE_TYPES)
-            duration = st.number_input("运动时长(分钟)", min_value=1, value=30)
-            intensity = st.select_slider("运动强度", INTENSITY_LEVELS)
-            calories = st.number_input("消耗卡路里", min_value=0, value=100)
+            calories = st.number_input(
+                "消耗卡路里",
+                min_value=0,
+                value=int(round(estimated)) if estimated is not None else DEFAULT_CALORIES,
+                key=f"calories_{duration}_{intensity}"
+            )
+            if estimated is not None:
+                st.caption(f"模型估算约 {estimated:.0f} 千卡，可按实际情况修改")
             notes = st.text_area("备注")
             date = st.date_input("日期", datetime.now())
             
             if st.form_submit_button("添加记录"):
-                conn = get_db_connection()
-                try:
-                    conn.execute('''
-                        INSERT INTO exercise_records 
-                        (user_id, exercise_type, duration, intensity, calories_burned, notes, date)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        st.session_state.user_id,
-                        exercise_type,
-                        duration,
-                        intensity,
-                        calories,
-                        notes,
-                        date.strftime('%Y-%m-%d')
-                    ))
-                    conn.commit()
-                    st.success("记录添加成功！")
-                except Exception as e:
-                    st.error(f"添加失败：{str(e)}")
-                finally:
-                    conn.close()
+                save_record({
+                    'user_id': st.session_state.user_id,
+                    'exercise_type': exercise_type,
+                    'duration': duration,
+                    'intensity': intensity,
+                    'calories_burned': calories,
+                    'notes': notes,
+                    'date': date.strftime('%Y-%m-%d')
+                }, "记录添加成功！", "添加失败")
     
     with col2:
         if st.button("生成随机记录"):
             generate_random_record()
+    
+    show_import_form()
+    show_export_form()
+
+def show_import_form():
+    """批量导入锻炼记录"""
+    st.subheader("批量导入")
+    uploaded = st.file_uploader(
+        "上传CSV、JSON Lines或GPX文件",
+        type=['csv', 'jsonl', 'json', 'gpx'],
+        help="CSV/JSON Lines 字段：date, exercise_type, duration, intensity, calories_burned, notes，可选 import_key"
+    )
+    
+    if uploaded is not None and st.button("开始导入"):
+        try:
+            with st.spinner("正在导入..."):
+                report = import_stream(
+                    st.session_state.user_id, uploaded, detect_format(uploaded.name)
+                )
+            st.success(
+                f"导入完成：写入 {report['inserted']} 条，重复跳过 {report['duplicates']} 条，"
+                f"不合法 {report['invalid']} 条，{report['rows_per_sec']:.0f} 行/秒"
+            )
+            for error in report['errors']:
+                st.warning(error)
+        except Exception as e:
+            st.error(f"导入失败：{str(e)}")
+
+def show_export_form():
+    """导出本人的锻炼记录"""
+    st.subheader("导出数据")
+    col1, col2 = st.columns(2)
+    fmt = col1.radio("导出格式", EXPORT_FORMATS, horizontal=True)
+    date_range = col2.date_input("日期范围（不选则导出全部）", value=())
+    
+    if st.button("生成导出文件"):
+        try:
+            buffer = io.BytesIO()
+            report = export_records(
+                buffer, fmt,
+                user_id=st.session_state.user_id,
+                start_date=date_range[0] if len(date_range) > 0 else None,
+                end_date=date_range[1] if len(date_range) > 1 else None
+            )
+            st.session_state.user_export = (f"exercise_records_{datetime.now():%Y%m%d}.{fmt}", buffer.getvalue())
+            st.caption(f"共 {report['rows']} 条记录，耗时 {report['seconds']:.2f} 秒")
+        except Exception as e:
+            st.error(f"导出失败：{str(e)}")
+    
+    if 'user_export' in st.session_state:
+        file_name, data = st.session_state.user_export
+        st.download_button("下载导出文件", data, file_name=file_name)
 
 def generate_random_record():
     """生成随机锻炼记录"""
     record = {
+        'user_id': st.session_state.user_id,
         'exercise_type': random.choice(EXERCISE_TYPES),
         'duration': random.randint(15, 120),
         'intensity': random.choice(INTENSITY_LEVELS),
         'calories_burned': random.randint(50, 500),
-        'notes': "自动生成的记录",
+        'notes': RANDOM_RECORD_NOTE,
         'date': (datetime.now() - timedelta(days=random.randint(0, 30))).strftime('%Y-%m-%d')
     }
     
-    conn = get_db_connection()
+    save_record(record, "随机记录生成成功！", "生成失败")
+
+def save_record(record, success, failure):
+    """提交一条记录并等待写入确认
+
+    记录由写入线程与其他用户的记录合并提交，提交完成后再提示成功。等待超时时记录仍在队列中，
+    稍后会写入，只提示仍在保存，避免用户重复提交产生重复记录。
+    """
     try:
-        conn.execute('''
-            INSERT INTO exercise_records 
-            (user_id, exercise_type, duration, intensity, calories_burned, notes, date)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            st.session_state.user_id,
-            record['exercise_type'],
-            record['duration'],
-            record['intensity'],
-            record['calories_burned'],
-            record['notes'],
-            record['date']
-        ))
-        conn.commit()
-        st.success("随机记录生成成功！")
+        record_writer.submit([record]).result(WRITE_ACK_TIMEOUT)
+        st.success(success)
+    except WriteTimeout:
+        st.info("记录仍在保存中，稍后刷新即可看到，请勿重复提交")
     except Exception as e:
-        st.error(f"生成失败：{str(e)}")
-    finally:
-        conn.close()
+        st.error(f"{failure}：{str(e)}")
 
 def show_recommendations():
     """显示锻炼和饮食推荐"""
     st.header("今日推荐")
     
-    # 获取用户信息和锻炼记录
-    conn = get_db_connection()
-    user = conn.execute(
-        'SELECT * FROM users WHERE user_id = ?', 
-        (st.session_state.user_id,)
-    ).fetchone()
+    user = get_profile()
     
-    # 获取最近7天的运动记录
-    seven_days_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    records = pd.read_sql_query('''
-        SELECT * FROM exercise_records 
-        WHERE user_id = ? AND date >= ?
-        ORDER BY date DESC
-    ''', conn, params=(st.session_state.user_id, seven_days_ago))
+    # 计算最近各时间窗口的运动负荷，建议强度以最近7天为准
+    load_scores = {
+        days: get_load_score(st.session_state.user_id, days)
+        for days in sorted(set(LOAD_SCORE_WINDOWS) | {7})
+    }
+    avg_daily_calories = load_scores[7]['avg_daily_load']
     
-    # 计算最近的运动强度和消耗
-    total_calories = 0
-    if len(records) > 0:
-        for _, record in records.iterrows():
-            total_calories += INTENSITY_CALORIES.get(record['intensity'], 0)
-        avg_daily_calories = total_calories / 7
-    else:
-        avg_daily_calories = 0
+    load_cols = st.columns(len(load_scores))
+    for col, (days, score) in zip(load_cols, load_scores.items()):
+        col.metric(
+            f"近{days}天日均负荷",
+            int(score['avg_daily_load']),
+            f"{score['workouts']}次运动",
+            delta_color="off"
+        )
     
     # 创建两列布局
     col1, col2 = st.columns(2)
@@ -228,93 +294,105 @@ def show_recommendations():
         st.info("🥗 控制碳水化合物摄入，增加蔬菜摄入，保证适量蛋白质")
     else:
         st.info("🥜 均衡饮食，适量多样，注意营养搭配")
-    
-    conn.close()
 
 def show_progress():
     """显示进度追踪"""
     st.header("进度追踪")
     
-    conn = get_db_connection()
-    records = pd.read_sql_query('''
-        SELECT * FROM exercise_records 
-        WHERE user_id = ? 
-        ORDER BY date DESC
-    ''', conn, params=(st.session_state.user_id,))
+    stats = get_user_daily_stats(st.session_state.user_id)
     
-    if len(records) == 0:
+    if len(stats) == 0:
         st.info("还没有锻炼记录，开始添加吧！")
         return
     
     # 显示最近的运动记录
     st.subheader("最近的运动记录")
+    records = get_latest_records(st.session_state.user_id, 5)
     st.dataframe(
         records[['date', 'exercise_type', 'duration', 'intensity', 'calories_burned']]
-        .head(5)
     )
     
-    # 绘制运动时长趋势图
-    fig_duration = px.line(
-        records, 
-        x='date', 
-        y='duration',
-        title='运动时长趋势'
-    )
+    daily_duration, type_counts = summarize_progress(stats)
+    
+    # 绘制运动时长趋势图，缩小显示范围后按每次运动重新查询
+    days = pd.to_datetime(daily_duration['day']).dt.date
+    start, end = days.min(), days.max()
+    if start < end:
+        start, end = st.slider(
+            "显示范围", min_value=start, max_value=end, value=(start, end),
+            help=f"范围不超过{CHART_DETAIL_DAYS}天时显示每次运动的时长"
+        )
+    series, x = duration_series(st.session_state.user_id, daily_duration, start, end)
+    fig_duration, points = line_chart(series, x, 'duration', '运动时长趋势')
     st.plotly_chart(fig_duration)
+    if points < len(series):
+        st.caption(f"共 {len(series)} 个点，图中按形状保留 {points} 个")
     
     # 绘制运动类型分布
     fig_types = px.pie(
-        records, 
+        type_counts, 
         names='exercise_type',
+        values='workouts',
         title='运动类型分布'
     )
     st.plotly_chart(fig_types)
-    
-    conn.close()
 
 def show_analysis():
     """显示数据分析"""
     st.header("数据分析")
     
-    conn = get_db_connection()
-    records = pd.read_sql_query('''
-        SELECT * FROM exercise_records 
-        WHERE user_id = ? 
-        ORDER BY date DESC
-    ''', conn, params=(st.session_state.user_id,))
+    stats = get_user_daily_stats(st.session_state.user_id)
     
-    if len(records) == 0:
+    if len(stats) == 0:
         st.info("还没有足够的数据进行分析，请先添加一些锻炼记录！")
         return
     
-    # 计算统计数据
-    total_workouts = len(records)
-    total_duration = records['duration'].sum()
-    total_calories = records['calories_burned'].sum()
-    avg_duration = records['duration'].mean()
+    totals, weekly_stats = summarize_analysis(stats)
     
     # 显示统计数据
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("总运动次数", total_workouts)
-    col2.metric("总运动时长(分钟)", int(total_duration))
-    col3.metric("总消耗卡路里", int(total_calories))
-    col4.metric("平均每次时长", f"{int(avg_duration)}分钟")
-    
-    # 按周分析
-    records['date'] = pd.to_datetime(records['date'])
-    records['week'] = records['date'].dt.isocalendar().week
-    weekly_stats = records.groupby('week').agg({
-        'duration': 'sum',
-        'calories_burned': 'sum'
-    }).reset_index()
+    col1.metric("总运动次数", totals['workouts'])
+    col2.metric("总运动时长(分钟)", int(totals['duration']))
+    col3.metric("总消耗卡路里", int(totals['calories']))
+    col4.metric("平均每次时长", f"{int(totals['avg_duration'])}分钟")
     
-    # 绘制每周运动时长趋势
-    fig_weekly = px.bar(
-        weekly_stats,
-        x='week',
-        y='duration',
-        title='每周运动时长统计'
-    )
+    # 绘制每周运动时长趋势，周数过多时按更长的周期合并
+    fig_weekly, period = bar_chart(weekly_stats, 'week', 'duration')
+    fig_weekly.update_layout(title=f'每{period}运动时长统计')
     st.plotly_chart(fig_weekly)
+
+def summarize_progress(stats):
+    """从每日汇总计算每日运动时长和各运动类型次数"""
+    daily_duration = stats.groupby('day', as_index=False)['duration'].sum()
+    type_counts = stats.groupby('exercise_type', as_index=False)['workouts'].sum()
+    return daily_duration, type_counts
+
+def duration_series(user_id, daily_duration, start, end):
+    """返回 start 到 end 日（含）的运动时长序列及其日期列名
+
+    范围不超过 CHART_DETAIL_DAYS 天时读取每次运动的记录（含已归档的记录），否则使用每日汇总。
+    """
+    if (end - start).days <= CHART_DETAIL_DAYS:
+        return get_user_duration_records(user_id, start, end), 'date'
     
-    conn.close() 
+    day = pd.to_datetime(daily_duration['day'])
+    in_range = (day >= pd.Timestamp(start)) & (day <= pd.Timestamp(end))
+    return daily_duration[in_range].assign(day=day[in_range]), 'day'
+
+def summarize_analysis(stats):
+    """从每日汇总计算总体统计和每周运动量"""
+    totals = {
+        'workouts': int(stats['workouts'].sum()),
+        'duration': stats['duration'].sum(),
+        'calories': stats['calories'].sum()
+    }
+    totals['avg_duration'] = totals['duration'] / totals['workouts']
+    
+    # 按周分析，以每周的周一区分不同年份的同一周
+    weekly_stats = stats.assign(
+        week=pd.to_datetime(stats['day']).dt.to_period('W').dt.start_time
+    ).groupby('week').agg({
+        'duration': 'sum',
+        'calories': 'sum'
+    }).reset_index()
+    return totals, weekly_stats
@@ -0,0 +1,327 @@
+"""PostgreSQL 存储后端
+
+PostgresPool 与 SQLite 的 ConnectionPool 接口一致，由 database.use_database 按数据库地址选用。
+底层连接由 SQLAlchemy 的 QueuePool 管理，支持常驻连接数、溢出连接数、借出前探活和定期重建。
+借出的 PgConnection 提供应用用到的 sqlite3 连接接口：execute、executemany、cursor、
+in_transaction、lastrowid，行可以按列名和下标访问，pandas 也可以直接用它读取数据。
+
+应用的SQL按SQLite方言编写，执行前按 translate_sql 中的规则改写为PostgreSQL方言。
+事务语句的对应关系：BEGIN 开启可重复读事务，与SQLite读事务的快照语义一致；
+BEGIN IMMEDIATE 获取事务级咨询锁，只与同样使用 BEGIN IMMEDIATE 的事务（结构迁移、归档）互斥，
+不像SQLite那样阻塞其他写入；需要排除并发写入的事务（如归档）还要自行 LOCK TABLE。
+
+psycopg2 的普通游标执行查询时把全部结果读入客户端。结果较大的分块读取在 stream_results 期间创建
+服务端命名游标，每次只取 PG_FETCH_ROWS 行；逐行迭代游标时同样按批读取，不一次生成全部行对象。
+"""
+import itertools
+import re
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from functools import lru_cache
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from query_stats import query_recorder
+from config import (
+    PG_POOL_SIZE, PG_MAX_OVERFLOW, PG_POOL_TIMEOUT, PG_POOL_RECYCLE, PG_POOL_PRE_PING,
+    PG_FETCH_ROWS, QUERY_STATS_ENABLED
+)
+
+# PgConnection 实现了DBAPI游标接口，pandas 可以正常读取
+warnings.filterwarnings('ignore', message='pandas only supports SQLAlchemy connectable', category=UserWarning)
+
+# BEGIN IMMEDIATE 使用的咨询锁编号
+WRITE_LOCK_ID = 0x66697431
+
+# 整数求和等结果在PostgreSQL中是 numeric，按SQLite的习惯转换为 int 或 float
+NUMERIC_TO_NUMBER = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, 'NUMERIC_TO_NUMBER',
+    lambda value, cursor: None if value is None else float(value) if '.' in value else int(value)
+)
+
+# 日期和时间在SQLite中以文本保存，读出时同样保留为文本
+DATETIME_TO_TEXT = psycopg2.extensions.new_type(
+    psycopg2.extensions.PYDATE.values + psycopg2.extensions.PYTIME.values
+    + psycopg2.extensions.PYDATETIME.values + psycopg2.extensions.PYDATETIMETZ.values,
+    'DATETIME_TO_TEXT', lambda value, cursor: value
+)
+
+# 服务端游标在连接内需要唯一的名字
+_cursor_names = itertools.count()
+
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+# 与SQLite方言不同的写法：(正则, 替换)，依次应用于字符串字面量以外的部分
+_REWRITES = [
+    (re.compile(r'\bINTEGER PRIMARY KEY AUTOINCREMENT\b', re.IGNORECASE), 'BIGSERIAL PRIMARY KEY'),
+    (re.compile(r'\)\s*WITHOUT ROWID', re.IGNORECASE), ')'),
+    (re.compile(r'\bINDEXED BY \w+', re.IGNORECASE), ''),
+    (re.compile(r'\binstr\(', re.IGNORECASE), 'strpos('),
+    (re.compile(r'\bCURRENT_TIMESTAMP\b', re.IGNORECASE), 'LOCALTIMESTAMP(0)'),
+    (re.compile(r'\bIS NOT (?!NULL\b)', re.IGNORECASE), 'IS DISTINCT FROM '),
+    (re.compile(r'%'), '%%'),
+    (re.compile(r'\?'), '%s'),
+]
+
+# 建表和加列时，SQLite的64位整数和8字节浮点数对应的类型
+_DDL_REWRITES = [
+    (re.compile(r'\bINTEGER\b', re.IGNORECASE), 'BIGINT'),
+    (re.compile(r'\bREAL\b', re.IGNORECASE), 'DOUBLE PRECISION'),
+]
+_DDL = re.compile(r'\s*(CREATE TABLE|ALTER TABLE)\b', re.IGNORECASE)
+
+@lru_cache(maxsize=1024)
+def translate_sql(sql):
+    """把SQLite方言的语句改写为PostgreSQL方言"""
+    rewrites = _REWRITES + (_DDL_REWRITES if _DDL.match(sql) else [])
+    parts = _STRING_LITERAL.split(sql)
+    for i in range(0, len(parts), 2):
+        for pattern, replacement in rewrites:
+            parts[i] = pattern.sub(replacement, parts[i])
+    # 字面量中的 % 同样需要转义
+    for i in range(1, len(parts), 2):
+        parts[i] = parts[i].replace('%', '%%')
+    return ''.join(parts)
+
+class PgCursor:
+    """包装 psycopg2 游标，执行前改写SQL，并记录语句耗时
+
+    server_side 为真时使用服务端命名游标，只能执行一条查询。
+    """
+    
+    def __init__(self, connection, server_side=False):
+        self.connection = connection
+        name = f"stream_{next(_cursor_names)}" if server_side else None
+        self._cursor = connection.raw.cursor(name=name, cursor_factory=psycopg2.extras.DictCursor)
+        self._buffer = []
+        self._sample = None
+        self._inserted = False
+    
+    def execute(self, sql, parameters=()):
+        self.connection.trace(sql)
+        started = time.perf_counter()
+        self._cursor.execute(translate_sql(sql), tuple(parameters))
+        if self._cursor.name is not None:
+            # 命名游标读取第一批后才有列信息，pandas 执行后立即需要列名
+            self._buffer = self._cursor.fetchmany(PG_FETCH_ROWS)
+        self._record(sql, started)
+        self._inserted = sql.lstrip()[:6].upper() == 'INSERT'
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        self.connection.trace(sql)
+        started = time.perf_counter()
+        psycopg2.extras.execute_batch(
+            self._cursor, translate_sql(sql), [tuple(parameters) for parameters in seq_of_parameters]
+        )
+        self._record(sql, started)
+        return self
+    
+    def _record(self, sql, started):
+        if QUERY_STATS_ENABLED:
+            self._sample = query_recorder.start(sql, time.perf_counter() - started)
+    
+    def _fetched(self, started, rows):
+        if self._sample is not None:
+            query_recorder.add_fetch(self._sample, time.perf_counter() - started, rows)
+    
+    def _read(self, size=None):
+        """读取至多 size 行，size 为 None 时读取剩余全部行；先返回执行时预读的行"""
+        if not self._cursor.description:
+            return []
+        rows = self._buffer if size is None else self._buffer[:size]
+        self._buffer = self._buffer[len(rows):]
+        if size is None:
+            return rows + self._cursor.fetchall()
+        if len(rows) < size:
+            rows += self._cursor.fetchmany(size - len(rows))
+        return rows
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        rows = self._read(1)
+        self._fetched(started, len(rows))
+        return rows[0] if rows else None
+    
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = self._read(self._cursor.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._read()
+        self._fetched(started, len(rows))
+        return rows
+    
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(PG_FETCH_ROWS)
+            if not rows:
+                return
+            yield from rows
+    
+    @property
+    def description(self):
+        return self._cursor.description
+    
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+    
+    @property
+    def lastrowid(self):
+        """最近一条 INSERT 生成的自增ID"""
+        if not self._inserted:
+            return None
+        with self.connection.raw.cursor() as cursor:
+            cursor.execute('SELECT lastval()')
+            return cursor.fetchone()[0]
+    
+    def close(self):
+        self._cursor.close()
+
+class PgConnection:
+    """提供应用用到的 sqlite3 连接接口的PostgreSQL连接"""
+    
+    dialect = 'postgresql'
+    
+    def __init__(self, raw, trace_callback=None):
+        self.raw = raw
+        self._trace_callback = trace_callback
+        self._server_side = False
+    
+    def trace(self, sql):
+        if self._trace_callback is not None:
+            self._trace_callback(sql)
+    
+    def cursor(self):
+        return PgCursor(self, self._server_side)
+    
+    @contextmanager
+    def stream_results(self):
+        """期间创建的游标使用服务端游标，供 pandas 分块读取大结果；只应执行查询"""
+        self._server_side = True
+        try:
+            yield self
+        finally:
+            self._server_side = False
+    
+    def execute(self, sql, parameters=()):
+        statement = sql.strip().upper()
+        if statement == 'BEGIN':
+            sql = 'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ'
+        elif statement == 'BEGIN IMMEDIATE':
+            sql = f'SELECT pg_advisory_xact_lock({WRITE_LOCK_ID})'
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    @property
+    def in_transaction(self):
+        status = self.raw.driver_connection.get_transaction_status()
+        return status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    
+    def commit(self):
+        self.raw.commit()
+    
+    def rollback(self):
+        self.raw.rollback()
+    
+    def close(self):
+        self.raw.close()
+
+class PostgresPool:
+    """进程级PostgreSQL连接池，借出和归还的语义与SQLite的 ConnectionPool 相同"""
+    
+    dialect = 'postgresql'
+    
+    def __init__(self, database):
+        self.database = database
+        # 连接适配基于 psycopg2，不随 SQLAlchemy 版本改用其他驱动
+        self.engine = create_engine(
+            make_url(database).set(drivername='postgresql+psycopg2'),
+            poolclass=QueuePool,
+            pool_size=PG_POOL_SIZE,
+            max_overflow=PG_MAX_OVERFLOW,
+            pool_timeout=PG_POOL_TIMEOUT,
+            pool_recycle=PG_POOL_RECYCLE,
+            pool_pre_ping=PG_POOL_PRE_PING,
+            # 与SQLite的 CURRENT_TIMESTAMP 一样使用UTC时间
+            connect_args={'options': '-c timezone=UTC'}
+        )
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._trace_callback = None
+        self._stats = {
+            'checkouts': 0,
+            'nested': 0,
+            'created': 0,
+            'closed': 0
+        }
+        event.listen(self.engine, 'connect', self._on_connect)
+        event.listen(self.engine.pool, 'close', self._on_close)
+    
+    def _on_connect(self, dbapi_connection, record):
+        psycopg2.extensions.register_type(NUMERIC_TO_NUMBER, dbapi_connection)
+        psycopg2.extensions.register_type(DATETIME_TO_TEXT, dbapi_connection)
+        with self._lock:
+            self._stats['created'] += 1
+    
+    def _on_close(self, dbapi_connection, record):
+        with self._lock:
+            self._stats['closed'] += 1
+    
+    @contextmanager
+    def connection(self):
+        """借出连接，正常退出时提交，异常时回滚"""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            with self._lock:
+                self._stats['nested'] += 1
+            yield held
+            return
+        
+        raw = self.engine.raw_connection()
+        with self._lock:
+            self._stats['checkouts'] += 1
+        conn = PgConnection(raw, self._trace_callback)
+        self._local.conn = conn
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            # 归还到 QueuePool
+            raw.close()
+    
+    def set_trace_callback(self, callback):
+        """为之后借出的连接设置SQL语句跟踪回调，传入 None 取消"""
+        self._trace_callback = callback
+    
+    def close_all(self):
+        """关闭所有空闲连接"""
+        self.engine.dispose()
+    
+    def stats(self):
+        """返回连接池统计信息，字段与SQLite连接池一致，另含溢出连接数"""
+        pool = self.engine.pool
+        with self._lock:
+            stats = dict(self._stats)
+        stats['reused'] = max(stats['checkouts'] - stats['created'], 0)
+        stats['in_use'] = pool.checkedout()
+        stats['idle'] = pool.checkedin()
+        stats['max_idle'] = pool.size()
+        stats['overflow'] = max(pool.overflow(), 0)
+        return stats
@@ -0,0 +1,225 @@
+"""SQL语句耗时统计
+
+连接池创建的连接使用 InstrumentedConnection，每条语句按指纹（去掉字面量后的SQL）
+累计调用次数、耗时、返回行数和调用它的页面函数，并维护对数分桶的耗时直方图。
+最近的语句保存在定长环形缓冲区中。execute、fetch 和逐行迭代游标的耗时都计入同一条语句。
+"""
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import lru_cache
+import sqlite3
+from config import QUERY_LOG_SIZE
+
+# 直方图各桶的上限(毫秒)，最后一桶收纳更慢的语句
+HISTOGRAM_BUCKETS_MS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf')]
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# 统计调用方时跳过的模块
+_INTERNAL_MODULES = ('query_stats', 'database', 'pg_backend', 'cache', 'contextlib', 'pandas', 'sqlalchemy')
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """去掉字面量和多余空白，使同一类语句得到相同的指纹"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(?, ...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+def _caller():
+    """找到发起语句的页面函数，找不到时返回第一个外部调用方"""
+    frame = sys._getframe(3)
+    outside = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('pages.'):
+            return f"{module}.{frame.f_code.co_name}"
+        if outside is None and not module.startswith(_INTERNAL_MODULES):
+            outside = f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return outside or 'unknown'
+
+class QueryRecorder:
+    """按语句指纹汇总耗时并保存最近语句的记录器"""
+
+    def __init__(self, log_size=QUERY_LOG_SIZE):
+        self._lock = threading.Lock()
+        self._log = deque(maxlen=log_size)
+        self._totals = {}
+
+    def start(self, sql, seconds):
+        """记录一次 execute，返回用于累加 fetch 耗时的样本"""
+        key = fingerprint(sql)
+        elapsed_ms = seconds * 1000
+        # 样本：[指纹, 调用方, 开始时间, 耗时(毫秒), 返回行数]
+        sample = [key, _caller(), time.time(), elapsed_ms, 0]
+        with self._lock:
+            totals = self._totals.get(key)
+            if totals is None:
+                totals = self._totals[key] = {
+                    'calls': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'rows': 0,
+                    'callers': {},
+                    'histogram': [0] * len(HISTOGRAM_BUCKETS_MS)
+                }
+            totals['calls'] += 1
+            totals['total_ms'] += elapsed_ms
+            totals['max_ms'] = max(totals['max_ms'], elapsed_ms)
+            totals['callers'][sample[1]] = totals['callers'].get(sample[1], 0) + 1
+            totals['histogram'][bisect_left(HISTOGRAM_BUCKETS_MS, elapsed_ms)] += 1
+            self._log.append(sample)
+        return sample
+
+    def add_fetch(self, sample, seconds, rows):
+        """把 fetch 的耗时和行数累加到对应样本，并调整其所在直方图桶"""
+        elapsed_ms = seconds * 1000
+        with self._lock:
+            totals = self._totals.get(sample[0])
+            if totals is None:
+                return
+            old_bucket = bisect_left(HISTOGRAM_BUCKETS_MS, sample[3])
+            sample[3] += elapsed_ms
+            sample[4] += rows
+            new_bucket = bisect_left(HISTOGRAM_BUCKETS_MS, sample[3])
+            if new_bucket != old_bucket:
+                totals['histogram'][old_bucket] -= 1
+                totals['histogram'][new_bucket] += 1
+            totals['total_ms'] += elapsed_ms
+            totals['max_ms'] = max(totals['max_ms'], sample[3])
+            totals['rows'] += rows
+
+    def top_queries(self, n=10, order_by='total_ms'):
+        """返回按总耗时或 p99 排序的前 n 类语句"""
+        with self._lock:
+            rows = [
+                {
+                    'fingerprint': key,
+                    'calls': totals['calls'],
+                    'total_ms': totals['total_ms'],
+                    'avg_ms': totals['total_ms'] / totals['calls'],
+                    'p99_ms': _percentile(totals['histogram'], 0.99, totals['max_ms']),
+                    'max_ms': totals['max_ms'],
+                    'rows': totals['rows'],
+                    'callers': dict(totals['callers'])
+                }
+                for key, totals in self._totals.items()
+            ]
+        rows.sort(key=lambda row: row[order_by], reverse=True)
+        return rows[:n]
+
+    def recent(self):
+        """返回环形缓冲区中的最近语句"""
+        with self._lock:
+            samples = list(self._log)
+        return [
+            {
+                'fingerprint': key,
+                'caller': caller,
+                'started_at': started_at,
+                'duration_ms': duration_ms,
+                'rows': rows
+            }
+            for key, caller, started_at, duration_ms, rows in samples
+        ]
+
+    def export(self):
+        """导出全部汇总和最近语句，用于保存为JSON"""
+        with self._lock:
+            histograms = {key: list(totals['histogram']) for key, totals in self._totals.items()}
+        return {
+            'buckets_ms': [str(bucket) for bucket in HISTOGRAM_BUCKETS_MS],
+            'queries': self.top_queries(n=len(histograms)),
+            'histograms': histograms,
+            'recent': self.recent()
+        }
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self._log.clear()
+            self._totals.clear()
+
+def _percentile(histogram, quantile, max_ms):
+    """根据直方图估计分位数，返回该分位所在桶的上限
+
+    上限不超过观测到的最大耗时，落在最后一个无上限桶时也是有限值，导出的JSON不含 Infinity。
+    """
+    total = sum(histogram)
+    if total == 0:
+        return 0.0
+    threshold = quantile * total
+    seen = 0
+    for bucket, count in zip(HISTOGRAM_BUCKETS_MS, histogram):
+        seen += count
+        if seen >= threshold:
+            return min(bucket, max_ms)
+    return max_ms
+
+query_recorder = QueryRecorder()
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """记录每条语句耗时和返回行数的游标"""
+
+    _sample = None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        result = super().execute(sql, parameters)
+        self._sample = query_recorder.start(sql, time.perf_counter() - started)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        result = super().executemany(sql, seq_of_parameters)
+        self._sample = query_recorder.start(sql, time.perf_counter() - started)
+        return result
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        if self._sample is not None:
+            query_recorder.add_fetch(self._sample, time.perf_counter() - started, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if self._sample is not None:
+            query_recorder.add_fetch(self._sample, time.perf_counter() - started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        if self._sample is not None:
+            query_recorder.add_fetch(self._sample, time.perf_counter() - started, len(rows))
+        return rows
+
+    def __next__(self):
+        # for row in cursor 逐行读取时不经过 fetch 方法
+        started = time.perf_counter()
+        row = super().__next__()
+        if self._sample is not None:
+            query_recorder.add_fetch(self._sample, time.perf_counter() - started, 1)
+        return row
+
+class InstrumentedConnection(sqlite3.Connection):
+    """默认创建 InstrumentedCursor 的连接"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
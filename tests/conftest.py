@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import archive
+import database
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """每个测试使用独立的临时数据库和归档目录"""
+    monkeypatch.setattr(archive, 'ARCHIVE_DIR', tmp_path / 'archive')
+    database.use_database(tmp_path / 'test.db')
+    database.init_database()
+    return database
+
+def add_test_user(db, user_id, gender='男'):
+    db.add_user({
+        'user_id': user_id,
+        'username': user_id,
+        'password': 'secret',
+        'age': 30,
+        'gender': gender,
+        'fitness_goal': '减重',
+        'preferred_exercise': '跑步'
+    })
@@ -0,0 +1,63 @@
+from archive import archive_month
+from conftest import add_test_user
+
+def record(user_id, date, exercise_type='跑步', intensity='中', duration=30, calories=200):
+    return {
+        'user_id': user_id,
+        'exercise_type': exercise_type,
+        'duration': duration,
+        'intensity': intensity,
+        'calories_burned': calories,
+        'notes': '',
+        'date': date
+    }
+
+def cube(db):
+    with db.get_db_connection() as conn:
+        return [
+            (row['day'], row['exercise_type'], row['intensity'], row['gender'],
+             row['workouts'], row['duration'], round(row['calories'], 6))
+            for row in conn.execute('''
+                SELECT * FROM daily_activity_cube
+                ORDER BY day, exercise_type, intensity, gender
+            ''')
+        ]
+
+def assert_cube_matches_rebuild(db):
+    incremental = cube(db)
+    db.rebuild_daily_stats()
+    assert incremental == cube(db)
+
+def test_gender_change_between_writes(db):
+    add_test_user(db, 'u1', '男')
+    add_test_user(db, 'u2', '女')
+    db.add_exercise_records([
+        record('u1', '2026-01-05'),
+        record('u1', '2026-01-05', intensity='高', duration=45),
+        record('u2', '2026-01-05'),
+        record('u1', '2026-01-06', exercise_type='游泳')
+    ])
+    
+    db.update_user_profile('u1', 30, '女', '减重', '跑步')
+    db.add_exercise_records([record('u1', '2026-01-05'), record('u1', '2026-01-07')])
+    assert_cube_matches_rebuild(db)
+    
+    # 改回原性别后回填卡路里，修正值计入当前性别的行
+    db.update_user_profile('u1', 30, '男', '减重', '跑步')
+    with db.get_db_connection() as conn:
+        row = conn.execute("SELECT * FROM exercise_records WHERE user_id = 'u1' LIMIT 1").fetchone()
+    db.apply_calorie_estimates([(
+        row['record_id'], 'u1', row['date'], row['exercise_type'], row['intensity'],
+        row['calories_burned'], 350
+    )])
+    assert_cube_matches_rebuild(db)
+    assert {gender for *_, gender, _, _, _ in cube(db)} == {'男', '女'}
+
+def test_gender_change_moves_archived_records(db):
+    add_test_user(db, 'u1', '男')
+    db.add_exercise_records([record('u1', '2020-01-10'), record('u1', '2026-01-10')])
+    archive_month('2020-01')
+    
+    db.update_user_profile('u1', 30, '女', '减重', '跑步')
+    assert_cube_matches_rebuild(db)
+    assert {row[3] for row in cube(db)} == {'女'}
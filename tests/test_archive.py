@@ -0,0 +1,70 @@
+import io
+import threading
+import pyarrow.parquet as pq
+from archive import archive_month, scan_batches, scan_records
+from importer import import_stream
+from conftest import add_test_user
+
+CSV = (
+    "date,exercise_type,duration,intensity,calories_burned,notes\n"
+    "2025-01-05,跑步,30,中,250,\n"
+    "2025-01-05,跑步,30,中,250,\n"
+    "2025-01-12,骑行,60,高,500,\n"
+)
+
+def test_reimport_after_archive_skips_archived_records(db):
+    add_test_user(db, 'u1')
+    assert import_stream('u1', io.BytesIO(CSV.encode('utf-8')), 'csv')['inserted'] == 3
+    assert archive_month('2025-01')['records'] == 3
+    
+    report = import_stream('u1', io.BytesIO(CSV.encode('utf-8')), 'csv')
+    assert report['inserted'] == 0
+    assert report['duplicates'] == 3
+    with db.get_db_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM exercise_records').fetchone()[0] == 0
+
+def _add_records(db, dates):
+    db.add_exercise_records([{
+        'user_id': 'u1', 'exercise_type': '跑步', 'duration': 30, 'intensity': '中',
+        'calories_burned': 250, 'notes': '', 'date': date
+    } for date in dates])
+
+def test_scan_does_not_hold_a_transaction_between_batches(db):
+    add_test_user(db, 'u1')
+    _add_records(db, ['2026-03-01', '2026-03-02', '2026-03-03'])
+    batches = scan_batches(['duration'], batch_size=1)
+    assert list(next(batches).columns) == ['duration']
+    with db.get_db_connection() as conn:
+        assert not conn.in_transaction
+    assert sum(len(batch) for batch in batches) == 2
+
+def test_archive_during_scan_neither_repeats_nor_skips(db):
+    add_test_user(db, 'u1')
+    _add_records(db, ['2025-01-05', '2025-01-06', '2025-01-07', '2026-03-01', '2026-03-02'])
+    batches = scan_batches(['record_id'], batch_size=1)
+    seen = list(next(batches)['record_id'])
+    archive_month('2025-01')
+    for batch in batches:
+        seen.extend(batch['record_id'])
+    assert sorted(seen) == [1, 2, 3, 4, 5]
+
+def test_archive_does_not_block_writers_while_writing_files(db, monkeypatch):
+    add_test_user(db, 'u1')
+    _add_records(db, ['2025-01-05', '2025-01-06'])
+    write_table = pq.ParquetWriter.write_table
+    updated = []
+    
+    def update_then_write(self, table):
+        # 另一个线程在写文件期间修改待归档的记录，归档核对不一致后重试
+        if not updated:
+            thread = threading.Thread(target=lambda: updated.append(db.apply_calorie_estimates([(1, 'u1', '2025-01-05', '跑步', '中', 250, 300)]) or True))
+            thread.start()
+            thread.join(5)
+            assert updated
+        return write_table(self, table)
+    
+    monkeypatch.setattr(pq.ParquetWriter, 'write_table', update_then_write)
+    assert archive_month('2025-01')['records'] == 2
+    archived = scan_records(['record_id', 'calories_burned', 'calories_estimated'])
+    assert list(archived['calories_burned']) == [300, 250]
+    assert list(archived['calories_estimated']) == [1, 0]
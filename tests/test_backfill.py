@@ -0,0 +1,33 @@
+import math
+from backfill import backfill_calories
+from conftest import add_test_user
+
+def record(user_id, date, duration, calories):
+    return {
+        'user_id': user_id,
+        'exercise_type': '跑步',
+        'duration': duration,
+        'intensity': '中',
+        'calories_burned': calories,
+        'notes': '',
+        'date': date
+    }
+
+def test_records_without_duration_are_not_backfilled(db):
+    add_test_user(db, 'u1')
+    db.add_exercise_records([
+        record('u1', '2026-01-05', None, None),
+        record('u1', '2026-01-05', 30, None)
+    ])
+    
+    report = backfill_calories(use_model=False)
+    assert report['updated'] == 1
+    with db.get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT duration, calories_burned, calories_estimated FROM exercise_records ORDER BY record_id
+        ''').fetchall()
+        stats = conn.execute('SELECT calories FROM user_daily_stats').fetchall()
+        cube = conn.execute('SELECT calories FROM daily_activity_cube').fetchall()
+    assert (rows[0]['calories_burned'], rows[0]['calories_estimated']) == (None, 0)
+    assert rows[1]['calories_burned'] > 0 and rows[1]['calories_estimated'] == 1
+    assert all(math.isfinite(row['calories']) for row in [*stats, *cube])
@@ -0,0 +1,54 @@
+import io
+from importer import import_stream
+from conftest import add_test_user
+
+CSV = (
+    "date,exercise_type,duration,intensity,calories_burned,notes\n"
+    "2026-03-01,跑步,30,中,250,\n"
+    "2026-03-01,跑步,30,中,250,\n"
+    "2026-03-01T07:00:00,跑步,30,中,250,\n"
+    "2026-03-01T18:30:00,跑步,30,中,250,\n"
+)
+
+def test_identical_rows_on_same_day_are_kept(db):
+    add_test_user(db, 'u1')
+    report = import_stream('u1', io.BytesIO(CSV.encode('utf-8')), 'csv')
+    assert report['inserted'] == 4
+    assert report['duplicates'] == 0
+    
+    # 再次导入同一文件时全部视为重复
+    report = import_stream('u1', io.BytesIO(CSV.encode('utf-8')), 'csv')
+    assert report['inserted'] == 0
+    assert report['duplicates'] == 4
+    with db.get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM exercise_records WHERE user_id = 'u1'").fetchone()[0] == 4
+
+JSONL = (
+    '{"date": "2026-03-01", "exercise_type": "跑步", "duration": 30, "intensity": "中"}\n'
+    '{"date": "2026-03-02", "exercise_type": "跑步", \n'
+    '\n'
+    '[1, 2]\n'
+    '{"date": "2026-03-03", "exercise_type": "跑步", "duration": 40, "intensity": "中"}\n'
+)
+
+def test_corrupt_lines_are_reported_and_skipped(db):
+    add_test_user(db, 'u1')
+    report = import_stream('u1', io.BytesIO(JSONL.encode('utf-8')), 'jsonl', batch_size=1)
+    assert report['inserted'] == 2
+    assert report['invalid'] == 2
+    assert "第2行" in report['errors'][0]
+    assert "第4行" in report['errors'][1]
+
+GPX = (
+    '<gpx><trk><type>running</type><trkseg>'
+    '<trkpt><time>2026-03-01T07:00:00Z</time></trkpt><trkpt><time>bad</time></trkpt>'
+    '</trkseg></trk><trk><type>running</type><trkseg>'
+    '<trkpt><time>2026-03-02T07:00:00Z</time></trkpt><trkpt><time>2026-03-02T07:30:00Z</time></trkpt>'
+    '</trkseg></trk></gpx>'
+)
+
+def test_gpx_track_with_bad_time_is_skipped(db):
+    add_test_user(db, 'u1')
+    report = import_stream('u1', io.BytesIO(GPX.encode('utf-8')), 'gpx')
+    assert report['inserted'] == 1
+    assert report['invalid'] == 1
@@ -0,0 +1,100 @@
+import json
+import os
+import uuid
+from pathlib import Path
+import pytest
+
+pytest.importorskip('psycopg2')
+pytest.importorskip('sqlalchemy')
+
+import archive
+import database
+from pg_backend import translate_sql
+from migrations import MIGRATIONS
+from conftest import add_test_user
+
+GOLDEN = Path(__file__).parent / 'golden' / 'translate_sql.json'
+
+def _statements():
+    """热点查询和迁移中的全部SQL语句"""
+    statements = {f"hot:{name}": sql for name, (sql, _) in database.HOT_QUERIES.items()}
+    for version, _, steps in MIGRATIONS:
+        for index, step in enumerate(steps):
+            if isinstance(step, str):
+                statements[f"migration:{version}:{index}"] = step
+    return statements
+
+def test_translate_sql_matches_golden():
+    """改写结果与 golden/translate_sql.json 一致；设置 UPDATE_GOLDEN=1 运行时重新生成"""
+    translated = {key: translate_sql(sql) for key, sql in _statements().items()}
+    if os.environ.get('UPDATE_GOLDEN'):
+        GOLDEN.write_text(json.dumps(translated, ensure_ascii=False, indent=2) + '\n', encoding='utf-8')
+    assert translated == json.loads(GOLDEN.read_text(encoding='utf-8'))
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT * FROM t WHERE a = ? AND b = '?'", "SELECT * FROM t WHERE a = %s AND b = '?'"),
+    ("SELECT 'it''s ?' FROM t WHERE a = ?", "SELECT 'it''s ?' FROM t WHERE a = %s"),
+    ("SELECT * FROM t WHERE a LIKE '%x%' AND b % 2 = 0", "SELECT * FROM t WHERE a LIKE '%%x%%' AND b %% 2 = 0"),
+    ("SELECT * FROM t WHERE a IS NOT ? AND b IS NOT NULL", "SELECT * FROM t WHERE a IS DISTINCT FROM %s AND b IS NOT NULL"),
+    ("SELECT 'a IS NOT b' FROM t", "SELECT 'a IS NOT b' FROM t"),
+    ("SELECT * FROM t INDEXED BY idx_t_day WHERE day >= ?", "SELECT * FROM t  WHERE day >= %s"),
+    ("SELECT instr(a, 'instr(') FROM t", "SELECT strpos(a, 'instr(') FROM t"),
+    ("UPDATE t SET at = CURRENT_TIMESTAMP, note = 'CURRENT_TIMESTAMP'",
+     "UPDATE t SET at = LOCALTIMESTAMP(0), note = 'CURRENT_TIMESTAMP'"),
+    ("CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT, n INTEGER, x REAL) WITHOUT ROWID",
+     "CREATE TABLE t (id BIGSERIAL PRIMARY KEY, n BIGINT, x DOUBLE PRECISION)"),
+    ("SELECT CAST(a AS INTEGER), CAST(b AS REAL) FROM t", "SELECT CAST(a AS INTEGER), CAST(b AS REAL) FROM t"),
+])
+def test_translate_sql_rewrites(sql, expected):
+    assert translate_sql(sql) == expected
+
+@pytest.fixture
+def pg_db(tmp_path, monkeypatch):
+    """在 TEST_DATABASE_URL 指向的服务器上创建临时数据库，未设置时跳过"""
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip("未设置 TEST_DATABASE_URL")
+    import psycopg2
+    from sqlalchemy.engine import make_url
+    
+    name = f"fitness_test_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(url)
+    admin.autocommit = True
+    admin.cursor().execute(f'CREATE DATABASE {name}')
+    monkeypatch.setattr(archive, 'ARCHIVE_DIR', tmp_path / 'archive')
+    database.use_database(make_url(url).set(database=name).render_as_string(hide_password=False))
+    try:
+        database.init_database()
+        yield database
+    finally:
+        database.use_database(tmp_path / 'test.db')
+        admin.cursor().execute(f'DROP DATABASE {name} WITH (FORCE)')
+        admin.close()
+
+def test_hot_queries_run_on_postgres(pg_db):
+    add_test_user(pg_db, 'u1')
+    with pg_db.get_db_connection() as conn:
+        for name, (sql, params) in pg_db.HOT_QUERIES.items():
+            conn.execute(sql, params).fetchall()
+
+def test_records_round_trip_on_postgres(pg_db):
+    add_test_user(pg_db, 'u1')
+    records = [{
+        'user_id': 'u1', 'exercise_type': '跑步', 'duration': 30 + i, 'intensity': '中',
+        'calories_burned': 250, 'notes': '', 'date': f'2025-01-{i + 1:02d}', 'import_key': f'k{i}'
+    } for i in range(5)]
+    assert pg_db.add_exercise_records(records) == 5
+    assert pg_db.add_exercise_records(records) == 0
+    
+    with pg_db.get_db_connection() as conn:
+        assert [row['duration'] for row in conn.execute('SELECT duration FROM exercise_records ORDER BY record_id')] \
+            == [30, 31, 32, 33, 34]
+        chunks = list(pg_db.read_sql_chunks(
+            'SELECT record_id, date FROM exercise_records ORDER BY record_id', conn, chunksize=2
+        ))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[0]['date'][0] == '2025-01-01 00:00:00'
+    
+    assert archive.archive_month('2025-01')['records'] == 5
+    assert pg_db.add_exercise_records(records) == 0
+    assert len(archive.scan_records(['record_id'])) == 5
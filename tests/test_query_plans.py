@@ -0,0 +1,15 @@
+import pytest
+
+def test_hot_queries_use_indexes(db):
+    plans = db.check_query_plans()
+    assert set(plans) == set(db.HOT_QUERIES)
+    for name, plan in plans.items():
+        assert plan, name
+        assert not [step for step in plan if step.startswith('SCAN exercise_records')], name
+
+def test_full_scan_is_reported(db, monkeypatch):
+    monkeypatch.setitem(db.HOT_QUERIES, 'by_notes', (
+        'SELECT record_id FROM exercise_records WHERE notes = ?', ('',)
+    ))
+    with pytest.raises(RuntimeError, match='by_notes'):
+        db.check_query_plans()
@@ -0,0 +1,25 @@
+import json
+import sqlite3
+from query_stats import InstrumentedConnection, QueryRecorder
+import query_stats
+
+def test_iterating_cursor_counts_rows(monkeypatch):
+    recorder = QueryRecorder()
+    monkeypatch.setattr(query_stats, 'query_recorder', recorder)
+    conn = sqlite3.connect(':memory:', factory=InstrumentedConnection)
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.executemany('INSERT INTO t (x) VALUES (?)', [(i,) for i in range(5)])
+    
+    assert [row[0] for row in conn.execute('SELECT x FROM t ORDER BY x')] == [0, 1, 2, 3, 4]
+    query = next(row for row in recorder.top_queries() if row['fingerprint'].startswith('SELECT'))
+    assert query['calls'] == 1
+    assert query['rows'] == 5
+
+def test_export_of_slow_query_is_valid_json():
+    recorder = QueryRecorder()
+    recorder.start('SELECT 1', 0.002)
+    recorder.start('SELECT 1', 12.5)
+    
+    query = recorder.top_queries()[0]
+    assert query['p99_ms'] == query['max_ms'] == 12500
+    json.dumps(recorder.export(), allow_nan=False)
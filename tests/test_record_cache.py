@@ -0,0 +1,19 @@
+from datetime import date
+from database import get_user_duration_records
+from conftest import add_test_user
+
+def test_duration_records_are_cached_until_next_write(db):
+    add_test_user(db, 'u1')
+    record = {
+        'user_id': 'u1', 'exercise_type': '跑步', 'duration': 30, 'intensity': '中',
+        'calories_burned': 250, 'notes': '', 'date': '2026-03-01'
+    }
+    db.add_exercise_records([record])
+    start, end = date(2026, 3, 1), date(2026, 3, 31)
+    
+    first = get_user_duration_records('u1', start, end)
+    assert get_user_duration_records('u1', start, end) is first
+    
+    # 新记录使缓存失效
+    db.add_exercise_records([{**record, 'duration': 45, 'date': '2026-03-02'}])
+    assert list(get_user_duration_records('u1', start, end)['duration']) == [30, 45]
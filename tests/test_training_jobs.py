@@ -0,0 +1,64 @@
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import training_jobs
+from training_jobs import create_job, reclaim_orphaned_jobs
+
+def _insert_job(db, owner, heartbeat_at):
+    with db.get_db_connection() as conn:
+        return conn.execute(
+            "INSERT INTO training_jobs (kind, status, owner, heartbeat_at) VALUES ('train', 'queued', ?, ?)",
+            (owner, heartbeat_at)
+        ).lastrowid
+
+def _status(db, job_id):
+    with db.get_db_connection() as conn:
+        return conn.execute('SELECT status FROM training_jobs WHERE job_id = ?', (job_id,)).fetchone()[0]
+
+def test_only_orphaned_jobs_are_reclaimed(db):
+    # 已退出的本机进程
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    
+    own = create_job({'kind': 'train', 'n_estimators': 10})
+    other_host = _insert_job(db, 'other-host:1234:abcd', now)
+    stale = _insert_job(db, 'other-host:1234:abcd', '2000-01-01 00:00:00')
+    dead = _insert_job(db, f'{socket.gethostname()}:{exited.pid}:abcd', now)
+    legacy = _insert_job(db, None, None)
+    
+    assert sorted(reclaim_orphaned_jobs()) == sorted([stale, dead, legacy])
+    assert _status(db, own) == 'queued'
+    assert _status(db, other_host) == 'queued'
+    assert _status(db, stale) == 'failed'
+    
+    # 被标记为失败的任务在检查取消时停止
+    assert training_jobs._cancel_requested(stale)
+
+def test_only_the_claiming_process_finishes_a_job(db):
+    job_id = create_job({'kind': 'train', 'n_estimators': 10})
+    with db.get_db_connection() as conn:
+        conn.execute(
+            "UPDATE training_jobs SET status = 'running', owner = 'other-host:1234:abcd' WHERE job_id = ?",
+            (job_id,)
+        )
+    
+    assert not training_jobs._finish_job(job_id, 'failed', time.perf_counter(), error='lost')
+    assert _status(db, job_id) == 'running'
+    assert training_jobs._cancel_requested(job_id)
+
+def test_claiming_process_becomes_owner(db):
+    job_id = create_job({'kind': 'train', 'n_estimators': 10, 'max_depth': 2, 'min_samples_split': 2})
+    with db.get_db_connection() as conn:
+        conn.execute("UPDATE training_jobs SET owner = 'other-host:1234:abcd' WHERE job_id = ?", (job_id,))
+    
+    # 空库数据量不足，任务以失败结束
+    training_jobs.run_training_job(job_id, str(db.get_database_path()))
+    with db.get_db_connection() as conn:
+        owner, status = conn.execute(
+            'SELECT owner, status FROM training_jobs WHERE job_id = ?', (job_id,)
+        ).fetchone()
+    assert (owner, status) == (training_jobs.PROCESS_ID, 'failed')
@@ -0,0 +1,385 @@
+"""后台模型训练任务
+
+完整训练、增量更新和超参数搜索任务提交到独立的进程池中执行，不占用页面脚本线程。任务状态、进度、
+训练数据量和耗时记录在 training_jobs 表中，系统设置页轮询该表显示进度。
+任务状态依次为 queued、running，结束于 done、failed 或 cancelled。
+排队中的任务取消后不再执行，运行中的训练任务在下一批树训练完成时停止，
+运行中的搜索任务在搜索结束后丢弃结果。搜索排行榜保存在 search_results 表中。
+
+每个任务记录所属进程（主机名、进程号和随机标识），排队时为提交它的进程，开始执行时改为执行它的进程，
+结束状态只由所属进程写入。提交进程和执行任务的进程在任务结束前
+每 TRAINING_HEARTBEAT_INTERVAL 秒刷新任务的心跳时间。进程创建训练进程池时只把心跳超过
+TRAINING_HEARTBEAT_TIMEOUT 秒未刷新、或所属进程在本机已不存在的未完成任务标记为失败，
+多个页面服务进程共用一个数据库时不会中断彼此的任务。被标记为失败的任务在下一次检查取消时停止。
+"""
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from database import use_database, get_database_path, get_db_connection
+from archive import load_training_data
+from model import (
+    fit_calorie_model, extend_calorie_model, publish_model, search_calorie_params,
+    get_latest_model_info, load_model, SEARCH_PARAMS
+)
+from config import (
+    TRAINING_WORKERS, TRAINING_N_JOBS, TRAINING_NICENESS, SEARCH_FOLDS, INCREMENTAL_TREES,
+    TRAINING_HEARTBEAT_INTERVAL, TRAINING_HEARTBEAT_TIMEOUT
+)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+class TrainingCancelled(Exception):
+    """训练任务被取消"""
+
+_executor = None
+_executor_lock = threading.Lock()
+_futures = {}
+
+# 本进程的标识，进程号可能被复用，附加随机部分区分
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# 本进程负责刷新心跳的任务
+_heartbeat_jobs = set()
+_heartbeat_lock = threading.Lock()
+_heartbeat_thread = None
+
+def _lower_priority():
+    """训练进程启动时调低调度优先级"""
+    if TRAINING_NICENESS and hasattr(os, 'nice'):
+        os.nice(TRAINING_NICENESS)
+
+def _heartbeat_loop():
+    """定期刷新本进程未完成任务的心跳时间"""
+    while True:
+        time.sleep(TRAINING_HEARTBEAT_INTERVAL)
+        with _heartbeat_lock:
+            job_ids = list(_heartbeat_jobs)
+        if not job_ids:
+            continue
+        try:
+            with get_db_connection() as conn:
+                conn.execute(f'''
+                    UPDATE training_jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE job_id IN ({", ".join("?" * len(job_ids))}) AND status IN ('queued', 'running')
+                ''', job_ids)
+        except Exception:
+            # 数据库暂时不可用时等下一轮再刷新
+            pass
+
+def _track_job(job_id):
+    """开始为任务刷新心跳"""
+    global _heartbeat_thread
+    with _heartbeat_lock:
+        _heartbeat_jobs.add(job_id)
+        if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name='training-heartbeat', daemon=True)
+            _heartbeat_thread.start()
+
+def _untrack_job(job_id):
+    """停止为任务刷新心跳"""
+    with _heartbeat_lock:
+        _heartbeat_jobs.discard(job_id)
+
+def _owner_gone(owner):
+    """任务所属进程是否已确定不存在，只能判断本机的进程"""
+    if owner is None:
+        # 升级前登记的任务没有所属进程
+        return True
+    if owner == PROCESS_ID or os.name != 'posix':
+        return False
+    host, pid, _ = owner.rsplit(':', 2)
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, ValueError):
+        return False
+    return False
+
+def reclaim_orphaned_jobs():
+    """把所属进程已退出的未完成任务标记为失败，返回这些任务的ID"""
+    cutoff = (
+        datetime.now(timezone.utc) - timedelta(seconds=TRAINING_HEARTBEAT_TIMEOUT)
+    ).strftime('%Y-%m-%d %H:%M:%S')
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT job_id, owner, heartbeat_at FROM training_jobs
+            WHERE status IN ('queued', 'running')
+        ''').fetchall()
+        # 心跳时间为 UTC 的 YYYY-MM-DD HH:MM:SS 文本，可以直接按字符串比较
+        orphaned = [
+            job_id for job_id, owner, heartbeat_at in rows
+            if heartbeat_at is None or str(heartbeat_at) < cutoff or _owner_gone(owner)
+        ]
+        if orphaned:
+            conn.execute(f'''
+                UPDATE training_jobs
+                SET status = 'failed', error = '服务重启，任务中断', finished_at = CURRENT_TIMESTAMP
+                WHERE job_id IN ({", ".join("?" * len(orphaned))}) AND status IN ('queued', 'running')
+            ''', orphaned)
+    return orphaned
+
+def _get_executor():
+    """创建训练进程池，并把所属进程已退出的未完成任务标记为失败"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            reclaim_orphaned_jobs()
+            # 使用 spawn 启动进程，避免复制页面服务进程中的线程和连接
+            _executor = ProcessPoolExecutor(
+                max_workers=TRAINING_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_lower_priority
+            )
+        return _executor
+
+def create_job(fields):
+    """登记任务，返回任务ID；命令行工具登记后直接调用 run_training_job 同步执行"""
+    fields = {**fields, 'owner': PROCESS_ID}
+    with get_db_connection() as conn:
+        return conn.execute(f'''
+            INSERT INTO training_jobs ({", ".join(fields)}, heartbeat_at)
+            VALUES ({", ".join("?" * len(fields))}, CURRENT_TIMESTAMP)
+        ''', tuple(fields.values())).lastrowid
+
+def _submit_job(fields):
+    """登记任务并提交到进程池，返回任务ID"""
+    executor = _get_executor()
+    job_id = create_job(fields)
+    
+    _track_job(job_id)
+    future = executor.submit(run_training_job, job_id, str(get_database_path()))
+    _futures[job_id] = future
+    
+    def done(_):
+        _futures.pop(job_id, None)
+        _untrack_job(job_id)
+    
+    future.add_done_callback(done)
+    return job_id
+
+def submit_training_job(n_estimators, max_depth, min_samples_split, n_jobs=TRAINING_N_JOBS):
+    """提交训练任务，返回任务ID"""
+    return _submit_job({
+        'kind': 'train',
+        'n_estimators': n_estimators,
+        'max_depth': max_depth,
+        'min_samples_split': min_samples_split,
+        'n_jobs': n_jobs
+    })
+
+def submit_incremental_job(trees=INCREMENTAL_TREES, n_jobs=TRAINING_N_JOBS):
+    """提交增量更新任务，用上次训练之后新增的记录为最新模型增加 trees 棵树"""
+    return _submit_job({'kind': 'incremental', 'n_estimators': trees, 'n_jobs': n_jobs})
+
+def submit_search_job(mode, folds=SEARCH_FOLDS, n_jobs=-1):
+    """提交超参数搜索任务，默认使用全部CPU核，返回任务ID"""
+    return _submit_job({'kind': 'search', 'search_mode': mode, 'cv_folds': folds, 'n_jobs': n_jobs})
+
+def cancel_training_job(job_id):
+    """取消训练任务，返回任务是否仍处于可取消的状态"""
+    with get_db_connection() as conn:
+        cancelled = conn.execute('''
+            UPDATE training_jobs
+            SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND status = 'queued'
+        ''', (job_id,)).rowcount
+        requested = conn.execute('''
+            UPDATE training_jobs SET cancel_requested = 1
+            WHERE job_id = ? AND status = 'running'
+        ''', (job_id,)).rowcount
+    
+    future = _futures.get(job_id)
+    if future is not None:
+        future.cancel()
+    return bool(cancelled or requested)
+
+def get_training_jobs(limit=10):
+    """获取最近的训练任务"""
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT * FROM training_jobs
+            ORDER BY job_id DESC
+            LIMIT ?
+        ''', (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+def get_search_results(job_id):
+    """获取搜索任务的排行榜"""
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            'SELECT * FROM search_results WHERE job_id = ? ORDER BY rank', (job_id,)
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+def get_latest_search():
+    """获取最近一次完成的搜索任务，没有时返回 None"""
+    with get_db_connection() as conn:
+        row = conn.execute('''
+            SELECT * FROM training_jobs
+            WHERE kind = 'search' AND status = 'done'
+            ORDER BY job_id DESC
+            LIMIT 1
+        ''').fetchone()
+    return dict(row) if row else None
+
+def promote_search_result(job_id, n_jobs=TRAINING_N_JOBS):
+    """用搜索排行榜第一名的参数提交训练任务，返回训练任务ID"""
+    results = get_search_results(job_id)
+    if not results:
+        raise ValueError(f"搜索任务 #{job_id} 没有结果")
+    best = results[0]
+    return submit_training_job(best['n_estimators'], best['max_depth'], best['min_samples_split'], n_jobs)
+
+def _update_job(job_id, **fields):
+    """更新任务的若干字段"""
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    with get_db_connection() as conn:
+        conn.execute(
+            f'UPDATE training_jobs SET {assignments} WHERE job_id = ?',
+            (*fields.values(), job_id)
+        )
+
+def _finish_job(job_id, status, started, **fields):
+    """记录任务的结束状态和耗时，返回是否写入
+
+    已被标记为失败、或已由其他进程认领执行的任务不再覆盖。
+    """
+    with get_db_connection() as conn:
+        assignments = ''.join(f", {name} = ?" for name in fields)
+        return conn.execute(f'''
+            UPDATE training_jobs
+            SET status = ?, finished_at = CURRENT_TIMESTAMP, seconds = ?{assignments}
+            WHERE job_id = ? AND status = 'running' AND owner = ?
+        ''', (status, time.perf_counter() - started, *fields.values(), job_id, PROCESS_ID)).rowcount == 1
+
+def run_training_job(job_id, database_path):
+    """在训练进程中执行一个任务"""
+    use_database(database_path)
+    
+    with get_db_connection() as conn:
+        # 只有仍在排队且未被取消的任务才会开始执行，认领后所属进程改为本进程
+        claimed = conn.execute('''
+            UPDATE training_jobs
+            SET status = 'running', started_at = CURRENT_TIMESTAMP,
+                owner = ?, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND status = 'queued' AND cancel_requested = 0
+        ''', (PROCESS_ID, job_id)).rowcount
+        if not claimed:
+            return
+        job = dict(conn.execute('SELECT * FROM training_jobs WHERE job_id = ?', (job_id,)).fetchone())
+    
+    started = time.perf_counter()
+    _track_job(job_id)
+    try:
+        if job['kind'] == 'search':
+            _run_search(job, started)
+        elif job['kind'] == 'incremental':
+            _run_incremental(job, started)
+        else:
+            _run_fit(job, started)
+    except TrainingCancelled:
+        _finish_job(job_id, 'cancelled', started)
+    except Exception as e:
+        _finish_job(job_id, 'failed', started, error=str(e))
+    finally:
+        _untrack_job(job_id)
+
+def _cancel_requested(job_id):
+    """任务是否已被请求取消，或已被其他进程当作中断任务标记为失败、认领执行"""
+    with get_db_connection() as conn:
+        cancel_requested, status, owner = conn.execute(
+            'SELECT cancel_requested, status, owner FROM training_jobs WHERE job_id = ?', (job_id,)
+        ).fetchone()
+    return bool(cancel_requested) or status != 'running' or owner != PROCESS_ID
+
+def _run_fit(job, started):
+    """训练并发布模型"""
+    job_id = job['job_id']
+    
+    def report(done, total):
+        _update_job(job_id, progress=done / total)
+        if _cancel_requested(job_id):
+            raise TrainingCancelled()
+    
+    records = load_training_data()
+    _update_job(job_id, training_rows=len(records))
+    model = fit_calorie_model(
+        records, job['n_estimators'], job['max_depth'], job['min_samples_split'],
+        n_jobs=job['n_jobs'], progress=report
+    )
+    if model is None:
+        _finish_job(job_id, 'failed', started, error="数据量不足，无法训练模型")
+        return
+    
+    version = publish_model(
+        model, job['n_estimators'], job['max_depth'], job['min_samples_split'], len(records),
+        record_watermark=int(records['record_id'].max())
+    )
+    _finish_job(job_id, 'done', started, progress=1.0, model_version=version)
+
+def _run_incremental(job, started):
+    """只读取高水位之后的新记录，在最新模型上增加树并发布为新版本"""
+    job_id = job['job_id']
+    
+    def report(done, total):
+        _update_job(job_id, progress=done / total)
+        if _cancel_requested(job_id):
+            raise TrainingCancelled()
+    
+    base = get_latest_model_info()
+    if base is None or base['record_watermark'] is None:
+        raise ValueError("没有可增量更新的模型，请先完整训练一次")
+    
+    records = load_training_data(base['record_watermark'])
+    _update_job(
+        job_id, training_rows=len(records),
+        max_depth=base['max_depth'], min_samples_split=base['min_samples_split']
+    )
+    model = extend_calorie_model(
+        load_model(base), records, job['n_estimators'], n_jobs=job['n_jobs'], progress=report
+    )
+    if model is None:
+        # 新记录太少，沿用当前模型
+        _finish_job(job_id, 'done', started, progress=1.0, model_version=base['id'])
+        return
+    
+    version = publish_model(
+        model, len(model.estimators_), base['max_depth'], base['min_samples_split'],
+        (base['training_rows'] or 0) + len(records),
+        record_watermark=int(records['record_id'].max()),
+        base_version=base['id']
+    )
+    _finish_job(job_id, 'done', started, progress=1.0, model_version=version)
+
+def _run_search(job, started):
+    """运行超参数搜索并保存排行榜"""
+    job_id = job['job_id']
+    records = load_training_data()
+    _update_job(job_id, training_rows=len(records))
+    leaderboard = search_calorie_params(
+        records, job['search_mode'], folds=job['cv_folds'], n_jobs=job['n_jobs']
+    )
+    if leaderboard is None:
+        _finish_job(job_id, 'failed', started, error="数据量不足，无法进行交叉验证")
+        return
+    if _cancel_requested(job_id):
+        raise TrainingCancelled()
+    
+    columns = ['job_id', 'rank', *SEARCH_PARAMS, 'iteration', 'n_samples', 'mae', 'mae_std', 'fit_seconds']
+    with get_db_connection() as conn:
+        conn.executemany(
+            f'INSERT INTO search_results ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+            [
+                (job_id, rank, *(row[name] for name in columns[2:]))
+                for rank, row in enumerate(leaderboard, start=1)
+            ]
+        )
+    _finish_job(job_id, 'done', started, progress=1.0)
@@ -0,0 +1,153 @@
+"""锻炼记录的组提交写入队列
+
+页面提交的记录先放入进程内队列，由独立的写入线程取出。写入线程从取到第一条请求起最多再等待
+WRITE_BATCH_MAX_DELAY_MS 毫秒或攒够 WRITE_BATCH_MAX_ROWS 条记录，把这一批请求在同一个事务中写入，
+多个用户同时提交时只需一次获取写锁和一次提交落盘。每次提交返回一个 Future，事务提交后得到写入的记录数，
+页面等待它完成后再提示成功。批量事务失败时逐个请求单独重试，出错的请求只影响自己的 Future。
+进程退出时写完队列中剩余的记录。
+"""
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from database import get_db_connection, add_exercise_records
+from config import WRITE_BATCH_MAX_ROWS, WRITE_BATCH_MAX_DELAY_MS, WRITE_SHUTDOWN_TIMEOUT
+
+# 队列中的控制项：写完之前的请求后结束写入线程
+_STOP = object()
+
+class RecordWriter:
+    """把排队的锻炼记录分批写入数据库的后台线程"""
+    
+    def __init__(self, max_rows=WRITE_BATCH_MAX_ROWS, max_delay_ms=WRITE_BATCH_MAX_DELAY_MS):
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = 0
+        self._stats = {
+            'requests': 0,
+            'records': 0,
+            'batches': 0,
+            'failed': 0,
+            'max_pending': 0,
+            'wait_seconds': 0.0,
+            'write_seconds': 0.0
+        }
+    
+    def _start(self):
+        """首次提交时启动写入线程"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='record-writer', daemon=True)
+                self._thread.start()
+    
+    def submit(self, records):
+        """把一组记录加入队列，返回在事务提交后得到写入记录数的 Future"""
+        future = Future()
+        with self._lock:
+            self._pending += len(records)
+            self._stats['max_pending'] = max(self._stats['max_pending'], self._pending)
+        self._start()
+        self._queue.put((list(records), future, time.perf_counter()))
+        return future
+    
+    def flush(self, timeout=None):
+        """等待此前提交的记录全部写入"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        marker = Future()
+        self._queue.put(([], marker, time.perf_counter()))
+        marker.result(timeout)
+    
+    def close(self, timeout=WRITE_SHUTDOWN_TIMEOUT):
+        """写完队列中的记录后结束写入线程"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+    
+    def _run(self):
+        """写入线程主循环，收到 _STOP 时写完已收集的请求后退出"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            rows = len(item[0])
+            deadline = time.perf_counter() + self.max_delay
+            # 在等待窗口内继续收集请求，空请求是 flush 的标记，立即写入
+            while rows < self.max_rows and item[0]:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                rows += len(item[0])
+            self._write(batch)
+    
+    def _write(self, batch):
+        """在一个事务中写入一批请求，失败时逐个请求重试"""
+        started = time.perf_counter()
+        requests = [(records, future, enqueued) for records, future, enqueued in batch if records]
+        try:
+            counts = self._insert(requests) if requests else []
+        except Exception:
+            counts = []
+            for request in requests:
+                try:
+                    counts.extend(self._insert([request]))
+                except Exception as e:
+                    counts.append(e)
+        finished = time.perf_counter()
+        
+        with self._lock:
+            for records, _, enqueued in requests:
+                self._pending -= len(records)
+                self._stats['wait_seconds'] += finished - enqueued
+            self._stats['requests'] += len(requests)
+            self._stats['records'] += sum(count for count in counts if isinstance(count, int))
+            self._stats['failed'] += sum(isinstance(count, Exception) for count in counts)
+            self._stats['batches'] += bool(requests)
+            self._stats['write_seconds'] += finished - started
+        
+        for (_, future, _), count in zip(requests, counts):
+            if isinstance(count, Exception):
+                future.set_exception(count)
+            else:
+                future.set_result(count)
+        # flush 标记在之前的请求都写入后完成
+        for records, future, _ in batch:
+            if not records:
+                future.set_result(0)
+    
+    def _insert(self, requests):
+        """写入若干请求并返回各自写入的记录数，所有请求共用一个事务"""
+        with get_db_connection() as conn:
+            # 带导入键的记录可能被去重，需要逐个请求统计写入数
+            if any(record.get('import_key') is not None for records, _, _ in requests for record in records):
+                return [add_exercise_records(records) for records, _, _ in requests]
+            add_exercise_records([record for records, _, _ in requests for record in records])
+            return [len(records) for records, _, _ in requests]
+    
+    def stats(self):
+        """返回吞吐量和队列深度统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = self._pending
+        stats['queued_requests'] = self._queue.qsize()
+        stats['avg_batch_records'] = stats['records'] / stats['batches'] if stats['batches'] else 0.0
+        stats['avg_wait_ms'] = stats['wait_seconds'] / stats['requests'] * 1000 if stats['requests'] else 0.0
+        stats['records_per_sec'] = stats['records'] / stats['write_seconds'] if stats['write_seconds'] else 0.0
+        return stats
+
+record_writer = RecordWriter()
+atexit.register(record_writer.close)